@@ -0,0 +1,178 @@
+'''
+ZiGate adminpanel Tests
+-------------------------
+'''
+
+import unittest
+import json
+import threading
+import time
+from wsgiref.util import setup_testing_defaults
+from zigate import core
+from zigate.adminpanel import events, jobs, start_adminpanel
+
+
+def request(app, path, headers=None):
+    environ = {}
+    setup_testing_defaults(environ)
+    path, _, query = path.partition('?')
+    environ['PATH_INFO'] = path
+    environ['QUERY_STRING'] = query
+    for k, v in (headers or {}).items():
+        environ['HTTP_' + k.upper().replace('-', '_')] = v
+    result = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        result['status'] = int(status.split()[0])
+        result['headers'] = {k.lower(): v for k, v in response_headers}
+    body = b''.join(app(environ, start_response))
+    return result['status'], result['headers'], body
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        self.zigate = core.FakeZiGate(auto_start=False)
+        self.stream = events.EventStream(max_events=2, keepalive=0.01)
+
+    def tearDown(self):
+        self.stream.close()
+
+    def test_filters(self):
+        all_events = self.stream.subscribe()
+        device_1234 = self.stream.subscribe(addrs=['1234'])
+        removed = self.stream.subscribe(events=['device_removed'])
+        device = core.Device({'addr': '1234', 'ieee': '0123456789abcdef'}, self.zigate)
+        device.set_attribute(1, 6, {'attribute': 0, 'lqi': 255, 'data': True})
+        other = core.Device({'addr': '5678', 'ieee': '0123456789abcdee'}, self.zigate)
+        other.set_attribute(1, 6, {'attribute': 0, 'lqi': 255, 'data': True})
+        self.assertEqual(len(all_events.get(0)), 2)
+        messages = device_1234.get(0)
+        self.assertEqual(len(messages), 1)
+        self.assertTrue(messages[0].startswith('id: 1\nevent: attribute\ndata: '))
+        data = json.loads(messages[0].split('data: ')[1])
+        self.assertEqual(data['addr'], '1234')
+        self.assertEqual(data['attribute']['value'], True)
+        self.assertEqual(removed.get(0), [])
+        self.zigate._devices['1234'] = device
+        self.zigate._remove_device('1234')
+        self.assertEqual(removed.get(0), ['id: 3\nevent: device_removed\ndata: {"addr": "1234"}\n\n'])
+
+    def test_bounded_buffer(self):
+        subscriber = self.stream.subscribe()
+        device = core.Device({'addr': '1234', 'ieee': '0123456789abcdef'}, self.zigate)
+        for i in range(3):
+            device.set_attribute(1, 0x0402, {'attribute': 0, 'lqi': 255, 'data': i})
+        messages = subscriber.get(0)
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(messages[0].startswith('id: 2\n'))
+        self.assertEqual(subscriber.dropped, 1)
+
+    def test_stream(self):
+        subscriber = self.stream.subscribe()
+        stream = self.stream.stream(subscriber)
+        self.assertEqual(next(stream), 'retry: 3000\n\n')
+        self.assertEqual(next(stream), ': keepalive\n\n')
+        stream.close()
+        self.assertEqual(self.stream.subscribers, [])
+
+
+class TestAPI(unittest.TestCase):
+    def setUp(self):
+        self.zigate = core.FakeZiGate(auto_start=False)
+        self.app = start_adminpanel(self.zigate, autostart=False)
+        for addr, ieee in (('1234', '0123456789abcdef'), ('5678', '0123456789abcdee')):
+            device = core.Device({'addr': addr, 'ieee': ieee}, self.zigate)
+            device._changed()
+            self.zigate._devices[addr] = device
+        self.version = self.zigate.change_version
+
+    def tearDown(self):
+        self.app.events.close()
+
+    def test_devices_etag(self):
+        status, headers, body = request(self.app, '/api/devices')
+        self.assertEqual(status, 200)
+        data = json.loads(body.decode())
+        self.assertEqual(data['version'], self.version)
+        self.assertEqual([d['info']['addr'] for d in data['devices']][-2:], ['1234', '5678'])
+        etag = headers['etag']
+        status, headers, body = request(self.app, '/api/devices', {'If-None-Match': etag})
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+        self.zigate.get_device_from_addr('5678').set_attribute(1, 6, {'attribute': 0, 'lqi': 255, 'data': True})
+        status, headers, body = request(self.app, '/api/devices', {'If-None-Match': etag})
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers['etag'], etag)
+
+    def test_devices_etag_expired_attribute(self):
+        device = self.zigate.get_device_from_addr('5678')
+        device.set_attribute(1, 0x0005, {'attribute': 0xfff0, 'lqi': 255, 'data': 'scene_1'})
+        etag = request(self.app, '/api/devices')[1]['etag']
+        device._reset_attribute(1, 0x0005, 0xfff0)
+        status, headers, body = request(self.app, '/api/devices', {'If-None-Match': etag})
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers['etag'], etag)
+
+    def test_devices_since(self):
+        self.zigate.get_device_from_addr('5678').set_attribute(1, 6, {'attribute': 0, 'lqi': 255, 'data': True})
+        self.zigate._remove_device('1234')
+        status, headers, body = request(self.app, '/api/devices?since={}'.format(self.version))
+        data = json.loads(body.decode())
+        self.assertEqual(data['version'], self.version + 2)
+        self.assertEqual([d['addr'] for d in data['devices']], ['5678'])
+        self.assertEqual(data['removed'], ['1234'])
+        status, headers, body = request(self.app, '/api/devices?since={}'.format(self.version + 2))
+        self.assertEqual(json.loads(body.decode()), {'version': self.version + 2, 'devices': [], 'removed': []})
+        self.assertEqual(request(self.app, '/api/devices?since=bad')[0], 400)
+
+    def test_network_table_job(self):
+        self.zigate._neighbours_table = lambda: [('0000', '1234', 255)]
+        status, headers, body = request(self.app, '/api/network_table?force=true')
+        self.assertEqual(status, 202)
+        data = json.loads(body.decode())
+        self.assertEqual(data['job']['name'], 'network_table')
+        self.app.jobs.shutdown()
+        status, headers, body = request(self.app, data['status_url'].split('?')[0])
+        job = json.loads(body.decode())
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['result'], [['0000', '1234', 255]])
+        status, headers, body = request(self.app, '/api/network_table')
+        self.assertEqual(json.loads(body.decode()), {'network_table': [['0000', '1234', 255]]})
+        self.assertEqual(request(self.app, '/api/jobs/99')[0], 404)
+
+    def test_refresh_job(self):
+        self.zigate.refresh_device = lambda addr: addr
+        status, headers, body = request(self.app, '/api/refresh/1234')
+        self.assertEqual(status, 202)
+        data = json.loads(body.decode())
+        self.assertEqual(data['job']['name'], 'refresh_1234')
+        self.assertEqual(headers['location'], data['status_url'])
+        self.app.jobs.shutdown()
+        status, headers, body = request(self.app, data['status_url'].split('?')[0])
+        self.assertEqual(json.loads(body.decode())['result'], '1234')
+
+
+class TestJobs(unittest.TestCase):
+    def test_jobs(self):
+        manager = jobs.JobManager(history=1)
+        event = threading.Event()
+        job1 = manager.submit('wait', event.wait, 2)
+        # same active job is not started again
+        self.assertIs(manager.submit('wait', event.wait, 2), job1)
+        job2 = manager.submit('fail', lambda: 1 / 0)
+        event.set()
+        manager.shutdown()
+        self.assertEqual(job1.status, jobs.DONE)
+        self.assertTrue(job1.result)
+        self.assertEqual(job2.status, jobs.FAILED)
+        self.assertEqual(job2.error, 'division by zero')
+        manager = jobs.JobManager(history=1)
+        for i in range(3):
+            manager.submit('job{}'.format(i), time.sleep, 0)
+            time.sleep(0.05)
+        manager.shutdown()
+        self.assertEqual([job.name for job in manager.jobs()], ['job1', 'job2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+'''
+ZiGate benchmark Tests
+-------------------------
+'''
+
+import unittest
+from zigate import benchmark
+from zigate.clusters import CLUSTERS
+from zigate.responses import RESPONSES
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run(self):
+        result = benchmark.run(['framing', 'device', 'state.device_encoder'], min_time=0.001, repeat=1)
+        self.assertIn('framing.read_data_10_frames', result['results'])
+        self.assertIn('framing.decode_data_0x8102', result['results'])
+        self.assertIn('device.set_attribute_quirks', result['results'])
+        self.assertIn('state.device_encoder_100', result['results'])
+        self.assertNotIn('state.save_state_100', result['results'])
+        for r in result['results'].values():
+            self.assertGreater(r['seconds'], 0)
+
+    def test_coverage(self):
+        names = [name for name, func in benchmark.responses()]
+        self.assertEqual(len(names), len(RESPONSES))
+        names = [name for name, func in benchmark.cluster_update()]
+        self.assertEqual(len(names), len(CLUSTERS))
+
+    def test_compare(self):
+        baseline = {'results': {'a': {'seconds': 1.0}, 'b': {'seconds': 1.0}}}
+        result = {'results': {'a': {'seconds': 1.2}, 'b': {'seconds': 1.5}, 'c': {'seconds': 1.0}}}
+        self.assertEqual(benchmark.compare(result, baseline, 0.25), [('b', 1.0, 1.5, 1.5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
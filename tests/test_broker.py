@@ -0,0 +1,177 @@
+'''
+ZiGate broker Tests
+-------------------------
+'''
+
+import unittest
+import os
+import shutil
+import socket
+import tempfile
+import time
+from zigate import core, broker
+
+
+def recv_frame(sock, timeout=2):
+    sock.settimeout(timeout)
+    data = b''
+    while not data.endswith(b'\x03'):
+        data += sock.recv(1024)
+    return data
+
+
+def recv_frames(sock, count, timeout=2):
+    sock.settimeout(timeout)
+    data = b''
+    while data.count(b'\x03') < count:
+        data += sock.recv(1024)
+    return [frame + b'\x03' for frame in data.split(b'\x03')[:-1]]
+
+
+def wait_until(func, timeout=2):
+    end = time.monotonic() + timeout
+    while not func() and time.monotonic() < end:
+        time.sleep(0.01)
+    return func()
+
+
+class TestBroker(unittest.TestCase):
+    def setUp(self):
+        self.zigate = core.FakeZiGate(auto_start=False)
+        self.zigate._start_event_thread()
+        self.zigate.setup_connection()
+        self.test_dir = tempfile.mkdtemp()
+        self.unix_socket = os.path.join(self.test_dir, 'zigate.sock')
+        self.broker = broker.Broker(self.zigate, 0, '127.0.0.1', unix_socket=self.unix_socket)
+        self.port = self.broker.server.getsockname()[1]
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+        self.broker.exit()
+        if self.broker.is_alive():
+            self.broker.join(2)
+        shutil.rmtree(self.test_dir)
+
+    def connect(self, family=socket.AF_INET):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            sock.connect(('127.0.0.1', self.port))
+        else:
+            sock.connect(self.unix_socket)
+        self.sockets.append(sock)
+        return sock
+
+    def test_forward(self):
+        self.broker.start()
+        client1 = self.connect()
+        client2 = self.connect(socket.AF_UNIX)
+        self.assertTrue(wait_until(lambda: len(self.broker.clients) == 2))
+        frame = self.zigate.connection.create_fake_response(0x0010, b'')
+        # frame split in two packets is forwarded once complete
+        client1.sendall(frame[:3])
+        time.sleep(0.05)
+        self.assertEqual(self.zigate.connection.sent, [])
+        client1.sendall(frame[3:])
+        self.assertTrue(wait_until(lambda: len(self.zigate.connection.sent) == 1))
+        self.assertEqual(self.zigate.connection.sent[0], frame)
+        # status and response are received by both clients
+        for client in (client1, client2):
+            decoded = self.zigate.connection.zigate_decode(recv_frame(client)[1:-1])
+            self.assertEqual(decoded[:2], b'\x80\x00')
+        # disconnected client is removed
+        client2.close()
+        self.assertTrue(wait_until(lambda: len(self.broker.clients) == 1))
+
+    def msg_types(self, frames):
+        data = b''.join(frames)
+        types = []
+        for frame in data.split(b'\x03')[:-1]:
+            decoded = self.zigate.connection.zigate_decode(frame[1:])
+            types.append((decoded[:2], decoded[7:9] if decoded[:2] == b'\x80\x00' else None))
+        return sorted(types, key=lambda t: t[0])
+
+    def test_multiplex(self):
+        self.broker.multiplex = True
+        self.broker.start()
+        client1 = self.connect()
+        client2 = self.connect(socket.AF_UNIX)
+        self.assertTrue(wait_until(lambda: len(self.broker.clients) == 2))
+        connection = self.zigate.connection
+        client1.sendall(connection.create_fake_response(0x0010, b''))
+        client2.sendall(connection.create_fake_response(0x0009, b''))
+        self.assertEqual(self.msg_types(recv_frames(client1, 2)),
+                         [(b'\x80\x00', b'\x00\x10'), (b'\x80\x10', None)])
+        self.assertEqual(self.msg_types(recv_frames(client2, 2)),
+                         [(b'\x80\x00', b'\x00\x09'), (b'\x80\x09', None)])
+        self.assertEqual(self.broker._inflight, [])
+        # unsolicited report is broadcasted
+        connection.received.put(connection.create_fake_response(0x8102, b'\x01\xab\xcd'))
+        for client in (client1, client2):
+            self.assertEqual(self.msg_types([recv_frame(client)]), [(b'\x81\x02', None)])
+
+    def test_route_sequence(self):
+        self.broker.multiplex = True
+        client1 = broker.Client('sock1', ('client1', 0))
+        client2 = broker.Client('sock2', ('client2', 0))
+        self.broker.clients = {'sock1': client1, 'sock2': client2}
+        connection = self.zigate.connection
+        self.broker._inflight = [broker.Command(client1, 0x0100), broker.Command(client2, 0x0100),
+                                 broker.Command(client1, 0x0092)]
+        self.assertIsNone(self.broker._inflight[2].response)
+        status = connection.create_fake_response(0x8000, b'\x00\x05\x01\x00')
+        self.assertEqual(self.broker._route(status), [client1])
+        status = connection.create_fake_response(0x8000, b'\x00\x06\x01\x00')
+        self.assertEqual(self.broker._route(status), [client2])
+        # command without response is done on status
+        status = connection.create_fake_response(0x8000, b'\x00\x07\x00\x92')
+        self.assertEqual(self.broker._route(status), [client1])
+        self.assertEqual(len(self.broker._inflight), 2)
+        # responses are matched on sequence, not on order
+        response = connection.create_fake_response(0x8100, b'\x06\x12\x34\x01\x00\x06\x00\x00\x00\x10\x00\x01\x01')
+        self.assertEqual(self.broker._route(response), [client2])
+        # response of unknown sequence is broadcasted
+        response = connection.create_fake_response(0x8100, b'\x09\x12\x34\x01\x00\x06\x00\x00\x00\x10\x00\x01\x01')
+        self.assertEqual(self.broker._route(response), [client1, client2])
+        response = connection.create_fake_response(0x8100, b'\x05\x12\x34\x01\x00\x06\x00\x00\x00\x10\x00\x01\x01')
+        self.assertEqual(self.broker._route(response), [client1])
+        self.assertEqual(self.broker._inflight, [])
+
+    def test_slow_client(self):
+        self.broker.max_buffer = 100
+        client = broker.Client(None, ('test', 0))
+        self.broker.clients['test'] = client
+        frame = b'\x01' + b'\x00' * 38 + b'\x03'
+        for i in range(3):
+            self.broker.forward_msg(frame)
+        self.assertEqual(len(client.output), 80)
+        self.assertEqual(client.dropped, 1)
+        self.broker.policy = broker.POLICY_DISCONNECT
+        self.broker.forward_msg(frame)
+        self.assertTrue(client.closing)
+
+    def test_partial_write(self):
+        class Socket(object):
+            sent = []
+
+            def send(self, data):
+                self.sent.append(bytes(data[:10]))
+                return len(self.sent[-1])
+        client = broker.Client(Socket(), ('test', 0))
+        client.output += bytes(range(15))
+        self.broker._write(client)
+        self.assertEqual(client.output, bytes(range(10, 15)))
+        self.broker._write(client)
+        self.assertEqual(client.output, b'')
+        self.assertEqual(b''.join(client.sock.sent), bytes(range(15)))
+
+    def test_split_frames(self):
+        client = broker.Client(None, ('test', 0))
+        self.assertEqual(client.split_frames(b'\x01\x00'), [])
+        self.assertEqual(client.split_frames(b'\x03\x01\x05\x03\x01'), [b'\x01\x00\x03', b'\x01\x05\x03'])
+        self.assertEqual(client.input, b'\x01')
+
+
+if __name__ == '__main__':
+    unittest.main()
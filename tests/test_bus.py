@@ -0,0 +1,177 @@
+'''
+ZiGate signal bus Tests
+-------------------------
+'''
+
+import unittest
+import threading
+import time
+from zigate import core, bus, metrics
+from zigate.const import (ZIGATE_ATTRIBUTE_ADDED, ZIGATE_ATTRIBUTE_UPDATED, ZIGATE_DEVICE_REMOVED,
+                          ZIGATE_RESPONSE_RECEIVED)
+
+
+class TestBus(unittest.TestCase):
+    def setUp(self):
+        self.bus = bus.SignalBus()
+        self.zigate = core.FakeZiGate(auto_start=False, path=None)
+        self.device = self.zigate.get_device_from_addr('abcd')
+
+    def tearDown(self):
+        bus.BUS.clear()
+
+    def attribute(self, **kwargs):
+        attribute = {'endpoint': 1, 'cluster': 0x0402, 'attribute': 0, 'name': 'temperature', 'value': 21.5}
+        attribute.update(kwargs)
+        return attribute
+
+    def test_filters(self):
+        received = []
+
+        def callback(device, attribute):
+            received.append(attribute['name'])
+        self.bus.subscribe(callback, ZIGATE_ATTRIBUTE_UPDATED, name='temperature', addr='abcd')
+        self.bus.subscribe(callback, ZIGATE_ATTRIBUTE_UPDATED, cluster=0x0405)
+        self.bus.subscribe(callback, ZIGATE_ATTRIBUTE_UPDATED, endpoint=2, ieee='0123456789abcdef')
+        self.assertTrue(self.bus.listening(ZIGATE_ATTRIBUTE_UPDATED))
+        self.assertFalse(self.bus.listening(ZIGATE_ATTRIBUTE_ADDED))
+        named = {'zigate': self.zigate, 'device': self.device}
+        self.assertEqual(self.bus.publish(ZIGATE_ATTRIBUTE_UPDATED, self.zigate,
+                                          attribute=self.attribute(), **named), 1)
+        self.assertEqual(self.bus.publish(ZIGATE_ATTRIBUTE_UPDATED, self.zigate,
+                                          attribute=self.attribute(name='humidity', cluster=0x0405), **named), 1)
+        self.assertEqual(self.bus.publish(ZIGATE_ATTRIBUTE_UPDATED, self.zigate,
+                                          attribute=self.attribute(name='onoff', cluster=6), **named), 0)
+        self.assertEqual(self.bus.publish(ZIGATE_ATTRIBUTE_UPDATED, self.zigate,
+                                          attribute=self.attribute(name='onoff', endpoint=2), **named), 1)
+        self.assertEqual(self.bus.publish(ZIGATE_ATTRIBUTE_ADDED, self.zigate,
+                                          attribute=self.attribute(), **named), 0)
+        self.assertEqual(received, ['temperature', 'humidity', 'onoff'])
+        self.bus.unsubscribe(callback)
+        self.assertEqual(self.bus.subscriptions, [])
+        self.assertRaises(TypeError, self.bus.subscribe, callback, unknown=1)
+
+    def test_arguments(self):
+        received = []
+
+        def callback(**kwargs):
+            received.append(kwargs)
+
+        def failing(signal):
+            raise Exception('failing subscriber')
+        self.bus.subscribe(callback)
+        subscription = self.bus.subscribe(failing)
+        self.assertEqual(self.bus.publish(ZIGATE_DEVICE_REMOVED, self.zigate, addr='abcd'), 2)
+        self.assertEqual(received, [{'signal': ZIGATE_DEVICE_REMOVED, 'sender': self.zigate, 'addr': 'abcd'}])
+        self.assertEqual(subscription.errors, 1)
+
+    def test_zigate(self):
+        received = []
+
+        def callback(signal, attribute):
+            received.append((signal, attribute['name'], attribute['value']))
+        other = core.FakeZiGate(auto_start=False, path=None)
+        self.zigate.subscribe(callback, ZIGATE_ATTRIBUTE_UPDATED, name='temperature')
+        self.device.set_attribute(1, 0x0402, {'attribute': 0, 'data': 2150})
+        self.device.set_attribute(1, 0x0405, {'attribute': 0, 'data': 5000})
+        other.get_device_from_addr('abcd').set_attribute(1, 0x0402, {'attribute': 0, 'data': 2200})
+        self.assertEqual(received, [(ZIGATE_ATTRIBUTE_UPDATED, 'temperature', 21.5)])
+        self.zigate.unsubscribe(callback)
+        self.assertFalse(core.has_receivers(ZIGATE_ATTRIBUTE_UPDATED, self.zigate))
+
+    def test_response_ieee(self):
+        received = []
+
+        def callback(response):
+            received.append(response['addr'])
+        self.device.info['ieee'] = '0123456789abcdef'
+        self.zigate.subscribe(callback, ZIGATE_RESPONSE_RECEIVED, ieee='0123456789abcdef')
+        core.dispatch_signal(ZIGATE_RESPONSE_RECEIVED, self.zigate, response={'addr': 'abcd', 'status': 0})
+        core.dispatch_signal(ZIGATE_RESPONSE_RECEIVED, self.zigate, response={'addr': '1234', 'status': 0})
+        self.assertEqual(received, ['abcd'])
+
+    def publish(self, count, cluster=0x0402):
+        for i in range(count):
+            self.bus.publish(ZIGATE_ATTRIBUTE_UPDATED, self.zigate, device=self.device,
+                             attribute=self.attribute(value=i, cluster=cluster))
+
+    def test_asynchronous(self):
+        received = []
+        release = threading.Event()
+
+        def callback(attribute):
+            release.wait(5)
+            received.append(attribute['value'])
+        subscription = self.bus.subscribe(callback, ZIGATE_ATTRIBUTE_UPDATED, asynchronous=True,
+                                          max_queue=3, name='test_drop')
+        self.publish(10)
+        release.set()
+        self.assertTrue(subscription.flush(5))
+        # first signal taken by the delivery thread before the queue overflowed
+        self.assertEqual(received[-3:], [7, 8, 9])
+        self.assertEqual(subscription.dropped + len(received), 10)
+        self.assertGreater(subscription.max_lag, 0)
+        self.assertEqual(metrics.SUBSCRIBER_DROPPED.labels('test_drop', 'overflow').value, subscription.dropped)
+        self.bus.unsubscribe(subscription)
+        self.assertEqual(subscription.pending, 0)
+        self.assertEqual(self.bus.publish(ZIGATE_ATTRIBUTE_UPDATED, self.zigate), 0)
+        self.assertRaises(ValueError, self.bus.subscribe, callback, asynchronous=True, overflow='unknown')
+
+    def test_subscription_names(self):
+        def callback(signal):
+            pass
+        subscriptions = [self.bus.subscribe(callback, asynchronous=True) for i in range(2)]
+        self.assertNotEqual(subscriptions[0].name, subscriptions[1].name)
+        self.assertTrue(subscriptions[0].name.startswith(callback.__qualname__))
+        # closing one subscription keeps the queue gauge of the other
+        self.bus.unsubscribe(subscriptions[0])
+        self.assertIsNotNone(metrics.SUBSCRIBER_QUEUE.labels(subscriptions[1].name).function)
+        self.bus.unsubscribe(subscriptions[1])
+        self.assertIsNone(metrics.SUBSCRIBER_QUEUE.labels(subscriptions[1].name).function)
+
+    def test_coalesce(self):
+        received = []
+        release = threading.Event()
+
+        def callback(signal, attribute=None):
+            release.wait(5)
+            received.append((attribute['cluster'], attribute['value']) if attribute else signal)
+        subscription = self.bus.subscribe(callback, asynchronous=True, overflow=bus.COALESCE, max_queue=3)
+        self.publish(1, 0x0001)
+        self.assertTrue(self.wait(lambda: subscription.pending == 0))
+        # queued until full, then latest pending signal of the attribute is replaced
+        self.publish(5)
+        self.assertEqual(subscription.pending, 3)
+        self.assertEqual(subscription.coalesced, 2)
+        # no pending signal of the attribute, oldest is dropped
+        self.publish(5, 0x0405)
+        self.assertEqual((subscription.coalesced, subscription.dropped), (6, 1))
+        # signal not about an attribute is never coalesced
+        self.bus.publish(ZIGATE_DEVICE_REMOVED, self.zigate, addr='abcd')
+        self.assertEqual((subscription.coalesced, subscription.dropped), (6, 2))
+        release.set()
+        self.assertTrue(subscription.flush(5))
+        self.assertEqual(received, [(0x0001, 0), (0x0402, 4), (0x0405, 4), ZIGATE_DEVICE_REMOVED])
+        self.bus.clear()
+
+    def test_block(self):
+        received = []
+
+        def callback(attribute):
+            received.append(attribute['value'])
+        subscription = self.bus.subscribe(callback, asynchronous=True, overflow=bus.BLOCK, max_queue=1)
+        self.publish(50)
+        self.assertTrue(subscription.flush(5))
+        self.assertEqual(received, list(range(50)))
+        self.assertEqual(subscription.dropped, 0)
+        self.bus.clear()
+
+    def wait(self, condition, timeout=5):
+        start = time.monotonic()
+        while not condition() and time.monotonic() - start < timeout:
+            time.sleep(0.01)
+        return condition()
+
+
+if __name__ == '__main__':
+    unittest.main()
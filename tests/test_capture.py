@@ -0,0 +1,111 @@
+'''
+ZiGate capture Tests
+-------------------------
+'''
+
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from binascii import unhexlify
+from zigate import core, capture, transport
+
+
+class TestCapture(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.test_dir, 'test.zcap')
+        self.frame = transport.FakeTransport().create_fake_response(0x8102,
+                                                                    unhexlify(b'01abcd01040200000029000208fc'))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_round_trip(self):
+        writer = capture.CaptureWriter(self.path)
+        writer.write(capture.IN, self.frame, 1.0)
+        writer.write(capture.OUT, b'\x01\x00\x10\x03', 1.5)
+        writer.close()
+        records = list(capture.read_capture(self.path))
+        self.assertEqual(records, [(1.0, capture.IN, self.frame), (1.5, capture.OUT, b'\x01\x00\x10\x03')])
+        # truncated last record is ignored
+        with open(self.path, 'ab') as fp:
+            fp.write(capture.RECORD.pack(2.0, capture.IN, 20) + b'\x01')
+        self.assertEqual(len(list(capture.read_capture(self.path))), 2)
+        with open(self.path, 'wb') as fp:
+            fp.write(b'bad header file content')
+        self.assertRaises(capture.CaptureError, list, capture.read_capture(self.path))
+
+    def test_rotation(self):
+        size = capture.HEADER.size + 3 * (capture.RECORD.size + len(self.frame))
+        writer = capture.CaptureWriter(self.path, max_bytes=size, backup_count=2)
+        for i in range(10):
+            writer.write(capture.IN, self.frame, float(i))
+        writer.close()
+        self.assertEqual(capture.capture_files(self.path), [self.path + '.2', self.path + '.1', self.path])
+        self.assertFalse(os.path.exists(self.path + '.3'))
+        timestamps = [r[0] for r in capture.read_captures(self.path)]
+        self.assertEqual(timestamps, [float(i) for i in range(3, 10)])
+        self.assertEqual(len(list(capture.read_captures(self.path, rotated=False))), 1)
+
+    def test_new_run(self):
+        writer = capture.CaptureWriter(self.path)
+        writer.write(capture.IN, self.frame, 100.0)
+        writer.write(capture.IN, self.frame, 101.0)
+        writer.close()
+        # capture of previous run is rotated, timestamps of new run follow it
+        writer = capture.CaptureWriter(self.path)
+        writer.write(capture.IN, self.frame, 5.0)
+        writer.write(capture.IN, self.frame, 5.5)
+        writer.close()
+        self.assertEqual(capture.capture_files(self.path), [self.path + '.1', self.path])
+        self.assertEqual([r[0] for r in capture.read_captures(self.path)], [100.0, 101.0, 101.0, 101.5])
+
+    def test_timed_flush(self):
+        writer = capture.CaptureWriter(self.path, flush_interval=0.05)
+        writer.write(capture.IN, self.frame, 1.0)
+        for i in range(40):
+            if os.path.getsize(self.path) == capture.HEADER.size + capture.RECORD.size + len(self.frame):
+                break
+            time.sleep(0.05)
+        self.assertEqual(list(capture.read_capture(self.path)), [(1.0, capture.IN, self.frame)])
+        writer.close()
+
+    def test_capture_and_replay(self):
+        zigate = core.FakeZiGate(auto_start=False, path=None)
+        zigate.connection = transport.FakeTransport()
+        zigate._start_event_thread()
+        zigate.start_capture(self.path)
+        version = zigate.get_version()
+        self.assertIsNotNone(version)
+        zigate.stop_capture()
+        zigate.close()
+        directions = [r[1] for r in capture.read_capture(self.path)]
+        self.assertEqual(directions, [capture.OUT, capture.IN, capture.IN])
+
+        zigate = core.FakeZiGate(auto_start=False, path=None)
+        zigate.connection = transport.ReplayTransport(self.path, speed=0)
+        zigate._start_event_thread()
+        self.assertTrue(zigate.connection.wait(5))
+        self.assertEqual(zigate.connection.replayed, 2)
+        start = time.monotonic()
+        while 0x8010 not in zigate._last_response and time.monotonic() - start < 5:
+            time.sleep(0.01)
+        self.assertEqual(zigate._last_response[0x8010].data, version)
+        zigate.send_data(0x0010, wait_status=False)
+        self.assertEqual(len(zigate.connection.sent), 1)
+        zigate.close()
+
+    def test_decode_throughput(self):
+        writer = capture.CaptureWriter(self.path)
+        for i in range(5):
+            writer.write(capture.IN, self.frame)
+        writer.write(capture.OUT, b'\x01\x00\x10\x03')
+        writer.close()
+        result = capture.decode_throughput(self.path)
+        self.assertEqual(result['frames'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
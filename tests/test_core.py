@@ -11,6 +11,7 @@ import datetime
 from zigate import responses, transport, core, clusters
 from binascii import hexlify, unhexlify
 import time
+import struct
 
 
 class TestCore(unittest.TestCase):
@@ -556,6 +557,119 @@ class TestCore(unittest.TestCase):
         self.assertDictEqual(self.zigate.groups,
                              {'3456': {('1234', 1)}})
 
+    def test_decode_frame(self):
+        data = bytes(range(256))
+        self.assertEqual(self.zigate.zigate_decode(self.zigate.zigate_encode(data)), data)
+        msg = self.zigate.connection.create_fake_response(0x8102, unhexlify(b'01abcd010006000000100001') + b'\x01',
+                                                          200)
+        self.assertIn(b'\x02', msg[1:-1])
+        self.zigate._decode_data(msg, time.monotonic())
+        response = self.zigate._last_response[0x8102]
+        self.assertEqual(response['addr'], 'abcd')
+        self.assertEqual(response['lqi'], 200)
+        self.assertEqual(response['data'], True)
+
+    def test_register_handler(self):
+        received = []
+
+        @core.register_handler(0x8888, 0x8000)
+        def failing_handler(zigate, response):
+            raise Exception('failing handler')
+
+        @core.register_handler(0x8888, exclusive=True)
+        def handler(zigate, response):
+            received.append((zigate, response.msg))
+        try:
+            self.assertEqual([h[0] for h in core.HANDLERS[0x8888]], [failing_handler, handler])
+            self.zigate.interpret_response(responses.Response(b'', 255))
+            self.assertEqual(received, [])
+            r = responses.Response(b'', 255)
+            r.msg = 0x8888
+            self.zigate.interpret_response(r)
+            # failing handler doesn't prevent next handler
+            self.assertEqual(received, [(self.zigate, 0x8888)])
+            # failing handler doesn't prevent builtin handler
+            self.zigate.interpret_response(responses.R8000(b'\x00\x01\x88\x88', 255))
+            self.assertIn(0x8888, self.zigate._last_status)
+        finally:
+            core.unregister_handler(handler)
+            core.unregister_handler(failing_handler)
+        self.assertNotIn(0x8888, core.HANDLERS)
+        self.assertEqual([h[0] for h in core.HANDLERS[0x8000]], [core.ZiGate._handle_status])
+
+    def test_override_handler(self):
+        received = []
+
+        class MyZiGate(core.FakeZiGate):
+            def _handle_status(self, response):
+                received.append(response['packet_type'])
+                core.FakeZiGate._handle_status(self, response)
+        zigate = MyZiGate(auto_start=False)
+        zigate.interpret_response(responses.R8000(b'\x00\x01\x88\x88', 255))
+        self.assertEqual(received, [0x8888])
+        self.assertIn(0x8888, zigate._last_status)
+
+    def test_change_filter(self):
+        received = []
+
+        def callback(attribute):
+            received.append((attribute['name'], attribute['value']))
+        self.zigate.subscribe(callback, core.ZIGATE_ATTRIBUTE_UPDATED)
+        self.zigate.set_change_filter('temperature', core.CHANGE_ABSOLUTE, 0.1)
+        self.zigate.set_change_filter('humidity', core.CHANGE_RELATIVE, 0.1)
+        self.zigate.set_change_filter(None)
+        device = self.zigate.get_device_from_addr('abcd')
+        try:
+            device.set_attribute(1, 0x0402, {'attribute': 0, 'data': 2000})
+            device.set_attribute(1, 0x0402, {'attribute': 0, 'data': 2005})
+            # compared to last signaled value, no drift
+            device.set_attribute(1, 0x0402, {'attribute': 0, 'data': 2009})
+            self.assertEqual(device.get_property_value('temperature'), 20.09)
+            device.set_attribute(1, 0x0402, {'attribute': 0, 'data': 2012})
+            device.set_attribute(1, 0x0405, {'attribute': 0, 'data': 5000})
+            device.set_attribute(1, 0x0405, {'attribute': 0, 'data': 5400})
+            device.set_attribute(1, 0x0405, {'attribute': 0, 'data': 5500})
+            device.set_attribute(1, 0x0006, {'attribute': 0, 'data': True})
+            device.info['last_seen'] = None
+            device.set_attribute(1, 0x0006, {'attribute': 0, 'data': True, 'lqi': 100})
+            self.assertIsNotNone(device.last_seen)
+            self.assertEqual(device.lqi, 100)
+            device.set_attribute(1, 0x0006, {'attribute': 0, 'data': False})
+            self.assertEqual(received, [('temperature', 20.0), ('temperature', 20.12),
+                                        ('humidity', 50.0), ('humidity', 55.0), ('onoff', False)])
+            self.assertFalse(core.value_changed((core.CHANGE_RELATIVE, 0.1), 50, 54.9))
+            self.assertTrue(core.value_changed((core.CHANGE_ABSOLUTE, 1), 'a', 'b'))
+            # deadband doesn't apply to bool
+            self.assertTrue(core.value_changed((core.CHANGE_ABSOLUTE, 5), False, True))
+            self.zigate.set_change_filter(None, core.CHANGE_ABSOLUTE, 5)
+            device.set_attribute(1, 0x0006, {'attribute': 0, 'data': True})
+            self.assertEqual(received[-1], ('onoff', True))
+            # renamed property
+            device.set_attribute(2, 0x0006, {'attribute': 0, 'data': True})
+            self.assertEqual(device.get_attribute(2, 0x0006, 0)['name'], 'onoff2')
+            self.zigate.set_change_filter('onoff2', core.CHANGE_RELATIVE, 1)
+            cluster = device.get_cluster(2, 0x0006)
+            self.assertEqual(self.zigate._get_change_filter(cluster, 0), (core.CHANGE_RELATIVE, 1))
+            self.zigate.remove_change_filter('onoff2')
+            self.zigate.set_change_filter(None)
+
+            updated = []
+
+            def device_updated(device):
+                updated.append(device)
+            self.zigate.subscribe(device_updated, core.ZIGATE_DEVICE_UPDATED)
+            self.zigate._handle_device_list(responses.R8015(unhexlify(b'01abcd0123456789abcdef00bb'), 255))
+            self.assertEqual(updated, [])
+            self.assertEqual(device.lqi, 0xbb)
+            self.zigate._handle_device_list(responses.R8015(unhexlify(b'01abcd0123456789abcdef01bb'), 255))
+            self.assertEqual(updated, [device])  # power_type changed
+            self.zigate.unsubscribe(device_updated)
+            self.zigate.remove_change_filter()
+            self.assertNotIn(None, self.zigate.get_change_filters())
+            self.assertRaises(ValueError, self.zigate.set_change_filter, 'temperature', 'unknown')
+        finally:
+            self.zigate.unsubscribe(callback)
+
     def test_groups(self):
         self.zigate.add_group('1234', 1, '4567')
         self.assertDictEqual(self.zigate.groups,
@@ -610,6 +724,175 @@ class TestCore(unittest.TestCase):
         self.assertEqual(hexlify(self.zigate.connection.get_last_cmd()),
                          b'0212340103030000000000020020000000010e100000000020000100010e10000000'
                          )
+        self.zigate.reporting_request('1234', 1, 0x0402, [(0x0000, 0x29, 50)], min_interval=30)
+        self.assertEqual(hexlify(self.zigate.connection.get_last_cmd()),
+                         b'02123401010402000000000100290000001e0e1000000032'
+                         )
+
+    def test_encode_reportable_change(self):
+        self.assertEqual(core.encode_reportable_change(0x10, 1), b'\x00')
+        self.assertEqual(core.encode_reportable_change(0x20, 3), b'\x03')
+        self.assertEqual(core.encode_reportable_change(0x21, 100), b'\x00\x64')
+        self.assertEqual(core.encode_reportable_change(0x25, 10), b'\x00\x00\x00\x00\x00\x0a')
+        self.assertEqual(core.encode_reportable_change(0x29, -1), b'\xff\xff')
+        self.assertEqual(core.encode_reportable_change(0x39, 0.5), struct.pack('!f', 0.5))
+        self.assertEqual(core.encode_reportable_change(0x38, 1), b'\x3c\x00')
+        self.assertEqual(core.encode_reportable_change(0x38, -0.5), b'\xb8\x00')
+        self.assertEqual(core.encode_reportable_change(0x38, 65504), b'\x7b\xff')
+        self.assertEqual(core.encode_reportable_change(0x38, 1e6), b'\x7c\x00')
+        self.assertEqual(core.encode_reportable_change(0x38, 2 ** -24), b'\x00\x01')
+        for data_type, change in ((0x20, 3), (0x29, -1), (0x25, 10), (0x38, -0.5), (0x38, 2 ** -24), (0x39, 0.5)):
+            self.assertEqual(responses.decode_reportable_change(data_type,
+                                                                core.encode_reportable_change(data_type, change)),
+                             change)
+
+    def test_reporting_profile(self):
+        device = core.Device({'addr': '1234', 'ieee': '0123456789abcdef'})
+        self.assertEqual(device.get_reporting_profile(0x0006, 0x0000), (1, 3600, 0))
+        self.assertEqual(device.get_reporting_profile(0x0402, 0x0000), (30, 3600, 10))
+        device.set_reporting_profile(0x0402, min_interval=60, max_interval=1800, change=50)
+        self.assertEqual(device.get_reporting_profile(0x0402, 0x0000), (60, 1800, 50))
+        device.set_reporting_profile(0x0402, 0x0000, change=20)
+        self.assertEqual(device.get_reporting_profile(0x0402, 0x0000), (60, 1800, 20))
+        self.assertEqual(device.info['reporting'][-1], {'cluster': 0x0402, 'attribute': 0x0000, 'change': 20})
+        device.set_reporting_profile(0x0402, 0x0000, change=25)
+        self.assertEqual(len(device.info['reporting']), 2)
+        # template like
+        device = core.Device({'addr': '1234', 'ieee': '0123456789abcdef',
+                              'reporting': [{'cluster': 0x0405, 'change': 200}]})
+        self.assertEqual(device.get_reporting_profile(0x0405, 0x0000), (30, 3600, 200))
+        device.endpoints[1] = {'device': 0x0302, 'profile': 0x0104, 'in_clusters': [0x0402, 0x0405],
+                               'out_clusters': [], 'clusters': {}}
+        self.assertEqual(device._bind_report_plan(),
+                         [('1234', 1, 0x0402, [(0x0000, 0x29, 30, 3600, 10)]),
+                          ('1234', 1, 0x0405, [(0x0000, 0x21, 30, 3600, 200)])])
+
+    def _answer_bind_report(self, max_interval=3600, change=None):
+        '''
+        fake device answering bind, configure reporting and read reporting configuration
+        '''
+        connection = self.zigate.connection
+        send = connection.send
+
+        def fake_send(data):
+            send(data)
+            data = connection.zigate_decode(data[1:-1])
+            cmd = struct.unpack('!H', data[:2])[0]
+            if cmd == 0x0030:
+                value = struct.pack('!BBBH', connection.sequence, 0, 2, 0x1234)
+                connection.received.put(connection.create_fake_response(0x8030, value))
+            elif cmd == 0x0120:
+                cluster, attribute = struct.unpack('!H7xH', data[10:21])
+                status = 0x8c if cluster == 6 else 0
+                value = struct.pack('!BHBHHB', connection.sequence, 0x1234, 1, cluster, attribute, status)
+                connection.received.put(connection.create_fake_response(0x8120, value))
+            elif cmd == 0x0122:
+                cluster, attribute = struct.unpack('!H6xH', data[10:20])
+                value = struct.pack('!BHBHBBHHH', connection.sequence, 0x1234, 1, cluster, 0, 0x20, attribute,
+                                    1, max_interval)
+                if change is not None:
+                    value += struct.pack('!B', change)
+                connection.received.put(connection.create_fake_response(0x8122, value))
+        connection.send = fake_send
+
+    def test_bind_report_bulk(self):
+        device = core.Device({'addr': '1234', 'ieee': '0123456789abcdef'}, self.zigate)
+        self.zigate._devices['1234'] = device
+        connection = self.zigate.connection
+        self._answer_bind_report()
+        result = self.zigate.bind_report_bulk([('1234', 1, 0x0006, [(0x0000, 0x10)]),
+                                               ('1234', 1, 0x0008, [(0x0000, 0x20), (0x0011, 0x20, 5, 600)]),
+                                               ('5678', 1, 0x0006, [(0x0000, 0x10)])],
+                                              max_pending=2)
+        self.assertEqual(result,
+                         [{'addr': '1234', 'endpoint': 1, 'cluster': 0x0006,
+                           'bind': 0, 'report': {0x0000: 0x8c}},
+                          {'addr': '1234', 'endpoint': 1, 'cluster': 0x0008,
+                           'bind': 0, 'report': {0x0000: 0, 0x0011: 0}},
+                          {'addr': '5678', 'endpoint': 1, 'cluster': 0x0006,
+                           'bind': None, 'report': {}}])
+        self.assertTrue(device.assumed_state)
+        self.assertEqual(hexlify(connection.get_last_cmd()),
+                         b'0212340101000800000000010020001100050258000000')
+        # binds are limited to max_pending in flight too
+        in_flight = []
+        add_pending = self.zigate._add_pending
+
+        def _add_pending(pending, *args):
+            add_pending(pending, *args)
+            in_flight.append(len(pending))
+        self.zigate._add_pending = _add_pending
+        result = self.zigate.bind_report_bulk([('1234', 1, cluster, []) for cluster in range(5)], max_pending=2)
+        self.assertEqual([r['bind'] for r in result], [0] * 5)
+        self.assertEqual(max(in_flight), 2)
+
+    def test_reporting_ledger(self):
+        device = core.Device({'addr': '1234', 'ieee': '0123456789abcdef'}, self.zigate)
+        device.endpoints[1] = {'device': 0x0100, 'profile': 0x0104, 'in_clusters': [0x0006, 0x0008],
+                               'out_clusters': [], 'clusters': {}}
+        self.zigate._devices['1234'] = device
+        connection = self.zigate.connection
+        self._answer_bind_report()
+        device._bind_report()
+        self.assertEqual(len(connection.sent), 4)
+        self.assertEqual(self.zigate.get_reporting_ledger('1234'),
+                         {'bind': {(1, 0x0006), (1, 0x0008)},
+                          'report': {(1, 0x0008, 0x0000): (1, 3600, 3)},
+                          'unsupported': {(1, 0x0006, 0x0000): 0x8c}})
+        # already configured or unreportable, nothing is sent
+        connection.sent = []
+        device._bind_report()
+        self.assertEqual(len(connection.sent), 0)
+        result = self.zigate.bind_report_bulk([('1234', 1, 0x0006, [(0x0000, 0x10)])])
+        self.assertEqual(result[0]['report'], {0x0000: 0x8c})
+        self.assertEqual(len(connection.sent), 1)  # only bind
+        self.assertEqual(hexlify(connection.get_last_cmd()),
+                         b'0123456789abcdef01000603fedcba987654321001')
+
+        path = os.path.join(self.test_dir, 'test_zigate.json')
+        self.zigate.save_state(path)
+        self.zigate.clear_reporting_ledger()
+        self.assertIsNone(self.zigate._reporting_ledger.get('0123456789abcdef'))
+        self.zigate.load_state(path)
+        self.assertEqual(self.zigate.get_reporting_ledger('1234'),
+                         {'bind': {(1, 0x0006), (1, 0x0008)},
+                          'report': {(1, 0x0008, 0x0000): (1, 3600, 3)},
+                          'unsupported': {(1, 0x0006, 0x0000): 0x8c}})
+
+        # device doesn't report as configured anymore
+        self._answer_bind_report(max_interval=300)
+        connection.sent = []
+        self.zigate.verify_reporting('1234')
+        # read configuration, bind and report again on 0x0008
+        self.assertEqual(len(connection.sent), 3)
+        self.assertEqual(hexlify(connection.get_last_cmd()),
+                         b'0212340101000800000000010020000000010e10000003')
+        self.assertEqual(self.zigate.get_reporting_ledger('1234'),
+                         {'bind': {(1, 0x0006), (1, 0x0008)},
+                          'report': {(1, 0x0008, 0x0000): (1, 3600, 3)},
+                          'unsupported': {(1, 0x0006, 0x0000): 0x8c}})
+
+    def test_verify_reporting_change(self):
+        device = core.Device({'addr': '1234', 'ieee': '0123456789abcdef'}, self.zigate)
+        device.endpoints[1] = {'device': 0x0100, 'profile': 0x0104, 'in_clusters': [0x0008],
+                               'out_clusters': [], 'clusters': {}}
+        self.zigate._devices['1234'] = device
+        connection = self.zigate.connection
+        send = connection.send
+        ledger = self.zigate._get_reporting_ledger(device.ieee)
+        ledger['bind'].add((1, 0x0008))
+        ledger['report'][(1, 0x0008, 0x0000)] = (1, 3600, 3)
+        self._answer_bind_report(change=3)
+        self.zigate.verify_reporting('1234')
+        self.assertEqual(len(connection.sent), 1)  # only read configuration
+        # device lost its reportable change
+        connection.send = send
+        self._answer_bind_report(change=0)
+        connection.sent = []
+        self.zigate.verify_reporting('1234')
+        self.assertEqual(len(connection.sent), 3)  # read, bind and report again
+        self.assertEqual(hexlify(connection.get_last_cmd()),
+                         b'0212340101000800000000010020000000010e10000003')
 
     def test_raw_aps_data(self):
         def send_data(cmd, data=None, wait_response=False, wait_status=False):
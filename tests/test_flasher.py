@@ -0,0 +1,76 @@
+'''
+ZiGate flasher Tests
+-------------------------
+'''
+
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+from zigate import flasher
+
+
+def create_firmware(size=3000):
+    firmware = bytearray(os.urandom(size))
+    firmware[0x20:0x24] = struct.pack('>L', size)
+    return bytes(firmware)
+
+
+class TestFlasher(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.firmware = create_firmware()
+        self.path = os.path.join(self.test_dir, 'firmware.bin')
+        with open(self.path, 'wb') as fd:
+            fd.write(flasher.ZIGATE_BINARY_VERSION + self.firmware)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_write(self):
+        ser = flasher.FakeBootloader()
+        flasher._flash(ser, write=self.path)
+        self.assertEqual(ser.flash[:len(self.firmware)], self.firmware)
+        self.assertEqual(ser.baudrate, 38400)
+        fast_ser = flasher.FakeBootloader()
+        flasher._flash(fast_ser, write=self.path, fast=True)
+        self.assertEqual(fast_ser.flash[:len(self.firmware)], self.firmware)
+        self.assertLess(fast_ser.elapsed * 3, ser.elapsed)
+
+    def test_backup(self):
+        path = os.path.join(self.test_dir, 'backup.bin')
+        ser = flasher.FakeBootloader(self.firmware)
+        flasher._flash(ser, save=path, fast=True)
+        with open(path, 'rb') as fd:
+            self.assertEqual(fd.read(), flasher.ZIGATE_BINARY_VERSION + self.firmware)
+
+    def test_negotiate(self):
+        ser = flasher.FakeBootloader(max_baudrate=250000)
+        self.assertEqual(flasher.negotiate_baudrate(ser), 250000)
+        self.assertEqual(ser.bootloader_baudrate, 250000)
+        # bootloader refusing large chunks
+        ser = flasher.FakeBootloader(max_chunk_size=flasher.DEFAULT_CHUNK_SIZE)
+        flasher._flash(ser, write=self.path, fast=True)
+        self.assertEqual(ser.flash[:len(self.firmware)], self.firmware)
+
+    def test_compare_verify(self):
+        ser = flasher.FakeBootloader(self.firmware)
+        self.assertIsNone(flasher.compare_flash(ser, self.path, flasher.FAST_CHUNK_SIZE))
+        ser.flash[1000] ^= 0xff
+        self.assertEqual(flasher.compare_flash(ser, self.path), 896)
+        self.assertEqual(flasher.compare_flash(ser, self.path, stop=False), 896)
+        # identical firmware, nothing written nor saved
+        path = os.path.join(self.test_dir, 'backup.bin')
+        ser = flasher.FakeBootloader(self.firmware)
+        self.assertFalse(flasher._flash(ser, write=self.path, save=path, compare=True))
+        self.assertFalse(os.path.exists(path))
+        # different firmware, saved, written and verified
+        ser = flasher.FakeBootloader(create_firmware())
+        self.assertTrue(flasher._flash(ser, write=self.path, save=path, compare=True, verify=True, fast=True))
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(ser.flash[:len(self.firmware)], self.firmware)
+
+
+if __name__ == '__main__':
+    unittest.main()
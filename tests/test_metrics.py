@@ -0,0 +1,85 @@
+'''
+ZiGate metrics Tests
+-------------------------
+'''
+
+import unittest
+from zigate import core, metrics, transport
+
+
+def value(name, **labels):
+    for samples in metrics.REGISTRY.collect().values():
+        for sample_name, sample_labels, v in samples:
+            if sample_name == name and sample_labels == labels:
+                return v
+    return 0
+
+
+class TestMetrics(unittest.TestCase):
+    def test_registry(self):
+        registry = metrics.Registry()
+        counter = registry.counter('test_total', 'Test counter', ('cmd',))
+        counter.labels(0x0010).inc()
+        counter.labels(0x0010).inc(2)
+        gauge = registry.gauge('test_depth', 'Test gauge').labels()
+        gauge.set_function(lambda: 5)
+        histogram = registry.histogram('test_seconds', 'Test histogram', buckets=(0.1, 1)).labels()
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        self.assertEqual(registry.render(),
+                         '# HELP test_depth Test gauge\n'
+                         '# TYPE test_depth gauge\n'
+                         'test_depth 5\n'
+                         '# HELP test_seconds Test histogram\n'
+                         '# TYPE test_seconds histogram\n'
+                         'test_seconds_bucket{le="0.1"} 1\n'
+                         'test_seconds_bucket{le="1.0"} 2\n'
+                         'test_seconds_bucket{le="+Inf"} 3\n'
+                         'test_seconds_sum 5.55\n'
+                         'test_seconds_count 3\n'
+                         '# HELP test_total Test counter\n'
+                         '# TYPE test_total counter\n'
+                         'test_total{cmd="0x0010"} 3\n')
+
+    def test_transport(self):
+        connection = transport.BaseTransport()
+        frames = value('zigate_transport_frames_received_total')
+        received = value('zigate_transport_bytes_received_total')
+        malformed = value('zigate_transport_malformed_packets_total')
+        connection.read_data(b'\x01\x80\x00\x03\x00\x03')
+        self.assertEqual(value('zigate_transport_frames_received_total'), frames + 1)
+        self.assertEqual(value('zigate_transport_bytes_received_total'), received + 6)
+        self.assertEqual(value('zigate_transport_malformed_packets_total'), malformed + 1)
+
+    def test_zigate(self):
+        zigate = core.FakeZiGate(auto_start=False)
+        zigate.setup_connection()
+        zigate._start_event_thread()
+        commands = value('zigate_command_round_trip_seconds_count', cmd='0x0010')
+        decoded = value('zigate_decode_seconds_count', msg_type='0x8010')
+        zigate.get_version()
+        self.assertEqual(value('zigate_command_round_trip_seconds_count', cmd='0x0010'), commands + 1)
+        self.assertEqual(value('zigate_decode_seconds_count', msg_type='0x8010'), decoded + 1)
+        instance = zigate._metrics_instance
+        self.assertEqual(value('zigate_transport_received_queue_depth', instance=instance), 0)
+        checksum = value('zigate_decode_errors_total', reason='checksum')
+        zigate.decode_data(b'\x01' + zigate.zigate_encode(bytes.fromhex('8010000142ff')) + b'\x03')
+        self.assertEqual(value('zigate_decode_errors_total', reason='checksum'), checksum + 1)
+        msg = zigate.connection.create_fake_response(0x8102, bytes.fromhex('01abcd010006000000100001') + b'\x01', 200)
+        zigate.decode_data(msg)
+        self.assertEqual(value('zigate_device_lqi', addr='abcd'), 200)
+        self.assertIn(('zigate_device_lqi', {'addr': 'abcd'}, 200), zigate.get_metrics()['zigate_device_lqi'])
+        # gauges of each instance are kept until it is closed
+        other = core.FakeZiGate(auto_start=False)
+        other._no_response_count = 3
+        self.assertEqual(value('zigate_command_no_response_count', instance=instance), 0)
+        self.assertEqual(value('zigate_command_no_response_count', instance=other._metrics_instance), 3)
+        other.close()
+        self.assertNotIn(other._metrics_instance,
+                         [labels['instance'] for n, labels, v in zigate.get_metrics()['zigate_command_no_response_count']])
+        zigate.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
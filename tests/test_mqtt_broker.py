@@ -0,0 +1,138 @@
+'''
+ZiGate MQTT broker Tests
+-------------------------
+'''
+
+import unittest
+import json
+import time
+from zigate import core
+try:
+    from zigate import mqtt_broker
+except ImportError:  # paho-mqtt not installed
+    mqtt_broker = None
+
+
+@unittest.skipIf(mqtt_broker is None, 'paho-mqtt not installed')
+class TestMQTTBroker(unittest.TestCase):
+    def setUp(self):
+        self.zigate = core.FakeZiGate(auto_start=False)
+        self.broker = mqtt_broker.MQTT_Broker(self.zigate)
+        self.published = []
+        self.broker.client.publish = lambda topic, payload, retain: self.published.append((topic,
+                                                                                           json.loads(payload),
+                                                                                           retain))
+
+    def tearDown(self):
+        mqtt_broker.dispatcher.disconnect(self.broker.attribute_changed, mqtt_broker.ZIGATE_ATTRIBUTE_ADDED)
+        mqtt_broker.dispatcher.disconnect(self.broker.attribute_changed, mqtt_broker.ZIGATE_ATTRIBUTE_UPDATED)
+        mqtt_broker.dispatcher.disconnect(self.broker.device_added, mqtt_broker.ZIGATE_DEVICE_ADDED)
+        mqtt_broker.dispatcher.disconnect(self.broker.device_changed, mqtt_broker.ZIGATE_DEVICE_UPDATED)
+        mqtt_broker.dispatcher.disconnect(self.broker.device_removed, mqtt_broker.ZIGATE_DEVICE_REMOVED)
+
+    def test_coalesce_attributes(self):
+        device = self.zigate.get_device_from_addr('abcd')
+        device.set_attribute(1, 0x0402, {'attribute': 0, 'data': 2000})
+        device.set_attribute(1, 0x0402, {'attribute': 0, 'data': 2100})
+        device.set_attribute(1, 0x0405, {'attribute': 0, 'data': 5000})
+        self.assertEqual(self.published, [])
+        self.broker.flush()
+        self.assertEqual([(topic, payload['value']) for topic, payload, retain in self.published],
+                         [('zigate/attribute_changed/abcd/01/0402/0000', 21.0),
+                          ('zigate/attribute_changed/abcd/01/0405/0000', 50.0)])
+        # unchanged value not published again
+        self.published.clear()
+        device.set_attribute(1, 0x0402, {'attribute': 0, 'data': 2100})
+        self.broker.flush()
+        self.assertEqual(self.published, [])
+        # published again after reconnection
+        self.broker.on_connect(self.broker.client, None, {}, 0)
+        self.broker.attribute_changed(device.get_attribute(1, 0x0402, 0, True), device)
+        self.broker.flush()
+        self.assertEqual([topic for topic, payload, retain in self.published],
+                         ['zigate/attribute_changed/abcd/01/0402/0000'])
+
+    def test_device_delta(self):
+        device = self.zigate.get_device_from_addr('abcd')
+        self.broker.device_changed(device)
+        self.broker.flush()
+        topic, payload, retain = self.published[-1]
+        self.assertEqual(topic, 'zigate/device_changed/abcd')
+        self.assertFalse(retain)
+        self.assertIn('ieee', payload['info'])
+        self.published.clear()
+        device.set_attribute(1, 0x0402, {'attribute': 0, 'data': 2000})
+        device.info['rssi'] = 100
+        self.broker.device_changed(device)
+        self.broker.flush()
+        topic, payload, retain = self.published[-1]
+        self.assertEqual(payload['info'], {'rssi': 100})
+        self.assertEqual([a['name'] for a in payload['attributes']], ['temperature'])
+        self.assertNotIn('endpoints', payload)
+        # nothing changed
+        self.published.clear()
+        self.broker.device_changed(device)
+        self.broker.flush()
+        self.assertEqual(self.published, [])
+        # snapshot on request
+        self.broker.publish_snapshot('abcd')
+        topic, payload, retain = self.published[-1]
+        self.assertEqual(topic, 'zigate/device_snapshot/abcd')
+        self.assertIn('endpoints', payload)
+
+    def test_command(self):
+        self.broker.start_workers()
+        self.assertTrue(self.broker.submit_command({'function': 'get_device_from_addr', 'args': ['abcd'],
+                                                    'id': 42, 'response_topic': 'client/result'}))
+        self.broker.submit_command({'function': 'unknown', 'id': 43})
+        self.broker.submit_command({'function': 'get_device_from_addr', 'args': ['0000']})
+        self.broker.join_commands()
+        results = {payload.get('id'): (topic, payload) for topic, payload, retain in self.published
+                   if 'function' in payload}
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[42][0], 'client/result')
+        self.assertEqual(results[42][1]['result']['addr'], 'abcd')
+        self.assertEqual(results[43], ('zigate/command/result',
+                                       {'function': 'unknown', 'result': None, 'id': 43,
+                                        'error': 'unknown function'}))
+        self.broker.flush()
+        self.assertEqual(self.published[-1], ('zigate/command/queue', {'depth': 0, 'max': 100, 'workers': 4}, True))
+
+    def test_command_order(self):
+        executed = []
+        self.zigate.record = lambda i: executed.append(i) or time.sleep(0.001)
+        self.broker.start_workers()
+        for i in range(20):
+            self.broker.submit_command({'function': 'record', 'args': [i], 'response_topic': 'client/result'})
+        self.broker.join_commands()
+        self.assertEqual(executed, list(range(20)))
+
+    def test_command_queue_full(self):
+        self.broker = mqtt_broker.MQTT_Broker(self.zigate, workers=1, max_queue=1)
+        self.broker.client.publish = lambda topic, payload, retain: self.published.append((topic,
+                                                                                           json.loads(payload),
+                                                                                           retain))
+        self.assertTrue(self.broker.submit_command({'function': 'permit_join', 'id': 1}))
+        self.assertFalse(self.broker.submit_command({'function': 'permit_join', 'id': 2}))
+        self.assertEqual(self.published, [('zigate/command/result',
+                                           {'function': 'permit_join', 'result': None, 'id': 2,
+                                            'error': 'queue full'}, True)])
+
+    def test_invalid_command(self):
+        class Message(object):
+            topic = 'zigate/command'
+            payload = b'{invalid'
+        self.broker.on_message(self.broker.client, None, Message)
+        Message.payload = b'["permit_join"]'
+        self.broker.on_message(self.broker.client, None, Message)
+        self.assertEqual([(topic, payload['error'][:15], retain) for topic, payload, retain in self.published],
+                         [('zigate/command/result', 'invalid command', True)] * 2)
+
+    def test_device_removed(self):
+        self.broker.device_removed('abcd')
+        self.broker.device_removed('abcd')
+        self.assertEqual(self.published, [('zigate/device_removed', 'abcd', True)] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+'''
+ZiGate OTA Tests
+-------------------------
+'''
+
+import unittest
+import os
+import shutil
+import tempfile
+import struct
+import time
+from zigate import responses, core, ota, ota_benchmark
+from binascii import hexlify
+
+
+def create_ota_file(path, manufacturer_code=0x117c, image_type=0x2101, image_version=0x12345678, size=200):
+    data = bytes(range(256)) * (size // 256 + 1)
+    header = ota.OTA_HEADER.pack(0x0BEEF11E, 0x0100, 0x38, 0, manufacturer_code, image_type,
+                                 image_version, 2, b'test image', size, 0, 0, 0, 0)
+    with open(path, 'wb') as f:
+        f.write(header + data[:size - len(header)])
+    return path
+
+
+def block_request(addr, file_offset, manufacturer_code=0x117c, image_type=0x2101,
+                  image_version=0x12345678, max_data_size=64):
+    msg_data = struct.pack('!BBHBHQLLHHHBB', 1, 1, 0x0019, 2, addr, 0x0123456789abcdef, file_offset,
+                           image_version, image_type, manufacturer_code, 0, max_data_size, 0)
+    return responses.R8501(msg_data, 255)
+
+
+class TestOTA(unittest.TestCase):
+    def setUp(self):
+        core.WAIT_TIMEOUT = 2 * core.SLEEP_INTERVAL  # reduce timeout during test
+        self.zigate = core.FakeZiGate(auto_start=False)
+        self.zigate._start_event_thread()
+        self.zigate.setup_connection()
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for image in self.zigate._ota_images.values():
+            image.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_image(self):
+        path = create_ota_file(os.path.join(self.test_dir, 'test.ota'))
+        image = ota.OTAImage(path)
+        self.assertEqual(image.key, (0x117c, 0x2101, 0x12345678))
+        self.assertEqual(image.size, 200)
+        self.assertEqual(image.header['header_str'], b'test image' + b' ' * 22)
+        self.assertEqual(image.header_payload()[:4], b'\x0b\xee\xf1\x1e')
+        self.assertEqual(bytes(image.block(190, 64)), bytes(range(190 - 69, 200 - 69)))
+        image.close()
+        # bad size
+        with open(path, 'ab') as f:
+            f.write(b'\x00')
+        self.assertRaises(ota.OTAImageError, ota.OTAImage, path)
+
+    def test_parallel_sessions(self):
+        path = create_ota_file(os.path.join(self.test_dir, 'test.ota'))
+        self.zigate.ota_load_image(path)
+        self.assertEqual(list(self.zigate._ota_images.keys()), [(0x117c, 0x2101, 0x12345678)])
+        connection = self.zigate.connection
+        self.zigate.interpret_response(block_request(0x1234, 0))
+        self.zigate.interpret_response(block_request(0x5678, 0))
+        self.zigate.interpret_response(block_request(0x1234, 64))
+        self.assertEqual(set(self.zigate._ota_sessions.keys()),
+                         {('1234', 0x117c, 0x2101), ('5678', 0x117c, 0x2101)})
+        self.assertEqual(hexlify(connection.get_last_cmd()[:20]),
+                         b'0212340101010000000040123456782101117c40')
+        self.assertEqual(connection.get_last_cmd()[20:], bytes(5) + bytes(range(0, 59)))
+        status = self.zigate.get_ota_status()
+        self.assertEqual(len(status), 2)
+        self.assertEqual(self.zigate.get_ota_status(addr='1234')[0]['transfered'], 128)
+        # reloading image while transfering is refused
+        self.assertIsNone(self.zigate.ota_load_image(path))
+        # unknown image
+        sent = len(connection.sent)
+        self.zigate.interpret_response(block_request(0x1234, 0, image_type=0x2102))
+        self.assertEqual(len(connection.sent), sent)
+        # end
+        msg_data = struct.pack('!BBHBHLHHB', 1, 1, 0x0019, 2, 0x1234, 0x12345678, 0x2101, 0x117c, 0)
+        self.zigate.interpret_response(responses.R8503(msg_data, 255))
+        self.assertEqual(list(self.zigate._ota_sessions.keys()), [('5678', 0x117c, 0x2101)])
+        # abandoned session expires, image can be reloaded
+        self.zigate._ota_sessions[('5678', 0x117c, 0x2101)].last_activity -= ota.OTA_SESSION_TIMEOUT + 1
+        image = self.zigate._ota_images[(0x117c, 0x2101, 0x12345678)]
+        self.zigate.ota_load_image(path)
+        self.assertIsNot(self.zigate._ota_images[(0x117c, 0x2101, 0x12345678)], image)
+        self.assertEqual(self.zigate._ota_sessions, {})
+        self.assertIsNone(self.zigate.ota_metrics()['completed'][-1]['result'])
+
+    def test_repository(self):
+        create_ota_file(os.path.join(self.test_dir, 'a.ota'), image_version=1)
+        create_ota_file(os.path.join(self.test_dir, 'b.ota'), image_version=2)
+        create_ota_file(os.path.join(self.test_dir, 'c.ota'), image_type=0x2102)
+        with open(os.path.join(self.test_dir, 'bad.ota'), 'wb') as f:
+            f.write(b'bad')
+        repository = ota.OTARepository(self.test_dir)
+        self.assertIsNone(repository.get(0x117c, 0x2103))
+        self.assertEqual(repository.latest(), {(0x117c, 0x2101): 2, (0x117c, 0x2102): 0x12345678})
+        self.assertEqual(repository.get(0x117c, 0x2101), os.path.join(self.test_dir, 'b.ota'))
+        self.assertEqual(repository.get(0x117c, 0x2101, 1), os.path.join(self.test_dir, 'a.ota'))
+        self.assertEqual(len(repository.images()), 3)
+        # cached headers are reused
+        cache = repository._cache.copy()
+        repository.refresh()
+        self.assertIs(repository._cache[os.path.join(self.test_dir, 'a.ota')][1],
+                      cache[os.path.join(self.test_dir, 'a.ota')][1])
+        # recent miss does not scan directory again
+        self.assertIsNone(repository.get(0x117c, 0x2103))
+        create_ota_file(os.path.join(self.test_dir, 'd.ota'), image_type=0x2103)
+        self.assertIsNone(repository.get(0x117c, 0x2103))
+        # new file found once miss has expired
+        repository._misses[(0x117c, 0x2103, None)] -= ota.OTA_MISS_TTL + 1
+        self.assertEqual(repository.get(0x117c, 0x2103), os.path.join(self.test_dir, 'd.ota'))
+
+    def test_directory_block_request(self):
+        create_ota_file(os.path.join(self.test_dir, 'a.ota'), image_version=1)
+        create_ota_file(os.path.join(self.test_dir, 'b.ota'), image_version=2)
+        self.assertEqual(len(self.zigate.ota_load_directory(self.test_dir)), 2)
+        self.zigate.interpret_response(block_request(0x1234, 0, image_version=1))
+        self.zigate.interpret_response(block_request(0x5678, 0, image_version=2))
+        self.assertEqual(set(self.zigate._ota_images.keys()),
+                         {(0x117c, 0x2101, 1), (0x117c, 0x2101, 2)})
+        self.assertEqual(self.zigate._ota_sessions[('1234', 0x117c, 0x2101)].image.header['image_version'], 1)
+        self.assertEqual(self.zigate._ota_sessions[('5678', 0x117c, 0x2101)].image.header['image_version'], 2)
+
+    def test_directory_image_eviction(self):
+        create_ota_file(os.path.join(self.test_dir, 'a.ota'), image_version=1)
+        self.zigate.ota_load_directory(self.test_dir)
+        self.zigate.interpret_response(block_request(0x1234, 0, image_version=1))
+        image = self.zigate._ota_images[(0x117c, 0x2101, 1)]
+        # superseded image is kept while it is sent
+        create_ota_file(os.path.join(self.test_dir, 'b.ota'), image_version=2)
+        self.zigate._ota_repository.refresh()
+        self.zigate.interpret_response(block_request(0x5678, 0, image_version=2))
+        self.assertEqual(set(self.zigate._ota_images.keys()), {(0x117c, 0x2101, 1), (0x117c, 0x2101, 2)})
+        # superseded image is closed once its session has ended
+        msg_data = struct.pack('!BBHBHLHHB', 1, 1, 0x0019, 2, 0x1234, 1, 0x2101, 0x117c, 0)
+        self.zigate.interpret_response(responses.R8503(msg_data, 255))
+        self.zigate.interpret_response(block_request(0x5678, 64, image_version=2))
+        self.assertEqual(list(self.zigate._ota_images.keys()), [(0x117c, 0x2101, 2)])
+        self.assertTrue(image._mmap.closed)
+        # idle image is closed once its session has expired
+        image = self.zigate._ota_images[(0x117c, 0x2101, 2)]
+        self.zigate._ota_sessions[('5678', 0x117c, 0x2101)].last_activity -= ota.OTA_SESSION_TIMEOUT + 1
+        image.last_used -= ota.OTA_SESSION_TIMEOUT + 1
+        with self.zigate._ota_lock:
+            self.zigate._ota_expire_sessions()
+        self.assertEqual(self.zigate._ota_images, {})
+        # image loaded by user is never closed
+        path = create_ota_file(os.path.join(self.test_dir, 'c.ota'), image_type=0x2102)
+        self.zigate.ota_load_image(path)
+        image = self.zigate._ota_images[(0x117c, 0x2102, 0x12345678)]
+        image.last_used -= ota.OTA_SESSION_TIMEOUT + 1
+        with self.zigate._ota_lock:
+            self.zigate._ota_expire_sessions()
+        self.assertIn(image.key, self.zigate._ota_images)
+
+    def test_notify_all(self):
+        create_ota_file(os.path.join(self.test_dir, 'a.ota'), image_version=2)
+        create_ota_file(os.path.join(self.test_dir, 'b.ota'), image_type=0x2102, image_version=3)
+        self.zigate.ota_load_directory(self.test_dir)
+        for addr, info in (('1234', {'manufacturer_code': '117c'}),
+                           ('5678', {'manufacturer_code': '117c', 'image_type': 0x2101, 'image_version': 2}),
+                           ('9abc', {'manufacturer_code': '1234'}),
+                           ('def0', {'manufacturer_code': '117c', 'image_type': 0x2101, 'image_version': 1}),
+                           ('4321', {'manufacturer_code': '117c'})):
+            info['addr'] = addr
+            self.zigate._devices[addr] = core.Device(info, self.zigate)
+        device = self.zigate._devices['1234']
+        device.endpoints[1] = {'device': 0x0100, 'profile': 0x0104, 'in_clusters': [],
+                               'out_clusters': [0x0019], 'clusters': {}}
+        device.set_attribute(1, 0x0019, {'attribute': 0x0002, 'lqi': 255, 'data': 1})
+        device.set_attribute(1, 0x0019, {'attribute': 0x0008, 'lqi': 255, 'data': 0x2102})
+        self.zigate._devices['4321'].endpoints[1] = {'device': 0x0100, 'profile': 0x0104, 'in_clusters': [],
+                                                     'out_clusters': [0x0019], 'clusters': {}}
+        connection = self.zigate.connection
+        notified = self.zigate.ota_notify_all(pace=0, image_delay=0)
+        self.assertEqual(notified, [('def0', 0x117c, 0x2101, 2), ('1234', 0x117c, 0x2102, 3)])
+        # unknown version of 4321 is queried
+        sent = [hexlify(connection.zigate_decode(cmd[1:-1])[5:]) for cmd in connection.sent]
+        self.assertIn(b'02432101010019010000000200020008', sent)
+        for i in range(100):
+            if hexlify(connection.get_last_cmd()) == b'021234010100ffffffff2102117c64':
+                break
+            time.sleep(0.05)
+        self.assertEqual(hexlify(connection.get_last_cmd()), b'021234010100ffffffff2102117c64')
+        sent = [hexlify(connection.zigate_decode(cmd[1:-1])[5:]) for cmd in connection.sent]
+        self.assertIn(b'02def0010100ffffffff2101117c64', sent)
+
+    def test_metrics(self):
+        path = create_ota_file(os.path.join(self.test_dir, 'test.ota'))
+        self.zigate.ota_load_image(path)
+        self.assertEqual(self.zigate.ota_configure(max_data_size=32),
+                         {'block_delay': 0, 'max_data_size': 32, 'session_timeout': ota.OTA_SESSION_TIMEOUT})
+        connection = self.zigate.connection
+        self.zigate.interpret_response(block_request(0x1234, 0))
+        self.assertEqual(len(connection.get_last_cmd()), ota.OTA_BLOCK_HEADER.size + 32)
+        self.zigate.interpret_response(block_request(0x1234, 32))
+        self.zigate.interpret_response(block_request(0x1234, 32))
+        metrics = self.zigate.get_ota_status()[0]['metrics']
+        self.assertEqual(metrics['blocks'], 3)
+        self.assertEqual(metrics['bytes'], 96)
+        self.assertEqual(metrics['retransmits'], 1)
+        self.assertEqual(sum(metrics['latency_histogram'].values()), 2)
+        msg_data = struct.pack('!BBHBHLHHB', 1, 1, 0x0019, 2, 0x1234, 0x12345678, 0x2101, 0x117c, 0)
+        self.zigate.interpret_response(responses.R8503(msg_data, 255))
+        metrics = self.zigate.ota_metrics()
+        self.assertEqual(metrics['active'], [])
+        self.assertEqual(metrics['completed'][0]['result'], 0)
+        self.assertEqual(metrics['completed'][0]['metrics']['blocks'], 3)
+
+    def test_block_pacing(self):
+        path = create_ota_file(os.path.join(self.test_dir, 'test.ota'))
+        self.zigate.ota_load_image(path)
+        self.zigate.ota_configure(block_delay=0.2)
+        connection = self.zigate.connection
+        self.zigate.interpret_response(block_request(0x1234, 0))
+        sent = len(connection.sent)
+        # paced response does not block caller
+        start = time.monotonic()
+        self.zigate.interpret_response(block_request(0x1234, 64))
+        self.zigate.interpret_response(block_request(0x1234, 64))  # retry replaces waiting request
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(len(connection.sent), sent)
+        for i in range(100):
+            if len(connection.sent) > sent:
+                break
+            time.sleep(0.05)
+        time.sleep(0.1)
+        self.assertEqual(len(connection.sent), sent + 1)
+        metrics = self.zigate.get_ota_status()[0]['metrics']
+        self.assertEqual(metrics['blocks'], 2)
+        self.assertEqual(self.zigate._ota_block_timers, {})
+
+    def test_benchmark(self):
+        result = ota_benchmark.run(devices=2, size=500, latency=0, timeout=10)
+        self.assertTrue(result['finished'])
+        self.assertEqual(len(result['sessions']), 2)
+        self.assertEqual(result['sessions'][0]['metrics']['bytes'], 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
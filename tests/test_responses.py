@@ -315,6 +315,31 @@ class TestResponses(unittest.TestCase):
                                           ('status', 0),
                                           ('lqi', 255)]))
 
+    def test_response_8122(self):
+        msg_data = unhexlify(b'0112340100080020000000010e10')
+        r = responses.R8122(msg_data, 255)
+        self.assertDictEqual(r.cleaned_data(),
+                             OrderedDict([('sequence', 1),
+                                          ('addr', '1234'),
+                                          ('endpoint', 1),
+                                          ('cluster', 8),
+                                          ('status', 0),
+                                          ('data_type', 0x20),
+                                          ('attribute', 0),
+                                          ('min_interval', 1),
+                                          ('max_interval', 3600),
+                                          ('lqi', 255)]))
+
+        msg_data = unhexlify(b'011234010008c1')
+        r = responses.R8122(msg_data, 255)
+        self.assertDictEqual(r.cleaned_data(),
+                             OrderedDict([('sequence', 1),
+                                          ('addr', '1234'),
+                                          ('endpoint', 1),
+                                          ('cluster', 8),
+                                          ('status', 0xc1),
+                                          ('lqi', 255)]))
+
     def test_response_80A0(self):
         msg_data = unhexlify(b'0101000500abcd0200001234')
         r = responses.R80A0(msg_data, 255)
@@ -569,6 +594,16 @@ class TestResponses(unittest.TestCase):
                                           ]))
         self.assertEqual(r.status_text(), 'E_PDM_SYSTEM_EVENT_LARGEST_RECORD_FULL_SAVE_NO_LONGER_POSSIBLE')
 
+    def test_response_memoryview(self):
+        msg_data = unhexlify(b'0001000006020102123402abcd0401234567')
+        r = responses.R8002(memoryview(msg_data), 255)
+        self.assertEqual(r.data, responses.R8002(msg_data, 255).data)
+        self.assertIsInstance(r['payload'], bytes)
+        r = responses.R8000(memoryview(unhexlify(b'00010001abcd')), 255)
+        self.assertEqual(r['error'], b'\xab\xcd')
+        r = responses.Response(memoryview(b'\x01\x02'), 255)
+        self.assertEqual(r['additional'], b'\x01\x02')
+
 
 if __name__ == '__main__':
     unittest.main()
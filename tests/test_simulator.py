@@ -0,0 +1,70 @@
+'''
+ZiGate simulator Tests
+-------------------------
+'''
+
+import unittest
+import time
+from zigate import core, simulator
+
+
+class TestSimulator(unittest.TestCase):
+    def setUp(self):
+        self.zigate = core.FakeZiGate(auto_start=False, path=None)
+        self.network = simulator.SimulatedNetwork(5, {'xiaomi_ht': 1, 'bulb': 1, 'meter': 1}, seed=1)
+        self.zigate.connection = self.network
+        self.zigate._devices.clear()
+        self.zigate._start_event_thread()
+
+    def tearDown(self):
+        self.network.close()
+        self.zigate.close()
+
+    def wait(self, condition, timeout=5):
+        start = time.monotonic()
+        while not condition() and time.monotonic() - start < timeout:
+            time.sleep(0.01)
+        return condition()
+
+    def test_discovery(self):
+        self.zigate.get_devices_list(True)
+        self.assertTrue(self.wait(lambda: len([d for d in self.zigate.devices if d.discovery]) == 5))
+        for virtual in self.network.devices.values():
+            device = self.zigate.get_device_from_addr('{:04x}'.format(virtual.addr))
+            self.assertEqual(device.get_value('type'), virtual.profile['type'])
+            self.assertEqual(device.ieee, '{:016x}'.format(virtual.ieee))
+            self.assertEqual(set(device.endpoints), set(virtual.profile['endpoints']))
+        bulb = [d for d in self.network.devices.values() if d.profile_name == 'bulb'][0]
+        self.assertTrue(self.wait(lambda: (1, 0x0006) in bulb.binds))
+        self.assertTrue(self.wait(lambda: (1, 0x0006, 0x0000) in bulb.reporting))
+
+    def test_reports(self):
+        self.zigate.get_devices_list(True)
+        self.assertTrue(self.wait(lambda: len([d for d in self.zigate.devices if d.discovery]) == 5))
+        sensor = [d for d in self.network.devices.values() if d.profile_name == 'xiaomi_ht'][0]
+        device = self.zigate.get_device_from_addr('{:04x}'.format(sensor.addr))
+        self.network.report(sensor, (1, 0x0402, 0x0000))
+        temperature = sensor.values[(1, 0x0402, 0x0000)][1] / 100
+        self.assertTrue(self.wait(lambda: device.get_value('temperature') == temperature))
+        self.network.report(sensor, (1, 0x0000, 0xff01))
+        self.assertTrue(self.wait(lambda: device.get_value('battery_voltage') is not None))
+        self.network.loss = 1
+        self.network.burst(10)
+        self.assertEqual(self.network.lost, 10)
+
+    def test_rejoin(self):
+        self.zigate.get_devices_list(True)
+        self.assertTrue(self.wait(lambda: len([d for d in self.zigate.devices if d.discovery]) == 5))
+        self.assertEqual(self.network.rejoin_storm(1.0, 0.1, new_addr=True), 5)
+        addrs = set('{:04x}'.format(addr) for addr in self.network.devices)
+        self.assertTrue(self.wait(lambda: set(self.zigate._devices) == addrs))
+
+    def test_run(self):
+        result = simulator.run(devices=5, duration=0.5, rate=5, bursts=1, burst_size=10, seed=1)
+        self.assertEqual(result['discovered'], 5)
+        self.assertGreater(result['reports_processed'], 0)
+        self.assertGreater(result['latency_max'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+'''
+ZiGate tracing Tests
+-------------------------
+'''
+
+import unittest
+import time
+from zigate import core, tracing
+from zigate.const import ZIGATE_ATTRIBUTE_ADDED
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        tracing.TRACER.clear()
+
+    def tearDown(self):
+        tracing.TRACER.stop()
+        tracing.TRACER.clear()
+
+    def test_sample(self):
+        tracer = tracing.Tracer()
+        self.assertIsNone(tracer.sample('frame'))
+        tracer.start(sample_every=2, max_traces=3)
+        traces = [tracer.sample('frame') for i in range(10)]
+        self.assertEqual([t is not None for t in traces[:4]], [False, True, False, True])
+        for trace in traces:
+            if trace:
+                trace.mark(tracing.READ)
+                tracer.finish(trace)
+        self.assertEqual(len(tracer.traces), 3)
+        trace = tracer.traces[-1]
+        trace.msg_type = 0x8102
+        self.assertEqual(trace.name, 'frame 0x8102')
+        self.assertEqual([stage[0] for stage in trace.stages()], [tracing.READ, tracing.DONE])
+        events = tracer.export()['traceEvents']
+        self.assertEqual(len(events), 6)
+        self.assertEqual(events[-2]['name'], 'frame 0x8102')
+        self.assertEqual(events[-1]['name'], tracing.DONE)
+        self.assertEqual(events[-1]['args'], {'from': tracing.READ})
+
+    def test_inbound(self):
+        zigate = core.FakeZiGate(auto_start=False)
+        zigate.setup_connection()
+        zigate.start_tracing()
+        received = []
+
+        def callback(**kwargs):
+            received.append(tracing.TRACER.current())
+        core.dispatcher.connect(callback, ZIGATE_ATTRIBUTE_ADDED)
+        msg = zigate.connection.create_fake_response(0x8102, bytes.fromhex('01abcd010006000000100001') + b'\x01')
+        zigate.connection.read_data(msg)
+        packet = zigate.connection.received.get()
+        self.assertIsInstance(packet, tracing.Frame)
+        zigate.decode_data(packet)
+        core.dispatcher.disconnect(callback, ZIGATE_ATTRIBUTE_ADDED)
+        self.assertIs(received[0], packet.trace)
+        self.assertIsNone(tracing.TRACER.current())
+        trace = zigate.get_traces()[-1]
+        self.assertEqual(trace['name'], 'frame 0x8102')
+        stages = [stage[0] for stage in trace['stages']]
+        self.assertEqual(stages[:5], [tracing.READ, tracing.DECODE, tracing.DECODED,
+                                      tracing.INTERPRET, tracing.SET_ATTRIBUTE])
+        self.assertIn((tracing.DISPATCH, ZIGATE_ATTRIBUTE_ADDED),
+                      [(stage[0], stage[1]) for stage in trace['stages']])
+        self.assertEqual(stages[-1], tracing.DONE)
+        zigate.close()
+
+    def test_command(self):
+        zigate = core.FakeZiGate(auto_start=False)
+        zigate.setup_connection()
+        zigate._start_event_thread()
+        zigate.start_tracing()
+        zigate.get_version()
+        time.sleep(0.2)
+        traces = {trace['name']: trace for trace in zigate.get_traces()}
+        stages = [stage[0] for stage in traces['command 0x0010']['stages']]
+        self.assertEqual(stages[:3], [tracing.SEND, tracing.WRITE, tracing.TRANSPORT])
+        self.assertEqual(set(stages[3:5]), {tracing.STATUS, tracing.RESPONSE})
+        self.assertEqual(stages[-1], tracing.DONE)
+        self.assertIn('frame 0x8000', traces)
+        self.assertIn(tracing.DEQUEUE, [stage[0] for stage in traces['frame 0x8010']['stages']])
+        self.assertEqual(zigate._command_traces, {})
+        self.assertEqual(zigate._response_traces, {})
+        zigate.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,13 +6,13 @@
 # file that was distributed with this source code.
 #
 
-from .core import (ZiGate, ZiGateWiFi, ZiGateGPIO)
+from .core import (ZiGate, ZiGateWiFi, ZiGateGPIO, register_handler)
 from .const import *  # noqa
 from .version import __version__  # noqa
 from pydispatch import dispatcher
 
 __all__ = ['ZiGate', 'ZiGateWiFi', 'ZiGateGPIO',
-           'dispatcher']
+           'register_handler', 'dispatcher']
 
 
 def connect(port=None, host=None,
@@ -9,20 +9,70 @@ import os
 import threading
 import bottle
 from json import dumps
+from wsgiref.simple_server import WSGIServer
 from zigate import version as zigate_version
+from zigate import metrics as zigate_metrics
 from zigate.core import DeviceEncoder
 from zigate.const import ADMINPANEL_PORT, ADMINPANEL_HOST
+from zigate.adminpanel.events import EventStream
+from zigate.adminpanel.jobs import JobManager, WorkerPool
 import time
+import zlib
 
 
 bottle.TEMPLATE_PATH.insert(0, os.path.join(os.path.dirname(__file__), 'views/'))
 
+# requests handled in parallel by default server
+POOL_SIZE = 16
+# event streams allowed in parallel, each one uses a server thread
+MAX_STREAMS = 8
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    '''
+    wsgiref server handling requests in a bounded thread pool
+    '''
+    pool_size = POOL_SIZE
+
+    def server_activate(self):
+        WSGIServer.server_activate(self)
+        self._pool = WorkerPool(self.pool_size, 'ZiGate-Adminpanel')
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        WSGIServer.server_close(self)
+        self._pool.shutdown(False)
+
+
+class ThreadPoolServer(bottle.WSGIRefServer):
+    '''
+    bottle server adapter using ThreadPoolWSGIServer, option pool_size
+    '''
+    def run(self, app):
+        pool_size = self.options.pop('pool_size', POOL_SIZE)
+        self.options['server_class'] = type('ThreadPoolWSGIServer', (ThreadPoolWSGIServer,),
+                                            {'pool_size': pool_size})
+        bottle.WSGIRefServer.run(self, app)
+
 
 def start_adminpanel(zigate_instance, host=ADMINPANEL_HOST, port=ADMINPANEL_PORT, mount=None, prefix=None,
-                     autostart=True, daemon=True, quiet=True, debug=False):
+                     autostart=True, daemon=True, quiet=True, debug=False, server=None, pool_size=POOL_SIZE,
+                     max_streams=MAX_STREAMS):
     '''
     mount: url prefix used to mount bottle application
     prefix: special prefix added when using get_url in template, eg proxy.php
+    server: bottle server name or adapter, default to thread pool wsgiref server of pool_size threads
+    max_streams: maximum parallel event streams
     '''
     app = bottle.Bottle()
     app.install(bottle.JSONPlugin(json_dumps=lambda s: dumps(s, cls=DeviceEncoder)))
@@ -52,6 +102,33 @@ def start_adminpanel(zigate_instance, host=ADMINPANEL_HOST, port=ADMINPANEL_PORT
     bottle.BaseTemplate.defaults['get_url'] = get_url
     bottle.BaseTemplate.defaults['zigate'] = zigate_instance
     app.zigate = zigate_instance
+    app.events = EventStream()
+    app.jobs = JobManager()
+    if server is None:  # keep threads for other requests
+        max_streams = min(max_streams, pool_size - 1)
+    device_cache = {}  # addr to (change version, serialized device)
+    devices_cache = {}  # key to serialized devices list
+
+    def json_body(body, etag):
+        '''
+        return serialized json body with ETag or 304 if unchanged
+        '''
+        if bottle.request.headers.get('If-None-Match') == etag:
+            return bottle.HTTPResponse(status=304, ETag=etag)
+        bottle.response.content_type = 'application/json'
+        bottle.response.set_header('ETag', etag)
+        return body
+
+    def device_json(d):
+        cached = device_cache.get(d.addr)
+        if cached and cached[0] == d.change_version:
+            return cached[1]
+        version = d.change_version
+        device = d.to_json()
+        device['friendly_name'] = str(d)
+        data = dumps(device, cls=DeviceEncoder)
+        device_cache[d.addr] = (version, data)
+        return data
 
     @app.route('/', name='index')
     @bottle.view('index')
@@ -106,6 +183,17 @@ def start_adminpanel(zigate_instance, host=ADMINPANEL_HOST, port=ADMINPANEL_PORT
     def networkmap():
         return
 
+    @app.route('/ota', name='ota')
+    @bottle.view('ota')
+    def ota():
+        return zigate_instance.ota_metrics()
+
+    @app.route('/ota/config', name='ota_config', method=['POST'])
+    def ota_config():
+        zigate_instance.ota_configure(float(bottle.request.forms.get('block_delay', 0)),
+                                      int(bottle.request.forms.get('max_data_size', 0)))
+        return redirect('ota')
+
     @app.route('/device/<addr>', name='device')
     @bottle.view('device')
     def device(addr):
@@ -138,15 +226,33 @@ def start_adminpanel(zigate_instance, host=ADMINPANEL_HOST, port=ADMINPANEL_PORT
         zigate_instance.set_led(on)
         return redirect('index')
 
+    def job_accepted(job):
+        '''
+        return 202 with job status url
+        '''
+        bottle.response.status = 202
+        url = get_url('api_job', job_id=job.id)
+        bottle.response.set_header('Location', url)
+        return {'job': job.to_json(), 'status_url': url}
+
     @app.route('/api/discover/<addr>', name='api_discover')
     def api_discover(addr):
-        zigate_instance.discover_device(addr, True)
-        return redirect('device', addr=addr)
+        return job_accepted(app.jobs.submit('discover_{}'.format(addr), zigate_instance.discover_device, addr, True))
 
     @app.route('/api/refresh/<addr>', name='api_refresh')
     def api_refresh(addr):
-        zigate_instance.refresh_device(addr)
-        return redirect('device', addr=addr)
+        return job_accepted(app.jobs.submit('refresh_{}'.format(addr), zigate_instance.refresh_device, addr))
+
+    @app.route('/api/jobs', name='api_jobs')
+    def api_jobs():
+        return {'jobs': [job.to_json() for job in app.jobs.jobs()]}
+
+    @app.route('/api/jobs/<job_id:int>', name='api_job')
+    def api_job(job_id):
+        job = app.jobs.get(job_id)
+        if not job:
+            return bottle.HTTPError(404, 'Unknown job')
+        return job.to_json()
 
     @app.route('/api/remove/<addr>', name='api_remove')
     def api_remove(addr):
@@ -160,28 +266,96 @@ def start_adminpanel(zigate_instance, host=ADMINPANEL_HOST, port=ADMINPANEL_PORT
         if not device:
             return redirect('index')
         device.name = bottle.request.forms.name
+        device._changed()
         return redirect('device', addr=addr)
 
     @app.route('/api/devices', name='api_devices')
     def devices():
-        devices = [{'info': {'addr': zigate_instance.addr,
-                             'ieee': zigate_instance.ieee
-                             },
-                    'friendly_name': 'ZiGate'
-                    }]
-        for d in zigate_instance.devices:
-            device = d.to_json()
-            device['friendly_name'] = str(d)
-            devices.append(device)
-        return {'devices': devices}
+        '''
+        devices list, cached until a device changes,
+        since: only devices changed (and removed addresses) since this change version
+        '''
+        version = zigate_instance.change_version
+        key = (version, zigate_instance.addr, zigate_instance.ieee)
+        since = bottle.request.query.get('since')
+        if since:
+            try:
+                since = int(since)
+            except ValueError:
+                return bottle.HTTPError(400, 'Invalid since')
+            etag = '"{}-{}-{}-{}"'.format(since, *key)
+            devices, removed = zigate_instance.get_changes(since)
+            body = '{{"version": {}, "devices": [{}], "removed": {}}}'.format(
+                version, ', '.join(map(device_json, devices)), dumps(removed))
+            return json_body(body, etag)
+        etag = '"{}-{}-{}"'.format(*key)
+        if bottle.request.headers.get('If-None-Match') == etag:
+            return json_body(None, etag)
+        # cache may be cleared by a concurrent request, body is kept locally
+        body = devices_cache.get(key)
+        if body is None:
+            devices = [dumps({'info': {'addr': zigate_instance.addr,
+                                       'ieee': zigate_instance.ieee
+                                       },
+                              'friendly_name': 'ZiGate'
+                              })]
+            devices += [device_json(d) for d in zigate_instance.devices]
+            body = '{{"version": {}, "devices": [{}]}}'.format(version, ', '.join(devices))
+            devices_cache.clear()
+            devices_cache[key] = body
+            for addr in set(device_cache) - set(zigate_instance._devices):
+                device_cache.pop(addr, None)
+        return json_body(body, etag)
 
     @app.route('/api/network_table', name='api_network_table')
     def network_table():
         force = bottle.request.query.get('force', 'false') == 'true'
-        return {'network_table': zigate_instance.build_neighbours_table(force)}
+        if force:  # network crawl could be long
+            return job_accepted(app.jobs.submit('network_table', zigate_instance.build_neighbours_table, True))
+        body = dumps({'network_table': zigate_instance.build_neighbours_table(force)})
+        return json_body(body, '"{:08x}"'.format(zlib.crc32(body.encode())))
+
+    @app.route('/api/ota', name='api_ota')
+    def api_ota():
+        return zigate_instance.ota_metrics()
+
+    @app.route('/metrics', name='metrics')
+    def metrics():
+        bottle.response.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        return zigate_metrics.REGISTRY.render()
+
+    @app.route('/api/traces', name='api_traces')
+    def api_traces():
+        '''
+        latency traces in Chrome trace-event format
+        '''
+        return zigate_instance.export_traces()
+
+    @app.route('/api/events', name='api_events')
+    def api_events():
+        '''
+        server-sent events stream, optional filters:
+        events: comma separated events (attribute, device_added, device_updated,
+        device_removed, device_address_changed, network_table)
+        addr: comma separated devices addresses
+        '''
+        events = [e for e in bottle.request.query.get('events', '').split(',') if e]
+        addrs = [a for a in bottle.request.query.get('addr', '').split(',') if a]
+        if len(app.events.subscribers) >= max_streams:
+            return bottle.HTTPError(503, 'Too many event streams')
+        subscriber = app.events.subscribe(events, addrs)
+        bottle.response.content_type = 'text/event-stream'
+        bottle.response.set_header('Cache-Control', 'no-cache')
+        bottle.response.set_header('X-Accel-Buffering', 'no')
+        return app.events.stream(subscriber)
 
     kwargs = {'host': host, 'port': port,
               'quiet': quiet, 'debug': debug}
+    if server is None:
+        kwargs['server'] = ThreadPoolServer
+        kwargs['pool_size'] = pool_size
+    else:
+        kwargs['server'] = server
 
     if autostart:
         r_app = app
@@ -0,0 +1,152 @@
+#
+# Copyright (c) 2018 Sébastien RAMAGE
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+import collections
+import json
+import threading
+from pydispatch import dispatcher
+from zigate.core import DeviceEncoder
+from zigate.const import (ZIGATE_ATTRIBUTE_ADDED, ZIGATE_ATTRIBUTE_UPDATED,
+                          ZIGATE_DEVICE_ADDED, ZIGATE_DEVICE_UPDATED,
+                          ZIGATE_DEVICE_REMOVED, ZIGATE_DEVICE_ADDRESS_CHANGED,
+                          ZIGATE_NETWORK_TABLE_UPDATED)
+
+# signal to event name
+EVENTS = {ZIGATE_ATTRIBUTE_ADDED: 'attribute',
+          ZIGATE_ATTRIBUTE_UPDATED: 'attribute',
+          ZIGATE_DEVICE_ADDED: 'device_added',
+          ZIGATE_DEVICE_UPDATED: 'device_updated',
+          ZIGATE_DEVICE_REMOVED: 'device_removed',
+          ZIGATE_DEVICE_ADDRESS_CHANGED: 'device_address_changed',
+          ZIGATE_NETWORK_TABLE_UPDATED: 'network_table',
+          }
+# events buffered per client, oldest are dropped
+MAX_EVENTS = 100
+# seconds between keepalive comments
+KEEPALIVE = 15
+
+
+class Subscriber(object):
+    '''
+    client of the event stream with its filters and its bounded buffer
+    '''
+    def __init__(self, events=None, addrs=None, max_events=MAX_EVENTS):
+        self.events = set(events) if events else None
+        self.addrs = set(addrs) if addrs else None
+        self.buffer = collections.deque(maxlen=max_events)
+        self.dropped = 0
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def match(self, event, addr):
+        if self.events is not None and event not in self.events:
+            return False
+        if self.addrs is not None and addr is not None and addr not in self.addrs:
+            return False
+        return True
+
+    def put(self, message):
+        with self._condition:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(message)
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        '''
+        return buffered messages, waiting at most timeout seconds
+        '''
+        with self._condition:
+            if not self.buffer and not self.closed:
+                self._condition.wait(timeout)
+            messages = list(self.buffer)
+            self.buffer.clear()
+        return messages
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+
+
+class EventStream(object):
+    '''
+    Server-sent events from zigate signals,
+    an event is serialized once whatever the number of subscribers
+    '''
+    def __init__(self, max_events=MAX_EVENTS, keepalive=KEEPALIVE):
+        self.max_events = max_events
+        self.keepalive = keepalive
+        self.subscribers = []
+        self._lock = threading.Lock()
+        self._event_id = 0
+
+    def subscribe(self, events=None, addrs=None):
+        subscriber = Subscriber(events, addrs, self.max_events)
+        with self._lock:
+            if not self.subscribers:
+                for signal in EVENTS:
+                    dispatcher.connect(self._on_signal, signal)
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        with self._lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            if not self.subscribers:
+                for signal in EVENTS:
+                    dispatcher.disconnect(self._on_signal, signal)
+
+    def close(self):
+        for subscriber in list(self.subscribers):
+            self.unsubscribe(subscriber)
+
+    def _payload(self, event, named):
+        device = named.get('device')
+        if event == 'attribute':
+            return {'addr': device.addr if device else None, 'attribute': named.get('attribute')}
+        if event == 'device_removed':
+            return {'addr': named.get('addr')}
+        if event == 'device_address_changed':
+            return {'old_addr': named.get('old_addr'), 'new_addr': named.get('new_addr')}
+        if event == 'network_table':
+            return {'network_table': named.get('network_table')}
+        return {'addr': device.addr, 'device': device}
+
+    def _on_signal(self, signal=None, **named):
+        event = EVENTS.get(signal)
+        device = named.get('device')
+        addr = named.get('addr') or named.get('new_addr')
+        if device is not None:
+            addr = device.addr
+        with self._lock:
+            subscribers = [s for s in self.subscribers if s.match(event, addr)]
+            if not subscribers:
+                return
+            self._event_id += 1
+            event_id = self._event_id
+        data = json.dumps(self._payload(event, named), cls=DeviceEncoder)
+        message = 'id: {}\nevent: {}\ndata: {}\n\n'.format(event_id, event, data)
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def stream(self, subscriber):
+        '''
+        generator of server-sent events for subscriber
+        '''
+        try:
+            yield 'retry: 3000\n\n'
+            while not subscriber.closed:
+                messages = subscriber.get(self.keepalive)
+                if not messages:
+                    yield ': keepalive\n\n'
+                for message in messages:
+                    yield message
+        finally:
+            self.unsubscribe(subscriber)
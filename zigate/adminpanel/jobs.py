@@ -0,0 +1,150 @@
+#
+# Copyright (c) 2018 Sébastien RAMAGE
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+import collections
+import logging
+import queue
+import threading
+import time
+
+LOGGER = logging.getLogger('zigate')
+
+JOB_WORKERS = 2
+# finished jobs kept for status request
+JOB_HISTORY = 50
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class WorkerPool(object):
+    '''
+    bounded pool of daemon threads, started on demand,
+    unlike ThreadPoolExecutor exit is never blocked by a running task
+    '''
+    def __init__(self, workers, name='ZiGate-Worker'):
+        self.workers = workers
+        self.name = name
+        self._queue = queue.Queue()
+        self._threads = []
+        self._idle = 0
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args):
+        with self._lock:
+            if self._idle:
+                self._idle -= 1
+            elif len(self._threads) < self.workers:
+                t = threading.Thread(target=self._worker, name='{}-{}'.format(self.name, len(self._threads)),
+                                     daemon=True)
+                self._threads.append(t)
+                t.start()
+            self._queue.put((func, args))
+
+    def _worker(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            func, args = task
+            try:
+                func(*args)
+            except Exception:
+                LOGGER.exception('Task failed in %s', self.name)
+            with self._lock:
+                self._idle += 1
+
+    def shutdown(self, wait=True):
+        for t in self._threads:
+            self._queue.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
+        self._threads = []
+        self._idle = 0
+
+
+class Job(object):
+    '''
+    long operation (network crawl, refresh, discovery) running in background
+    '''
+    def __init__(self, job_id, name, func, args):
+        self.id = job_id
+        self.name = name
+        self.func = func
+        self.args = args
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.status in (PENDING, RUNNING)
+
+    def run(self):
+        self.status = RUNNING
+        self.started = time.time()
+        try:
+            self.result = self.func(*self.args)
+            self.status = DONE
+        except Exception as e:
+            LOGGER.exception('Job %s failed', self.name)
+            self.error = str(e)
+            self.status = FAILED
+        self.finished = time.time()
+
+    def to_json(self):
+        return {'id': self.id,
+                'name': self.name,
+                'status': self.status,
+                'result': self.result,
+                'error': self.error,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished}
+
+
+class JobManager(object):
+    '''
+    run jobs in a bounded thread pool,
+    a job with the same name as an active job is not started again
+    '''
+    def __init__(self, workers=JOB_WORKERS, history=JOB_HISTORY):
+        self._pool = WorkerPool(workers, 'ZiGate-Job')
+        self._jobs = collections.OrderedDict()
+        self._history = history
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def submit(self, name, func, *args):
+        with self._lock:
+            for job in self._jobs.values():
+                if job.name == name and job.active:
+                    return job
+            job = Job(self._next_id, name, func, args)
+            self._next_id += 1
+            self._jobs[job.id] = job
+            finished = [j.id for j in self._jobs.values() if not j.active]
+            for job_id in finished[:max(len(finished) - self._history, 0)]:
+                del self._jobs[job_id]
+        self._pool.submit(job.run)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait)
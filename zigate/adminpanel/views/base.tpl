@@ -16,6 +16,7 @@
 			<ul class="pure-menu-list">
 				<li class="pure-menu-item"><a class="pure-menu-link" href="{{get_url('index')}}">Index</a></li>
 				<li class="pure-menu-item"><a class="pure-menu-link" href="{{get_url('networkmap')}}">Network Map</a></li>
+				<li class="pure-menu-item"><a class="pure-menu-link" href="{{get_url('ota')}}">OTA</a></li>
 			</ul>
 		</div>
 		<h2>{{get('subtitle', 'Index')}}</h2>
@@ -103,7 +103,7 @@
         refreshData();
     });
 
-    function refreshData(force = false) {
+    function refreshData() {
         let zigateDevicesStates = new Array();
         let addrToIeeeTable = new Array();
 
@@ -147,7 +147,7 @@
             _nodesDataset.flush();
 
             var duplicates = [];
-            $.getJSON('{{get_url('api_network_table')}}', { 'force': force }, function (data) {
+            $.getJSON('{{get_url('api_network_table')}}', function (data) {
                 var network_table = data['network_table'];
                 var links = network_table.sort((a, b) => a[2] > b[2] ? -1 : 0);
                 links.forEach(function (link) {
@@ -188,10 +188,23 @@
         });
     }
     $('#bt_refresh').click(function () {
-        refreshData(false);
+        refreshData();
     });
 
+    function waitJob(url) {
+        $.getJSON(url, function (job) {
+            if (job.status == 'pending' || job.status == 'running') {
+                setTimeout(function () { waitJob(url); }, 1000);
+            } else {
+                refreshData();
+            }
+        });
+    }
+
     $('#bt_force_refresh').click(function () {
-        refreshData(true);
+        // network crawl runs in background, wait for the job before refreshing
+        $.getJSON('{{get_url('api_network_table')}}', { 'force': true }, function (data) {
+            waitJob(data['status_url']);
+        });
     });
 </script>
@@ -0,0 +1,48 @@
+% rebase('base.tpl', subtitle='OTA')
+<div style="display: inline-block; vertical-align: top;">
+	<h3>Configuration</h3>
+	<form method="post" action="{{get_url('ota_config')}}">
+	<label for="block_delay">Block delay (s) : </label><input type="text" name="block_delay" value="{{config['block_delay']}}">
+	<label for="max_data_size">Max data size : </label><input type="text" name="max_data_size" value="{{config['max_data_size'] or 0}}">
+	<input type="submit" name="Save">
+	</form>
+</div>
+
+% for title, sessions in (('Active sessions', active), ('Completed sessions', completed)):
+<div style="vertical-align: top;">
+	<h3>{{title}}</h3>
+	<table class="pure-table pure-table-bordered">
+		<thead>
+			<tr>
+				<th>Addr</th>
+				<th>Image</th>
+				<th>Progress</th>
+				<th>Elapsed (s)</th>
+				<th>Blocks/s</th>
+				<th>Bytes/s</th>
+				<th>Retransmits</th>
+				<th>Host time (s)</th>
+				<th>Radio time (s)</th>
+				<th>Latency histogram</th>
+			</tr>
+		</thead>
+		<tbody>
+		% for session in sessions:
+			% metrics = session['metrics']
+			<tr>
+				<td><a href="{{get_url('device', addr=session['addr'])}}">{{session['addr']}}</a></td>
+				<td>0x{{'{:04x}'.format(session['manufacturer_code'])}} 0x{{'{:04x}'.format(session['image_type'])}} 0x{{'{:08x}'.format(session['image_version'])}}</td>
+				<td>{{'{:.1%}'.format(session['progress'])}}</td>
+				<td>{{int(session['elapsed'])}}</td>
+				<td>{{'{:.2f}'.format(metrics['blocks_per_second'])}}</td>
+				<td>{{'{:.0f}'.format(metrics['bytes_per_second'])}}</td>
+				<td>{{metrics['retransmits']}}</td>
+				<td>{{'{:.3f}'.format(metrics['host_time'])}}</td>
+				<td>{{'{:.3f}'.format(metrics['radio_time'])}}</td>
+				<td>{{', '.join('{} : {}'.format(k, v) for k, v in metrics['latency_histogram'].items() if v)}}</td>
+			</tr>
+		% end
+		</tbody>
+	</table>
+</div>
+% end
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2018 Sébastien RAMAGE
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+"""
+Microbenchmarks of core hot paths, offline
+
+python3 -m zigate.benchmark --save baseline.json
+python3 -m zigate.benchmark --baseline baseline.json --tolerance 0.25
+python3 -m zigate.benchmark --filter response. --json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import struct
+import tempfile
+import time
+from binascii import unhexlify
+from collections import OrderedDict
+from . import clusters
+from .clusters import CLUSTERS
+from .const import BASE_PATH
+from .core import FakeZiGate, Device, DeviceEncoder
+from .responses import RESPONSES
+from .transport import BaseTransport, FakeTransport
+from .version import __version__
+
+BENCHMARKS = OrderedDict()  # group to function yielding (name, callable)
+MIN_TIME = 0.2
+REPEAT = 3
+TOLERANCE = 0.25
+STATE_DEVICES = 100
+
+# real payloads, other responses are decoded from a synthetic payload
+RESPONSE_SAMPLES = {0x8000: '00010001',
+                    0x8002: '00010000060201030123456789abcdef03fedcba98765432100401234567',
+                    0x8009: '00000123456789abcdef12340123456789abcdef0b',
+                    0x8015: '00abcd0123456789abcdef00aa01abce0123456789abcdf000aa',
+                    0x8024: '01123400000000000000000b',
+                    0x8043: '0100abcd1001010401000003000000030006010019',
+                    0x804E: 'e6000e02001d4ddb95a5201556ccd800158d0001e563720ffd0100',
+                    0x8062: '0101000412341002abcd9876',
+                    0x80A6: '010100050010abcd0201021234',
+                    0x8100: '01abcd01040200000029000208fc',
+                    0x8102: '01abcd01040200000029000208fc',
+                    0x8110: '01abcd01040200000029000208fc',
+                    0x8122: '0112340100080020000000010e10',
+                    0x8140: '00300008932d030300',
+                    0x8702: 'd40103020123456789abcdefb9',
+                    }
+XIAOMI = '0121e50b0328190421a8130521090006240100000000642962066521f70c0a2100006410000b2100000'
+# candidate raw data to find one evaluating each cluster attribute definition
+DATA_CANDIDATES = (1, 'lumi.weather', '10' + XIAOMI[2:], XIAOMI, '0000000000000000')
+
+
+def register_benchmark(group):
+    def decorator(func):
+        BENCHMARKS[group] = func
+        return func
+    return decorator
+
+
+def encode_frame(msg_type, payload, lqi=255):
+    return FakeTransport().create_fake_response(msg_type, payload, lqi)
+
+
+def synthetic_payload(cls):
+    '''
+    longest generated payload the response could decode, up to 32 bytes
+    '''
+    for length in range(32, -1, -1):
+        payload = bytes(range(1, length + 1))
+        try:
+            cls(payload, 255)
+            return payload
+        except Exception:
+            continue
+
+
+def response_payload(msg_type, cls):
+    if msg_type in RESPONSE_SAMPLES:
+        return unhexlify(RESPONSE_SAMPLES[msg_type])
+    return synthetic_payload(cls)
+
+
+def attribute_data(cluster, attribute_id, attr_def):
+    for data in DATA_CANDIDATES:
+        try:
+            eval(attr_def['value'], vars(clusters), {'value': data, 'self': cluster})
+            cluster.update({'attribute': attribute_id, 'data': data})
+            return data
+        except Exception:
+            continue
+
+
+def synthetic_devices(zigate, count):
+    '''
+    create count devices from templates
+    '''
+    templates = []
+    dirname = os.path.join(BASE_PATH, 'templates')
+    for filename in sorted(os.listdir(dirname)):
+        with open(os.path.join(dirname, filename)) as fp:
+            templates.append(json.load(fp))
+    for i in range(count):
+        device = Device.from_json(templates[i % len(templates)], zigate)
+        device.info.update({'addr': '{:04x}'.format(i + 1),
+                            'ieee': '{:016x}'.format(0x00158d0000000000 + i),
+                            'lqi': 200,
+                            'last_seen': '2018-01-01 00:00:00',
+                            'need_report': False})
+        device.discovery = 'templated'
+        zigate._devices[device.addr] = device
+    return zigate
+
+
+@register_benchmark('framing')
+def framing():
+    frame = encode_frame(0x8102, unhexlify(RESPONSE_SAMPLES[0x8102]))
+    data = frame * 10
+    connection = BaseTransport()
+
+    def read_data():
+        connection.read_data(data)
+        connection.received.queue.clear()
+    yield 'framing.read_data_10_frames', read_data
+    zigate = FakeZiGate(auto_start=False, path=None)
+    decoded = bytes(zigate.zigate_decode(frame[1:-1]))
+    yield 'framing.zigate_encode', lambda: zigate.zigate_encode(decoded)
+    yield 'framing.zigate_decode', lambda: zigate.zigate_decode(frame[1:-1])
+    yield 'framing.checksum', lambda: zigate.checksum(decoded[:4], decoded[-1], decoded[5:-1])
+    yield 'framing.unpack', lambda: struct.unpack('!HHB%dsB' % (len(decoded) - 6), decoded)
+    zigate._devices['abcd'].discovery = 'templated'
+    yield 'framing.decode_data_0x8102', lambda: zigate.decode_data(frame)
+
+
+@register_benchmark('response')
+def responses():
+    for msg_type, cls in sorted(RESPONSES.items()):
+        payload = response_payload(msg_type, cls)
+        if payload is None:
+            continue
+        yield 'response.0x{:04x}'.format(msg_type), lambda cls=cls, payload=payload: cls(payload, 255)
+
+
+@register_benchmark('cluster')
+def cluster_update():
+    for cluster_id, cls in sorted(CLUSTERS.items()):
+        cluster = cls()
+        samples = []
+        for attribute_id, attr_def in sorted(cls.attributes_def.items()):
+            data = attribute_data(cluster, attribute_id, attr_def)
+            if data is not None:
+                samples.append({'attribute': attribute_id, 'data': data})
+
+        def update(cluster=cluster, samples=samples):
+            for data in samples:
+                cluster.update(dict(data))
+        yield 'cluster.0x{:04x}'.format(cluster_id), update
+
+
+@register_benchmark('device')
+def device_set_attribute():
+    zigate = FakeZiGate(auto_start=False, path=None)
+    device = zigate.get_device_from_addr('abcd')
+    device.discovery = 'templated'
+    yield 'device.set_attribute', lambda: device.set_attribute(1, 0x0402, {'attribute': 0, 'data': 2150})
+    yield 'device.set_attribute_quirks', lambda: device.set_attribute(1, 0x0000, {'attribute': 0xff01,
+                                                                                  'data': XIAOMI})
+    # same properties on two endpoints, renamed by _avoid_duplicate
+    switch = Device({'addr': 'abce', 'ieee': '0123456789abcdf0'}, zigate)
+    switch.discovery = 'templated'
+    zigate._devices['abce'] = switch
+    for endpoint_id in (1, 2, 3):
+        switch.set_attribute(endpoint_id, 0x0006, {'attribute': 0, 'data': True})
+    yield 'device.set_attribute_duplicate', lambda: switch.set_attribute(3, 0x0006, {'attribute': 0, 'data': False})
+
+
+@register_benchmark('state')
+def state(devices=STATE_DEVICES):
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'state.json')
+    zigate = synthetic_devices(FakeZiGate(auto_start=False, path=path), devices)
+    zigate.save_state()
+
+    def load_state():
+        FakeZiGate(auto_start=False, path=path).load_state()
+    yield 'state.save_state_{}'.format(devices), zigate.save_state
+    yield 'state.load_state_{}'.format(devices), load_state
+    yield 'state.device_encoder_{}'.format(devices), lambda: json.dumps(zigate.devices, cls=DeviceEncoder)
+    device = zigate.devices[0]
+    yield 'state.device_encoder_1', lambda: json.dumps(device, cls=DeviceEncoder)
+    os.remove(path)
+    os.rmdir(tmp)
+
+
+def measure(func, min_time=MIN_TIME, repeat=REPEAT):
+    '''
+    return best time per call of func, called enough times to last min_time
+    '''
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    best = elapsed
+    for i in range(repeat - 1):
+        start = time.perf_counter()
+        for i in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / number, number
+
+
+def run(filters=None, min_time=MIN_TIME, repeat=REPEAT):
+    '''
+    run benchmarks whose name starts with one of filters
+    and return results dict
+    '''
+    results = OrderedDict()
+    level = logging.getLogger('zigate').level
+    logging.getLogger('zigate').setLevel(logging.CRITICAL)
+    try:
+        for group, func in BENCHMARKS.items():
+            if filters and not any(group.startswith(f) or f.startswith(group) for f in filters):
+                continue
+            for name, benchmark in func():
+                if filters and not any(name.startswith(f) for f in filters):
+                    continue
+                seconds, number = measure(benchmark, min_time, repeat)
+                results[name] = {'seconds': seconds, 'number': number}
+    finally:
+        logging.getLogger('zigate').setLevel(level)
+    return {'version': __version__,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results}
+
+
+def compare(result, baseline, tolerance=TOLERANCE):
+    '''
+    return list of (name, baseline seconds, seconds, ratio) slower than baseline by more than tolerance
+    '''
+    regressions = []
+    for name, current in result['results'].items():
+        reference = baseline['results'].get(name)
+        if not reference or not reference['seconds']:
+            continue
+        ratio = current['seconds'] / reference['seconds']
+        if ratio > 1 + tolerance:
+            regressions.append((name, reference['seconds'], current['seconds'], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ZiGate core hot paths benchmarks')
+    parser.add_argument('--filter', action='append', help='only benchmarks starting with this name')
+    parser.add_argument('--min_time', type=float, default=MIN_TIME, help='minimum duration of a measure')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='measures per benchmark, best is kept')
+    parser.add_argument('--baseline', help='compare with results file, exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed slowdown ratio')
+    parser.add_argument('--save', help='save results to file')
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    args = parser.parse_args()
+    result = run(args.filter, args.min_time, args.repeat)
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(result, fp, indent=2)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for name, r in result['results'].items():
+            print('{:45} {:12.2f} us'.format(name, r['seconds'] * 1e6))
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        regressions = compare(result, baseline, args.tolerance)
+        for name, reference, seconds, ratio in regressions:
+            print('REGRESSION {}: {:.2f} us -> {:.2f} us (x{:.2f})'.format(name, reference * 1e6,
+                                                                           seconds * 1e6, ratio))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
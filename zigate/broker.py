@@ -7,63 +7,358 @@
 
 import threading
 import socket
+import selectors
+import logging
+import os
+import struct
 import sys
+import time
+from .responses import RESPONSES
+
+
+LOGGER = logging.getLogger('zigate')
+
+# maximum bytes waiting to be sent to a client
+MAX_BUFFER = 256 * 1024
+POLICY_DROP = 'drop'
+POLICY_DISCONNECT = 'disconnect'
+# seconds an in-flight command waits for its status and response
+RESPONSE_TIMEOUT = 5
+# maximum bytes given to a single socket send
+WRITE_CHUNK = 64 * 1024
+
+
+class Client(object):
+    '''
+    client connected to the broker
+    '''
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.input = b''  # incomplete frame received from client
+        self.output = bytearray()  # frames waiting to be sent
+        self.dropped = 0
+        self.closing = False
+
+    def split_frames(self, data):
+        '''
+        return complete frames (0x01 ... 0x03) received from client
+        '''
+        self.input += data
+        frames = []
+        endpos = self.input.find(b'\x03')
+        while endpos != -1:
+            startpos = self.input.rfind(b'\x01', 0, endpos)
+            if startpos != -1:
+                frames.append(self.input[startpos:endpos + 1])
+            else:
+                LOGGER.error('Malformed packet received from %s, ignore it', self.addr)
+            self.input = self.input[endpos + 1:]
+            endpos = self.input.find(b'\x03')
+        return frames
+
+    def __repr__(self):
+        return 'Client({})'.format(self.addr)
+
+
+def has_sequence(msg_type):
+    '''
+    return True if response msg_type starts with the sequence of the command status
+    '''
+    response = RESPONSES.get(msg_type)
+    fields = getattr(response, 's', None)
+    return bool(fields) and next(iter(fields)) == 'sequence'
+
+
+class Command(object):
+    '''
+    command sent by a client, waiting for its status (0x8000)
+    and its response (cmd | 0x8000) if such a response exists
+    '''
+    def __init__(self, client, cmd):
+        self.client = client
+        self.cmd = cmd
+        self.response = cmd | 0x8000 if cmd | 0x8000 in RESPONSES else None
+        self.created = time.monotonic()
+        self.status = None
+        self.sequence = None
+        self.responded = False
+
+    @property
+    def done(self):
+        if self.status is None:
+            return False
+        return self.status != 0 or self.response is None or self.responded
+
+    def match(self, msg_type, sequence):
+        '''
+        return True if frame msg_type with sequence (None if unknown) is the response
+        '''
+        if self.response != msg_type or self.responded or self.status is None:
+            return False
+        return sequence is None or sequence == self.sequence
+
+    def __repr__(self):
+        return 'Command(0x{:04x}, {})'.format(self.cmd, self.client)
 
 
 class Broker(threading.Thread):
-    def __init__(self, zigate, port=9999, host='0.0.0.0'):
-        threading.Thread.__init__(self)
+    '''
+    Share a ZiGate between several TCP (or unix socket) clients.
+    A single selectors loop serves all clients, frames from ZiGate are
+    queued in bounded per-client buffers, when a client buffer is full
+    the frame is dropped (policy 'drop') or the client disconnected
+    (policy 'disconnect').
+    In multiplex mode, commands sent by clients are tracked in an in-flight
+    table and their status and response are only sent to the originating
+    client, other frames are broadcasted. Statuses are matched on command type,
+    responses on type and on status sequence when the response carries it.
+    '''
+    def __init__(self, zigate, port=9999, host='0.0.0.0', unix_socket=None,
+                 max_buffer=MAX_BUFFER, policy=POLICY_DROP, multiplex=False,
+                 response_timeout=RESPONSE_TIMEOUT):
+        threading.Thread.__init__(self, name='ZiGate-Broker', daemon=True)
         self.zigate = zigate
         self.zigate.decode_data = self.forward_msg
         self.port = port
         self.host = host
+        self.unix_socket = unix_socket
+        self.max_buffer = max_buffer
+        self.policy = policy
+        self.multiplex = multiplex
+        self.response_timeout = response_timeout
+        self.clients = {}
+        self._inflight = []
+        self._lock = threading.Lock()
+        self._closing = False
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, 'wakeup')
+        self.servers = []
+
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.users = []
-
         try:
             self.server.bind((self.host, self.port))
-        except socket.error:
-            print('Bind failed %s' % (socket.error))
+        except socket.error as e:
+            print('Bind failed %s' % e)
             sys.exit()
+        self.servers.append(self.server)
 
-        self.server.listen()
+        if unix_socket:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(unix_socket)
+            self.servers.append(server)
+
+        for server in self.servers:
+            server.listen()
+            server.setblocking(False)
+            self._selector.register(server, selectors.EVENT_READ, 'accept')
 
     def exit(self):
+        self._closing = True
+        self._wakeup()
         self.zigate.close()
-        self.server.close()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'\x00')
+        except (BlockingIOError, OSError):
+            pass  # already woken up
 
     def forward_msg(self, raw_message):
-        raw_message = raw_message
-        to_remove = []
-        for conn, addr in self.users:
+        '''
+        queue frame received from ZiGate for every client
+        '''
+        with self._lock:
+            if self.multiplex:
+                clients = self._route(raw_message)
+            else:
+                clients = self.clients.values()
+            for client in clients:
+                self._queue_frame(client, raw_message)
+        self._wakeup()
+
+    def _route(self, frame):
+        '''
+        return clients the frame should be sent to
+        '''
+        now = time.monotonic()
+        self._inflight = [command for command in self._inflight
+                          if now - command.created < self.response_timeout and
+                          command.client.sock in self.clients]
+        try:
+            decoded = self.zigate.zigate_decode(frame[1:-1])
+            msg_type = struct.unpack('!H', decoded[:2])[0]
+            sequence = None
+            if msg_type == 0x8000:
+                status, sequence, packet_type = struct.unpack('!BBH', decoded[5:9])
+            elif has_sequence(msg_type):
+                sequence = decoded[5]
+        except Exception:
+            LOGGER.error('Failed to decode frame, broadcast it')
+            return list(self.clients.values())
+        for command in self._inflight:
+            if msg_type == 0x8000:
+                # ZiGate answers commands in order, status goes to the oldest command of that type
+                if command.cmd != packet_type or command.status is not None:
+                    continue
+                command.status = status
+                command.sequence = sequence
+            elif command.match(msg_type, sequence):
+                command.responded = True
+            else:
+                continue
+            if command.done:
+                self._inflight.remove(command)
+            return [command.client]
+        return list(self.clients.values())
+
+    def _queue_frame(self, client, frame):
+        if len(client.output) + len(frame) > self.max_buffer:
+            if self.policy == POLICY_DISCONNECT:
+                client.closing = True
+            else:
+                client.dropped += 1
+                if client.dropped == 1 or client.dropped % 100 == 0:
+                    LOGGER.warning('Client %s too slow, %s frames dropped', client.addr, client.dropped)
+            return
+        client.output += frame
+
+    def _accept(self, server):
+        conn, addr = server.accept()
+        conn.setblocking(False)
+        if not addr:  # unix socket
+            addr = (self.unix_socket, conn.fileno())
+        print('Client connected with ' + str(addr[0]) + ':' + str(addr[1]))
+        client = Client(conn, addr)
+        with self._lock:
+            self.clients[conn] = client
+        self._selector.register(conn, selectors.EVENT_READ, client)
+
+    def _close_client(self, client):
+        print('Client disconnected ' + str(client.addr[0]) + ':' + str(client.addr[1]))
+        with self._lock:
+            self.clients.pop(client.sock, None)
+        try:
+            self._selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close_client(client)
+            return
+        for frame in client.split_frames(data):
+            self.send_frame(client, frame)
+
+    def send_frame(self, client, frame):
+        '''
+        send a complete frame from client to ZiGate
+        '''
+        if not self.multiplex:
+            self.zigate.send_to_transport(frame)
+            return
+        try:
+            cmd = struct.unpack('!H', self.zigate.zigate_decode(frame[1:-1])[:2])[0]
+        except Exception:
+            LOGGER.error('Malformed frame received from %s, ignore it', client.addr)
+            return
+        with self._lock:
+            # keep in-flight table in the same order than commands sent to ZiGate
+            self._inflight.append(Command(client, cmd))
+            self.zigate.send_to_transport(frame)
+
+    def _write(self, client):
+        '''
+        send pending output without copying it, socket is non blocking
+        so sending under the lock does not wait
+        '''
+        with self._lock:
+            try:
+                with memoryview(client.output) as view, view[:WRITE_CHUNK] as chunk:
+                    sent = client.sock.send(chunk)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                sent = None
+            else:
+                del client.output[:sent]
+        if sent is None:
+            self._close_client(client)
+
+    def _update_interest(self):
+        with self._lock:
+            clients = list(self.clients.values())
+        for client in clients:
+            if client.closing:
+                self._close_client(client)
+                continue
+            events = selectors.EVENT_READ
+            if client.output:
+                events |= selectors.EVENT_WRITE
             try:
-                conn.sendall(raw_message)
-            except Exception:
-                to_remove.append((conn, addr))
-        for d in to_remove:
-            self.users.remove(d)
-
-    def run_thread(self, conn, addr):
-        print('Client connected with ' + addr[0] + ':' + str(addr[1]))
-        while True:
-            data = conn.recv(1024)
-            self.zigate.send_to_transport(data)
-        conn.close()
+                if self._selector.get_key(client.sock).events != events:
+                    self._selector.modify(client.sock, events, client)
+            except (KeyError, ValueError):
+                pass
 
     def run(self):
-        print('Waiting for connections on port %s' % (self.port))
-        # We need to run a loop and create a new thread for each connection
-        while True:
-            conn, addr = self.server.accept()
-            self.users.append((conn, addr))
-            threading.Thread(target=self.run_thread, args=(conn, addr)).start()
+        print('Waiting for connections on port %s' % (self.server.getsockname()[1]))
+        while not self._closing:
+            for key, mask in self._selector.select(timeout=1):
+                if key.data == 'wakeup':
+                    try:
+                        while self._wakeup_r.recv(1024):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                elif key.data == 'accept':
+                    self._accept(key.fileobj)
+                else:
+                    client = key.data
+                    if mask & selectors.EVENT_READ:
+                        self._read(client)
+                    if mask & selectors.EVENT_WRITE and client.sock in self.clients:
+                        self._write(client)
+            self._update_interest()
+        for client in list(self.clients.values()):
+            self._close_client(client)
+        for server in self.servers:
+            self._selector.unregister(server)
+            server.close()
+        if self.unix_socket and os.path.exists(self.unix_socket):
+            os.remove(self.unix_socket)
+        self._selector.close()
 
 
 if __name__ == '__main__':
     from zigate.core import ZiGate
-    import logging
+    import argparse
     logging.basicConfig(level=logging.DEBUG)
-    z = ZiGate(auto_start=False)
-    server = Broker(z)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', help='ZiGate usb port', default='auto')
+    parser.add_argument('--port', help='TCP port', type=int, default=9999)
+    parser.add_argument('--unix_socket', help='Unix socket path', default=None)
+    parser.add_argument('--policy', help='Slow client policy', choices=[POLICY_DROP, POLICY_DISCONNECT],
+                        default=POLICY_DROP)
+    parser.add_argument('--multiplex', help='Route status and responses to the originating client',
+                        default=False, action='store_true')
+    args = parser.parse_args()
+    z = ZiGate(args.device, auto_start=False)
+    server = Broker(z, args.port, unix_socket=args.unix_socket, policy=args.policy,
+                    multiplex=args.multiplex)
+    z._start_event_thread()
+    z.setup_connection()
     server.run()
@@ -0,0 +1,395 @@
+#
+# Copyright (c) 2018 Sébastien RAMAGE
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+'''
+In-process signal bus
+
+Subscribers receive the signals dispatched by ZiGate (same names and
+arguments as with pydispatch) and may filter them on sender, addr, ieee,
+endpoint, cluster, attribute and property name. Each subscription is
+indexed under its most selective filter, so a signal only reaches the
+subscriptions whose indexed value matches before the other filters are
+checked. Signals nobody subscribed to cost a dict lookup.
+
+Subscriptions are synchronous by default, called in the thread dispatching
+the signal (usually the one decoding the frame). An asynchronous
+subscription gets its own bounded queue and delivery thread, so a slow
+subscriber doesn't delay decoding. When its queue is full, the overflow
+policy drops the oldest signal, coalesces signals by key (the latest
+signal of an attribute replaces its pending one) or blocks the
+dispatching thread.
+
+    def on_temperature(device, attribute):
+        print(device, attribute['value'])
+    BUS.subscribe(on_temperature, ZIGATE_ATTRIBUTE_UPDATED, name='temperature')
+'''
+
+import collections
+import inspect
+import itertools
+import logging
+import threading
+import traceback
+from time import monotonic
+from . import metrics
+
+LOGGER = logging.getLogger('zigate')
+
+# filters, most selective first, a subscription is indexed under the first it sets
+FILTERS = ('ieee', 'addr', 'name', 'attribute', 'cluster', 'endpoint')
+# overflow policies of asynchronous subscriptions
+DROP_OLDEST = 'drop_oldest'
+COALESCE = 'coalesce'
+BLOCK = 'block'
+OVERFLOWS = (DROP_OLDEST, COALESCE, BLOCK)
+MAX_QUEUE = 1000
+SUBSCRIPTION_IDS = itertools.count(1)  # suffix of default subscription names
+
+
+def event_keys(named, sender=None):
+    '''
+    return filterable keys of signal arguments,
+    ieee of signals only carrying addr (like responses) is resolved
+    from sender devices
+    '''
+    keys = {}
+    device = named.get('device')
+    if device is not None:
+        info = device.info
+        keys['addr'] = info.get('addr')
+        keys['ieee'] = info.get('ieee')
+    elif 'addr' in named:
+        keys['addr'] = named['addr']
+    attribute = named.get('attribute')
+    if attribute:
+        keys['endpoint'] = attribute.get('endpoint')
+        keys['cluster'] = attribute.get('cluster')
+        keys['attribute'] = attribute.get('attribute')
+        keys['name'] = attribute.get('name')
+    response = named.get('response')
+    if response is not None:
+        for key in ('addr', 'ieee', 'endpoint', 'cluster', 'attribute'):
+            value = response.get(key)
+            if value is not None:
+                keys[key] = value
+    if keys.get('ieee') is None and keys.get('addr') is not None and \
+       hasattr(sender, 'get_device_from_addr'):
+        device = sender.get_device_from_addr(keys['addr'])
+        if device is not None:
+            keys['ieee'] = device.info.get('ieee')
+    return keys
+
+
+class Subscription(object):
+    '''
+    callback subscribed to signal (None for all signals) with filters
+    '''
+    def __init__(self, callback, signal=None, sender=None, **filters):
+        unknown = set(filters).difference(FILTERS)
+        if unknown:
+            raise TypeError('Unknown filters {}'.format(', '.join(sorted(unknown))))
+        self.callback = callback
+        self.signal = signal
+        self.sender = sender
+        self.filters = {k: v for k, v in filters.items() if v is not None}
+        self.index = next((f for f in FILTERS if f in self.filters), None)
+        self.delivered = 0
+        self.errors = 0
+        self._accepted = self._accepted_arguments(callback)
+
+    @staticmethod
+    def _accepted_arguments(callback):
+        '''
+        return arguments names callback accepts, None if it accepts any
+        '''
+        try:
+            parameters = inspect.signature(callback).parameters.values()
+        except (TypeError, ValueError):
+            return None
+        if any(p.kind == p.VAR_KEYWORD for p in parameters):
+            return None
+        return frozenset(p.name for p in parameters)
+
+    def match(self, sender, keys):
+        if self.sender is not None and self.sender is not sender:
+            return False
+        for key, value in self.filters.items():
+            if keys.get(key) != value:
+                return False
+        return True
+
+    def deliver(self, signal, sender, named):
+        kwargs = dict(named, signal=signal, sender=sender)
+        if self._accepted is not None:
+            kwargs = {k: v for k, v in kwargs.items() if k in self._accepted}
+        try:
+            self.callback(**kwargs)
+            self.delivered += 1
+        except Exception:
+            self.errors += 1
+            LOGGER.error('Exception in subscriber %s of signal %s', self.callback, signal)
+            LOGGER.error(traceback.format_exc())
+
+    def __repr__(self):
+        return '<Subscription {} {} {}>'.format(getattr(self.callback, '__name__', self.callback),
+                                                self.signal, self.filters)
+
+
+def default_coalesce_key(signal, named):
+    '''
+    coalesce signals of the same device attribute,
+    None for signals which are not about an attribute
+    '''
+    keys = event_keys(named)
+    if keys.get('addr') is None or keys.get('attribute') is None:
+        return None
+    return (signal, keys['addr'], keys.get('endpoint'), keys.get('cluster'), keys['attribute'])
+
+
+class AsyncSubscription(Subscription):
+    '''
+    subscription delivering signals from a bounded queue in its own thread,
+    with coalesce overflow, when the queue is full a signal replaces the latest
+    pending signal of the same coalesce_key(signal, named), signals without
+    pending match or with a None key drop the oldest one
+    '''
+    def __init__(self, callback, signal=None, sender=None, max_queue=MAX_QUEUE, overflow=DROP_OLDEST,
+                 coalesce_key=None, name=None, **filters):
+        if overflow not in OVERFLOWS:
+            raise ValueError('Unknown overflow policy {}, use one of {}'.format(overflow, ', '.join(OVERFLOWS)))
+        Subscription.__init__(self, callback, signal, sender, **filters)
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.coalesce_key = coalesce_key or default_coalesce_key
+        # default name is unique, metrics of two subscriptions of the same callback are not shared
+        self.name = name or '{}-{}'.format(getattr(callback, '__qualname__', repr(callback)), next(SUBSCRIPTION_IDS))
+        self.dropped = 0
+        self.coalesced = 0
+        self.lag = 0  # seconds from dispatch to delivery of last signal
+        self.max_lag = 0
+        self._pending = collections.OrderedDict()  # counter to (signal, sender, named, timestamp, coalesce key)
+        self._coalesce_index = {}  # coalesce key to counter of its latest pending signal
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._busy = False
+        self._closed = False
+        self._queue_metric = metrics.SUBSCRIBER_QUEUE.labels(self.name)
+        self._queue_function = lambda: len(self._pending)
+        self._queue_metric.set_function(self._queue_function)
+        self._delivered_metric = metrics.SUBSCRIBER_DELIVERED.labels(self.name)
+        self._lag_metric = metrics.SUBSCRIBER_LAG.labels(self.name)
+        self._thread = threading.Thread(target=self._run, name='ZiGate-Subscriber {}'.format(self.name))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def deliver(self, signal, sender, named):
+        '''
+        queue signal, applying overflow policy when full
+        '''
+        with self._condition:
+            if self._closed:
+                return
+            pending = self._pending
+            coalesce_key = None
+            if self.overflow == COALESCE:
+                coalesce_key = self.coalesce_key(signal, named)
+                if len(pending) >= self.max_queue and coalesce_key in self._coalesce_index:
+                    key = self._coalesce_index[coalesce_key]
+                    pending[key] = (signal, sender, named, pending[key][3], coalesce_key)
+                    self.coalesced += 1
+                    metrics.SUBSCRIBER_DROPPED.labels(self.name, 'coalesced').inc()
+                    return
+            if len(pending) >= self.max_queue:
+                if self.overflow == BLOCK:
+                    while len(pending) >= self.max_queue and not self._closed:
+                        self._condition.wait()
+                    if self._closed:
+                        return
+                else:
+                    self._pop()
+                    self.dropped += 1
+                    metrics.SUBSCRIBER_DROPPED.labels(self.name, 'overflow').inc()
+            key = next(self._counter)
+            pending[key] = (signal, sender, named, monotonic(), coalesce_key)
+            if coalesce_key is not None:
+                self._coalesce_index[coalesce_key] = key
+            self._condition.notify_all()
+
+    def _pop(self):
+        '''
+        remove and return oldest pending signal, must be called with condition held
+        '''
+        key, item = self._pending.popitem(last=False)
+        coalesce_key = item[4]
+        if coalesce_key is not None and self._coalesce_index.get(coalesce_key) == key:
+            del self._coalesce_index[coalesce_key]
+        return item
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                signal, sender, named, timestamp, coalesce_key = self._pop()
+                self._busy = True
+                self._condition.notify_all()
+            self.lag = monotonic() - timestamp
+            self.max_lag = max(self.max_lag, self.lag)
+            self._lag_metric.observe(self.lag)
+            Subscription.deliver(self, signal, sender, named)
+            self._delivered_metric.inc()
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self, timeout=None):
+        '''
+        wait until all queued signals are delivered, return False on timeout
+        '''
+        with self._condition:
+            return self._condition.wait_for(lambda: self._closed or (not self._pending and not self._busy), timeout)
+
+    def close(self):
+        '''
+        stop delivery thread, pending signals are discarded
+        '''
+        with self._condition:
+            self._closed = True
+            self._pending.clear()
+            self._coalesce_index.clear()
+            self._condition.notify_all()
+        if self._queue_metric.function is self._queue_function:  # not replaced by a subscription of same name
+            self._queue_metric.set_function(None)
+            self._queue_metric.set(0)
+
+
+class SignalIndex(object):
+    '''
+    subscriptions of a signal, unfiltered ones and others by indexed filter value
+    '''
+    __slots__ = ('unfiltered', 'indexes')
+
+    def __init__(self):
+        self.unfiltered = []
+        self.indexes = {}  # filter to value to subscriptions
+
+    def add(self, subscription):
+        if subscription.index is None:
+            self.unfiltered.append(subscription)
+        else:
+            value = subscription.filters[subscription.index]
+            self.indexes.setdefault(subscription.index, {}).setdefault(value, []).append(subscription)
+
+    def matches(self, sender, named, keys):
+        subscriptions = [s for s in self.unfiltered if s.sender is None or s.sender is sender]
+        if self.indexes:
+            if keys is None:
+                keys = event_keys(named, sender)
+            for index, values in self.indexes.items():
+                value = keys.get(index)
+                if value is None:
+                    continue
+                for subscription in values.get(value, ()):
+                    if subscription.match(sender, keys):
+                        subscriptions.append(subscription)
+        return subscriptions, keys
+
+
+class SignalBus(object):
+    '''
+    subscriptions are held strongly until unsubscribed,
+    indexes are rebuilt on change so publishing never locks
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = []
+        self._signals = {}  # signal to SignalIndex, None for all signals
+
+    def subscribe(self, callback, signal=None, sender=None, asynchronous=False, **filters):
+        '''
+        subscribe callback to signal (all signals if None), filters are
+        addr, ieee, endpoint, cluster, attribute and name (property name),
+        callback receives the signal arguments it accepts, plus signal and sender
+
+        asynchronous subscription accepts max_queue, overflow (drop_oldest,
+        coalesce or block), coalesce_key and name, see AsyncSubscription
+        '''
+        if asynchronous:
+            subscription = AsyncSubscription(callback, signal, sender, **filters)
+        else:
+            subscription = Subscription(callback, signal, sender, **filters)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            self._rebuild()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        '''
+        unsubscribe a Subscription or all subscriptions of a callback
+        '''
+        with self._lock:
+            removed = [s for s in self._subscriptions if s is subscription or s.callback == subscription]
+            self._subscriptions = [s for s in self._subscriptions if s not in removed]
+            self._rebuild()
+        self._close(removed)
+
+    def clear(self):
+        with self._lock:
+            removed = self._subscriptions
+            self._subscriptions = []
+            self._rebuild()
+        self._close(removed)
+
+    @staticmethod
+    def _close(subscriptions):
+        for subscription in subscriptions:
+            if isinstance(subscription, AsyncSubscription):
+                subscription.close()
+
+    def _rebuild(self):
+        signals = {}
+        for subscription in self._subscriptions:
+            if subscription.signal not in signals:
+                signals[subscription.signal] = SignalIndex()
+            signals[subscription.signal].add(subscription)
+        self._signals = signals
+
+    @property
+    def subscriptions(self):
+        return list(self._subscriptions)
+
+    def listening(self, signal):
+        '''
+        return True if a subscription may receive signal
+        '''
+        signals = self._signals
+        return signal in signals or None in signals
+
+    def publish(self, signal, sender=None, **named):
+        '''
+        deliver signal to matching subscriptions, return their count
+        '''
+        signals = self._signals
+        if not signals:
+            return 0
+        subscriptions = []
+        keys = None
+        for key in (signal, None):
+            index = signals.get(key)
+            if index is not None:
+                matches, keys = index.matches(sender, named, keys)
+                subscriptions.extend(matches)
+        for subscription in subscriptions:
+            subscription.deliver(signal, sender, named)
+        return len(subscriptions)
+
+
+BUS = SignalBus()
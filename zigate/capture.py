@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2018 Sébastien RAMAGE
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+"""
+Wire capture of raw ZiGate frames
+
+Append-only binary files: a header (magic, version, wall clock time,
+monotonic time at creation and monotonic time at writer start, which
+identifies the run) followed by records of monotonic time, direction and
+raw encoded frame. Files rotate at max_bytes and when a new writer starts,
+keeping backup_count files named path.1 (newest) to path.N (oldest).
+Records are flushed at most flush_interval seconds after being written.
+
+python3 -m zigate.capture info capture.zcap
+python3 -m zigate.capture dump capture.zcap
+python3 -m zigate.capture throughput capture.zcap
+"""
+
+import argparse
+import os
+import struct
+import threading
+import time
+from binascii import hexlify
+
+MAGIC = b'ZCAP'
+VERSION = 2
+HEADER_V1 = struct.Struct('!4sBdd')  # magic, version, wall time, monotonic time
+HEADER = struct.Struct('!4sBddd')  # magic, version, wall time, monotonic time, run monotonic time
+RECORD = struct.Struct('!dBH')  # monotonic time, direction, frame length
+IN = 0  # from ZiGate
+OUT = 1  # to ZiGate
+DIRECTIONS = {IN: 'in', OUT: 'out'}
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+FLUSH_INTERVAL = 1.0
+
+
+class CaptureError(Exception):
+    pass
+
+
+class CaptureWriter(object):
+    '''
+    thread safe writer of rotating capture files
+    '''
+    def __init__(self, path, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT, flush_interval=FLUSH_INTERVAL):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.frames = 0
+        self._lock = threading.Lock()
+        self._fp = None
+        self._size = 0
+        self._flush_timer = None
+        self._run = time.monotonic()
+        # capture of a previous run is never appended to, its timestamps use another origin
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            self._shift()
+        self._open()
+
+    def _open(self):
+        self._fp = open(self.path, 'wb')
+        self._fp.write(HEADER.pack(MAGIC, VERSION, time.time(), time.monotonic(), self._run))
+        self._size = HEADER.size
+
+    def _shift(self):
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = '{}.{}'.format(self.path, i)
+                if os.path.exists(src):
+                    os.replace(src, '{}.{}'.format(self.path, i + 1))
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+
+    def _rotate(self):
+        self._fp.close()
+        self._shift()
+        self._open()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._flush_timer = None
+            if self._fp:
+                self._fp.flush()
+
+    def write(self, direction, frame, timestamp=None):
+        record = RECORD.pack(timestamp or time.monotonic(), direction, len(frame))
+        with self._lock:
+            if self._fp is None:
+                return
+            if self.max_bytes and self._size + len(record) + len(frame) > self.max_bytes \
+               and self._size > HEADER.size:
+                self._rotate()
+            self._fp.write(record)
+            self._fp.write(frame)
+            self._size += len(record) + len(frame)
+            self.frames += 1
+            if self.flush_interval and self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_interval, self._timed_flush)
+                self._flush_timer.setDaemon(True)
+                self._flush_timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._fp:
+                self._fp.flush()
+
+    def close(self):
+        with self._lock:
+            if self._flush_timer:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self._fp:
+                self._fp.close()
+                self._fp = None
+
+
+def read_header(fp):
+    '''
+    return wall time, monotonic time and run of capture file,
+    version 1 files have no run, each file is its own run
+    '''
+    header = fp.read(HEADER_V1.size)
+    if len(header) < HEADER_V1.size:
+        raise CaptureError('Truncated capture header')
+    magic, version, wall_time, monotonic = HEADER_V1.unpack(header)
+    if magic != MAGIC:
+        raise CaptureError('Not a ZiGate capture file')
+    if version == 1:
+        return wall_time, monotonic, monotonic
+    if version != VERSION:
+        raise CaptureError('Unsupported capture version {}'.format(version))
+    run = fp.read(HEADER.size - HEADER_V1.size)
+    if len(run) < HEADER.size - HEADER_V1.size:
+        raise CaptureError('Truncated capture header')
+    return wall_time, monotonic, struct.unpack('!d', run)[0]
+
+
+def _read_records(fp):
+    while True:
+        record = fp.read(RECORD.size)
+        if len(record) < RECORD.size:
+            return
+        timestamp, direction, length = RECORD.unpack(record)
+        frame = fp.read(length)
+        if len(frame) < length:
+            return
+        yield timestamp, direction, frame
+
+
+def read_capture(path):
+    '''
+    yield (monotonic time, direction, frame) of capture file,
+    a truncated last record is ignored
+    '''
+    with open(os.path.expanduser(path), 'rb') as fp:
+        read_header(fp)
+        for record in _read_records(fp):
+            yield record
+
+
+def capture_files(path):
+    '''
+    return capture files of path, oldest first
+    '''
+    path = os.path.expanduser(path)
+    files = []
+    i = 1
+    while os.path.exists('{}.{}'.format(path, i)):
+        files.insert(0, '{}.{}'.format(path, i))
+        i += 1
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read_captures(path, rotated=True):
+    '''
+    yield (monotonic time, direction, frame) of capture and its rotated files,
+    timestamps of a run are shifted to follow the last record of previous run
+    '''
+    run = None
+    offset = 0
+    last = None
+    for filename in capture_files(path) if rotated else [path]:
+        with open(os.path.expanduser(filename), 'rb') as fp:
+            file_run = read_header(fp)[2]
+            for timestamp, direction, frame in _read_records(fp):
+                if file_run != run:
+                    run = file_run
+                    offset = last - timestamp if last is not None else 0
+                last = timestamp + offset
+                yield last, direction, frame
+
+
+def decode_throughput(path, rotated=True):
+    '''
+    decode inbound frames of capture as fast as possible in a FakeZiGate
+    return frames count, duration and frames per second
+    '''
+    from .core import FakeZiGate
+    zigate = FakeZiGate(auto_start=False, path=None)
+    frames = [frame for timestamp, direction, frame in read_captures(path, rotated) if direction == IN]
+    start = time.perf_counter()
+    for frame in frames:
+        zigate.decode_data(frame)
+    duration = time.perf_counter() - start
+    return {'frames': len(frames),
+            'duration': duration,
+            'frames_per_second': len(frames) / duration if duration else 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ZiGate capture tool')
+    parser.add_argument('command', choices=['info', 'dump', 'throughput'])
+    parser.add_argument('path')
+    parser.add_argument('--no-rotated', dest='rotated', action='store_false', help='ignore rotated files')
+    args = parser.parse_args()
+    if args.command == 'throughput':
+        import logging
+        logging.getLogger('zigate').setLevel(logging.CRITICAL)
+        result = decode_throughput(args.path, args.rotated)
+        print('{frames} frames decoded in {duration:.3f}s: {frames_per_second:.0f} frames/s'.format(**result))
+        return
+    if args.command == 'info':
+        counts = {IN: 0, OUT: 0}
+        first = last = None
+        for timestamp, direction, frame in read_captures(args.path, args.rotated):
+            counts[direction] += 1
+            first = first if first is not None else timestamp
+            last = timestamp
+        print('files: {}'.format(', '.join(capture_files(args.path) if args.rotated else [args.path])))
+        print('frames: {} in, {} out'.format(counts[IN], counts[OUT]))
+        if first is not None:
+            print('duration: {:.3f}s'.format(last - first))
+        return
+    start = None
+    for timestamp, direction, frame in read_captures(args.path, args.rotated):
+        start = start if start is not None else timestamp
+        print('{:12.6f} {:3} {}'.format(timestamp - start, DIRECTIONS.get(direction, direction),
+                                        hexlify(frame).decode()))
+
+
+if __name__ == '__main__':
+    main()
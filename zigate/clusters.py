@@ -392,6 +392,15 @@ def vibration_decode(value):
     return value
 
 
+@register_cluster
+class C0019(Cluster):
+    cluster_id = 0x0019
+    type = 'General: OTA'
+    attributes_def = {0x0002: {'name': 'current_file_version', 'value': 'value', 'type': int},
+                      0x0008: {'name': 'image_type_id', 'value': 'value', 'type': int},
+                      }
+
+
 @register_cluster
 class C0101(Cluster):
     cluster_id = 0x0101
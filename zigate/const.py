@@ -19,6 +19,7 @@ ZIGATE_DEVICE_NEED_DISCOVERY = 'ZIGATE_DEVICE_NEED_DISCOVERY'
 ZIGATE_FAILED_TO_CONNECT = 'ZIGATE_FAILED_TO_CONNECT'
 ZIGATE_CONNECTED = 'ZIGATE_CONNECTED'
 ZIGATE_READY = 'ZIGATE_READY'
+ZIGATE_NETWORK_TABLE_UPDATED = 'ZIGATE_NETWORK_TABLE_UPDATED'
 
 BATTERY = 0
 AC_POWER = 1
@@ -85,6 +86,31 @@ DATA_TYPE = {0x00: None,
              0x44: 's',  # long char string
              }
 
+# size in bytes of analog data types, used to encode reportable change
+ANALOG_DATA_TYPE = {0x20: 1,  # uint8
+                    0x21: 2,  # uint16
+                    0x22: 3,  # uint24
+                    0x23: 4,  # uint32
+                    0x24: 5,  # uint40
+                    0x25: 6,  # uint48
+                    0x26: 7,  # uint56
+                    0x27: 8,  # uint64
+                    0x28: 1,  # int8
+                    0x29: 2,  # int16
+                    0x2a: 3,  # int24
+                    0x2b: 4,  # int32
+                    0x2c: 5,  # int40
+                    0x2d: 6,  # int48
+                    0x2e: 7,  # int56
+                    0x2f: 8,  # int64
+                    0x38: 2,  # float semi
+                    0x39: 4,  # float simple
+                    0x3a: 8,  # float double
+                    0xe0: 4,  # time of day
+                    0xe1: 4,  # date
+                    0xe2: 4,  # UTC time
+                    }
+
 BASE_PATH = os.path.dirname(__file__)
 
 ADMINPANEL_PORT = 9998
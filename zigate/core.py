@@ -25,16 +25,25 @@ from .const import (ACTIONS_COLOR, ACTIONS_LEVEL, ACTIONS_LOCK, ACTIONS_HUE,
                     ZIGATE_DEVICE_ADDED, ZIGATE_DEVICE_REMOVED,
                     ZIGATE_DEVICE_UPDATED, ZIGATE_DEVICE_ADDRESS_CHANGED,
                     ZIGATE_PACKET_RECEIVED, ZIGATE_DEVICE_NEED_DISCOVERY,
-                    ZIGATE_RESPONSE_RECEIVED, DATA_TYPE, BASE_PATH)
+                    ZIGATE_RESPONSE_RECEIVED, ZIGATE_NETWORK_TABLE_UPDATED,
+                    DATA_TYPE, ANALOG_DATA_TYPE, BASE_PATH)
 
 from .clusters import (Cluster, get_cluster)
+from .ota import (OTAImage, OTAImageError, OTASession, OTARepository, OTA_BLOCK_HEADER, OTA_SESSION_TIMEOUT)
+from . import metrics
+from . import tracing
+from . import capture
+from . import bus
 import functools
+import queue
 import struct
 import threading
 import random
 from enum import Enum
 import colorsys
 import datetime
+import weakref
+import itertools
 try:
     import RPi.GPIO as GPIO
 except Exception:
@@ -50,14 +59,55 @@ import usb
 
 
 LOGGER = logging.getLogger('zigate')
+FRAME_HEADER = struct.Struct('!HHB')  # msg_type, length, checksum
 
 
 AUTO_SAVE = 5 * 60  # 5 minutes
 BIND_REPORT = True  # automatically bind and report state for light
+# cluster to bind and attributes to report (attribute_id, attribute_type)
+BIND_REPORT_CLUSTERS = {0x0001: [(0x0020, 0x20), (0x0021, 0x20)],
+                        0x0006: [(0x0000, 0x10)],
+                        0x0008: [(0x0000, 0x20)],
+                        0x0009: [],
+                        0x000f: [(0x0055, 0x10)],
+                        0x0101: [(0x0000, 0x30)],
+                        0x0102: [(0x0007, 0x20)],
+                        0x0201: [(0x0000, 0x29), (0x0002, 0x18), (0x0008, 0x20),
+                                 (0x0012, 0x29), (0x0014, 0x29), (0x001C, 0x30)],
+                        0x0300: [(0x0000, 0x20), (0x0001, 0x20), (0x0003, 0x21), (0x0004, 0x21)],  # 0x0200
+                        0x0400: [],
+                        0x0402: [(0x0000, 0x29)],
+                        0x0405: [(0x0000, 0x21)],
+                        0xFC00: [],
+                        0x0702: [(0x0000, 0x25)],
+                        }
+# reporting profile (min_interval, max_interval, reportable change) by (cluster, attribute)
+# attribute None means whole cluster, change is in attribute unit
+REPORTING_FIELDS = ('min_interval', 'max_interval', 'change')
+REPORTING_DEFAULT = (1, 3600, 0)
+REPORTING_PROFILES = {(0x0001, 0x0020): (300, 3600, 1),  # battery voltage, 0.1 V
+                      (0x0001, 0x0021): (300, 3600, 2),  # battery percent, 1 %
+                      (0x0008, 0x0000): (1, 3600, 3),  # level, ~1 %
+                      (0x0201, 0x0000): (30, 3600, 10),  # local temperature, 0.1 °C
+                      (0x0300, 0x0003): (1, 3600, 10),  # current x
+                      (0x0300, 0x0004): (1, 3600, 10),  # current y
+                      (0x0402, None): (30, 3600, 10),  # temperature, 0.1 °C
+                      (0x0405, None): (30, 3600, 100),  # humidity, 1 %
+                      (0x0702, 0x0000): (30, 3600, 10),  # current summation delivered
+                      }
+# configure reporting status of attributes which can't be reported, not sent again
+REPORTING_UNSUPPORTED = (0x86, 0x8c)  # unsupported attribute, unreportable attribute
 SLEEP_INTERVAL = 0.1
 ACTIONS = {}
+HANDLERS = {}  # msg type to list of (handler, exclusive)
+INSTANCE_IDS = itertools.count(1)  # instance label of ZiGate gauges
 WAIT_TIMEOUT = 5
+VERIFY_REPORTING = 24 * 60 * 60  # 24 hours
 DETECT_FASTCHANGE = False  # enable fast change detection
+# change filter modes, see ZiGate.set_change_filter
+CHANGE_EXACT = 'exact'
+CHANGE_ABSOLUTE = 'absolute'
+CHANGE_RELATIVE = 'relative'
 DELAY_FASTCHANGE = 1.0  # delay fast change for cluster 0x0006
 
 # Device id
@@ -106,6 +156,36 @@ def register_actions(action):
     return decorator
 
 
+def register_handler(*msg_types, exclusive=False):
+    '''
+    register handler(zigate, response) for responses of msg_types,
+    handlers run in registration order in the decoding thread of the response,
+    responses being decoded concurrently, handlers of different responses
+    may run in any order, exclusive handlers never run concurrently
+    with other exclusive handlers of the same ZiGate.
+    Built-in handlers are ZiGate methods, called on the instance
+    so subclasses can override them.
+    '''
+    def decorator(func):
+        for msg_type in msg_types:
+            # copy on write, lists may be iterated by decoding threads
+            HANDLERS[msg_type] = HANDLERS.get(msg_type, []) + [(func, exclusive)]
+        return func
+    return decorator
+
+
+def unregister_handler(func, *msg_types):
+    '''
+    unregister handler for msg_types, or for all msg types if none given
+    '''
+    for msg_type in msg_types or list(HANDLERS):
+        handlers = [h for h in HANDLERS.get(msg_type, []) if h[0] is not func]
+        if handlers:
+            HANDLERS[msg_type] = handlers
+        else:
+            HANDLERS.pop(msg_type, None)
+
+
 class AddrMode(Enum):
     bound = 0
     group = 1
@@ -141,17 +221,100 @@ def hex_to_xy(h):
     return rgb_to_xy(hex_to_rgb(h))
 
 
+def pack_semi_float(value):
+    '''
+    pack float as IEEE 754 half precision (struct 'e' format requires python 3.6)
+    '''
+    single = struct.unpack('!I', struct.pack('!f', value))[0]
+    sign = (single >> 16) & 0x8000
+    exponent = ((single >> 23) & 0xff) - 127 + 15
+    mantissa = single & 0x7fffff
+    if exponent >= 31:  # overflow, infinity
+        return struct.pack('!H', sign | 0x7c00)
+    if exponent <= 0:  # subnormal
+        if exponent < -10:
+            return struct.pack('!H', sign)
+        mantissa = (mantissa | 0x800000) >> (1 - exponent)
+        exponent = 0
+    # rounding may carry into exponent, which is still the right result
+    return struct.pack('!H', min((sign | (exponent << 10)) + ((mantissa + 0x1000) >> 13), sign | 0x7c00))
+
+
+def encode_reportable_change(data_type, change):
+    '''
+    encode reportable change according to attribute data type
+    discrete data types don't have reportable change, a zero byte is used
+    '''
+    size = ANALOG_DATA_TYPE.get(data_type)
+    if size is None:
+        return b'\x00'
+    if data_type == 0x38:
+        return pack_semi_float(change)
+    if data_type == 0x39:
+        return struct.pack('!f', change)
+    if data_type == 0x3a:
+        return struct.pack('!d', change)
+    signed = 0x28 <= data_type <= 0x2f
+    return int(change).to_bytes(size, 'big', signed=signed)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def value_changed(change_filter, previous, value):
+    '''
+    return True if value changed from previous according to change filter (mode, threshold)
+    thresholds only apply to numbers, other values (bool, str...) are compared exactly
+    '''
+    mode, threshold = change_filter
+    if mode == CHANGE_EXACT or not is_number(previous) or not is_number(value):
+        return value != previous
+    delta = abs(value - previous)
+    if mode == CHANGE_RELATIVE:
+        return delta > 0 and delta >= abs(previous) * threshold
+    return delta > 0 and delta >= threshold
+
+
+def has_receivers(signal, sender=dispatcher.Anonymous):
+    '''
+    return True if a bus subscription or a pydispatch receiver may receive signal
+    '''
+    if bus.BUS.listening(signal):
+        return True
+    connections = dispatcher.connections
+    if not connections:
+        return False
+    for key in (id(sender), id(dispatcher.Any)):
+        signals = connections.get(key)
+        if signals and (signals.get(signal) or signals.get(dispatcher.Any)):
+            return True
+    return False
+
+
 def dispatch_signal(signal=dispatcher.Any, sender=dispatcher.Anonymous,
                     *arguments, **named):
     '''
-    Dispatch signal with exception proof
+    Dispatch signal with exception proof to bus subscriptions and pydispatch receivers,
+    nothing is done without receivers
     '''
+    listening = bus.BUS.listening(signal)
+    if not listening and not has_receivers(signal, sender):
+        return
     LOGGER.debug('Dispatch %s', signal)
-    try:
-        dispatcher.send(signal, sender, *arguments, **named)
-    except Exception:
-        LOGGER.error('Exception dispatching signal %s', signal)
-        LOGGER.error(traceback.format_exc())
+    trace = tracing.TRACER.current()
+    if trace:
+        trace.mark(tracing.DISPATCH, signal)
+    if listening:
+        bus.BUS.publish(signal, sender, **named)
+    if dispatcher.connections:
+        try:
+            dispatcher.send(signal, sender, *arguments, **named)
+        except Exception:
+            LOGGER.error('Exception dispatching signal %s', signal)
+            LOGGER.error(traceback.format_exc())
+    if trace:
+        trace.mark(tracing.DISPATCHED, signal)
 
 
 def ftdi_set_bitmode(dev, bitmask):
@@ -186,8 +349,15 @@ class ZiGate(object):
         self._port = port
         self._last_response = {}  # response to last command type
         self._last_status = {}  # status to last command type
+        self._sequence_response = {}  # (response type, sequence) to (time, response)
+        self._command_traces = {}  # command type to trace waiting for status
+        self._response_traces = {}  # response type to trace waiting for response
         self._save_lock = threading.Lock()
         self._autosavetimer = None
+        self._verifyreportingtimer = None
+        self._ota_notify_timer = None
+        self._ota_block_timers = {}  # session key to timer sending a paced block response
+        self._reporting_ledger = {}  # ieee to successfully configured binds and reports
         self._closing = False
         self.connection = None
 
@@ -198,8 +368,23 @@ class ZiGate(object):
         self.channel = 0
         self._started = False
         self._no_response_count = 0
-
-        self._ota_reset_local_variables()
+        self.change_version = 0  # incremented on each device or attribute change
+        self._change_lock = threading.Lock()
+        self._handler_lock = threading.RLock()  # serialize exclusive handlers
+        self._change_filters = {}  # property name (None for all) to (mode, threshold)
+        self._removed_versions = {}  # addr to change version of removal
+
+        self._ota_images = {}  # (manufacturer_code, image_type, image_version) to OTAImage
+        self._ota_directory_images = set()  # keys of images opened from OTA directory, closed when unused
+        self._ota_sessions = {}  # (addr, manufacturer_code, image_type) to OTASession
+        self._ota_server_image = None  # image whose header is loaded in ZiGate
+        self._ota_repository = None
+        self._ota_completed = {}  # (addr, manufacturer_code, image_type) to last status
+        self._ota_block_delay = 0
+        self._ota_max_data_size = None
+        self._ota_session_timeout = OTA_SESSION_TIMEOUT
+        self._ota_lock = threading.Lock()
+        self._register_metrics()
 
         if self.model == 'DIN':
             self.set_running_mode()
@@ -284,20 +469,156 @@ class ZiGate(object):
     def addr(self):
         return self._addr
 
-    def start_adminpanel(self, host=None, port=None, mount=None, prefix=None, debug=False):
+    def _register_metrics(self):
+        '''
+        gauges are labelled by instance so several ZiGate do not overwrite each other,
+        they are removed on close
+        '''
+        ref = weakref.ref(self)
+        self._metrics_instance = str(next(INSTANCE_IDS))
+        metrics.SEND_QUEUE.labels(self._metrics_instance).set_function(lambda: ref().connection.queue.qsize())
+        metrics.RECEIVED_QUEUE.labels(self._metrics_instance).set_function(
+            lambda: ref().connection.received.qsize())
+        metrics.NO_RESPONSE.labels(self._metrics_instance).set_function(lambda: ref()._no_response_count)
+
+    def _unregister_metrics(self):
+        for gauge in (metrics.SEND_QUEUE, metrics.RECEIVED_QUEUE, metrics.NO_RESPONSE):
+            gauge.remove(self._metrics_instance)
+
+    def get_metrics(self):
+        '''
+        return metrics as dict of metric name to samples list of (name, labels, value)
+        '''
+        return metrics.REGISTRY.collect()
+
+    def start_tracing(self, sample_every=1, max_traces=tracing.MAX_TRACES):
+        '''
+        trace latency of one inbound frame or command out of sample_every,
+        keep the max_traces last traces
+        '''
+        tracing.TRACER.start(sample_every, max_traces)
+
+    def stop_tracing(self):
+        tracing.TRACER.stop()
+
+    def get_traces(self):
+        '''
+        return finished traces as list of dict with stages list of
+        (stage, detail, seconds since previous stage)
+        '''
+        return tracing.TRACER.collect()
+
+    def export_traces(self, path=None):
+        '''
+        return finished traces in Chrome trace-event format,
+        also written to path if given
+        '''
+        return tracing.TRACER.export(path)
+
+    def set_change_filter(self, name=None, mode=CHANGE_EXACT, threshold=0):
+        '''
+        signal property name updates only when its value changed,
+        exactly or by at least an absolute or relative threshold (0.05 for 5 %)
+        from the last signaled value, other reports only update last_seen and lqi
+
+        name None applies to properties without their own filter and also
+        skips device list refreshes bringing nothing new,
+        a property renamed to avoid duplicate (onoff2 for endpoint 2)
+        can be filtered by its new name or by its original name
+        attributes with expiration (motion...) are never filtered
+        '''
+        if mode not in (CHANGE_EXACT, CHANGE_ABSOLUTE, CHANGE_RELATIVE):
+            raise ValueError('Unknown change filter mode {}'.format(mode))
+        filters = dict(self._change_filters)
+        filters[name] = (mode, threshold)
+        self._change_filters = filters
+
+    def remove_change_filter(self, name=None):
+        filters = dict(self._change_filters)
+        filters.pop(name, None)
+        self._change_filters = filters
+
+    def get_change_filters(self):
+        return dict(self._change_filters)
+
+    def _get_change_filter(self, cluster, attribute_id):
+        filters = self._change_filters
+        if not filters:
+            return
+        attribute = cluster.attributes.get(attribute_id, {})
+        for name in (attribute.get('name'), cluster.attributes_def.get(attribute_id, {}).get('name')):
+            if name in filters:
+                return filters[name]
+        return filters.get(None)
+
+    def _touch_device(self, info):
+        '''
+        update known device from device list without signal if nothing else changed,
+        return True if done
+        '''
+        if None not in self._change_filters:
+            return False
+        device = self._devices.get(info['addr'])
+        if not device or device.missing:
+            return False
+        for k, v in info.items():
+            if k not in ('id', 'lqi') and device.info.get(k) != v:
+                return False
+        device.update_info(info)
+        return True
+
+    def subscribe(self, callback, signal=None, **filters):
+        '''
+        subscribe callback to signal of this zigate (all signals if None),
+        filters are addr, ieee, endpoint, cluster, attribute and name,
+        asynchronous=True delivers in a subscriber thread from a bounded queue,
+        see bus.SignalBus.subscribe
+        '''
+        return bus.BUS.subscribe(callback, signal, sender=self, **filters)
+
+    def unsubscribe(self, subscription):
+        '''
+        unsubscribe a Subscription or all subscriptions of a callback
+        '''
+        bus.BUS.unsubscribe(subscription)
+
+    def start_capture(self, path, max_bytes=capture.MAX_BYTES, backup_count=capture.BACKUP_COUNT):
+        '''
+        capture raw frames exchanged with ZiGate to rotating file path,
+        replay it with transport.ReplayTransport
+        '''
+        if not self.connection:
+            LOGGER.error('Not connected to zigate')
+            return
+        return self.connection.start_capture(path, max_bytes, backup_count)
+
+    def stop_capture(self):
+        if self.connection:
+            self.connection.stop_capture()
+
+    def start_adminpanel(self, host=None, port=None, mount=None, prefix=None, debug=False,
+                         server=None, pool_size=None):
         '''
         Start Admin panel in other thread
+        server: bottle server name, default to thread pool server with pool_size threads
         '''
-        from .adminpanel import start_adminpanel, ADMINPANEL_HOST, ADMINPANEL_PORT
+        from .adminpanel import start_adminpanel, ADMINPANEL_HOST, ADMINPANEL_PORT, POOL_SIZE
         port = port or ADMINPANEL_PORT
         host = host or ADMINPANEL_HOST
-        self.adminpanel = start_adminpanel(self, host=host, port=port, mount=mount, prefix=prefix, quiet=not debug, debug=debug)
+        self.adminpanel = start_adminpanel(self, host=host, port=port, mount=mount, prefix=prefix, quiet=not debug,
+                                           debug=debug, server=server, pool_size=pool_size or POOL_SIZE)
         return self.adminpanel
 
     def _event_loop(self):
         while not self._closing:
-            if self.connection and not self.connection.received.empty():
-                packet = self.connection.received.get()
+            connection = self.connection
+            if connection:
+                try:
+                    packet = connection.received.get(timeout=SLEEP_INTERVAL)
+                except queue.Empty:
+                    continue
+                if packet.__class__ is tracing.Frame:
+                    packet.trace.mark(tracing.DEQUEUE)
                 dispatch_signal(ZIGATE_PACKET_RECEIVED, self, packet=packet)
                 t = threading.Thread(target=self.decode_data, args=(packet,),
                                      name='ZiGate-Decode data')
@@ -313,8 +634,18 @@ class ZiGate(object):
         self._closing = True
         if self._autosavetimer:
             self._autosavetimer.cancel()
+        if self._verifyreportingtimer:
+            self._verifyreportingtimer.cancel()
+        if self._ota_notify_timer:
+            self._ota_notify_timer.cancel()
+        with self._ota_lock:
+            for timer in self._ota_block_timers.values():
+                timer.cancel()
+            self._ota_block_timers = {}
+        self._unregister_metrics()
         try:
             if self.connection:
+                self.connection.stop_capture()
                 self.connection.close()
         except Exception:
             LOGGER.error('Exception during closing')
@@ -341,7 +672,11 @@ class ZiGate(object):
                     'groups': self._groups,
                     'scenes': self._scenes,
                     'neighbours_table': self._neighbours_table_cache,
-                    'led': self._led
+                    'led': self._led,
+                    'reporting': {ieee: {'bind': list(ledger['bind']),
+                                         'report': [list(k) + list(v) for k, v in ledger['report'].items()],
+                                         'unsupported': [list(k) + [v] for k, v in ledger['unsupported'].items()]}
+                                  for ieee, ledger in self._reporting_ledger.items()}
                     }
             with open(self._path, 'w') as fp:
                 json.dump(data, fp, cls=DeviceEncoder,
@@ -376,11 +711,18 @@ class ZiGate(object):
             self._led = data.get('led', True)
             self._neighbours_table_cache = data.get('neighbours_table', [])
             LOGGER.debug('Load neighbours cache: %s', self._neighbours_table_cache)
+            self._reporting_ledger = {}
+            for ieee, ledger in data.get('reporting', {}).items():
+                self._reporting_ledger[ieee] = {'bind': set([tuple(r) for r in ledger['bind']]),
+                                                'report': {tuple(r[:3]): tuple(r[3:]) for r in ledger['report']},
+                                                'unsupported': {tuple(r[:3]): r[3]
+                                                                for r in ledger.get('unsupported', [])}}
             devices = data.get('devices', [])
             for data in devices:
                 try:
                     device = Device.from_json(data, self)
                     self._devices[device.addr] = device
+                    device._changed()
                     device._create_actions()
                 except Exception:
                     LOGGER.error('Error loading device %s', data)
@@ -496,16 +838,16 @@ class ZiGate(object):
         return encoded
 
     def zigate_decode(self, data):
-        flip = False
-        decoded = bytearray()
-        for b in data:
-            if flip:
-                flip = False
-                decoded.append(b ^ 0x10)
-            elif b == 0x02:
-                flip = True
-            else:
-                decoded.append(b)
+        '''
+        unescape data, byte following 0x02 is xored with 0x10,
+        work is done per escape instead of per byte
+        '''
+        chunks = bytes(data).split(b'\x02')
+        decoded = bytearray(chunks[0])
+        for chunk in chunks[1:]:
+            if chunk:  # escape never follows escape in valid frame
+                decoded.append(chunk[0] ^ 0x10)
+                decoded += chunk[1:]
         return decoded
 
     def checksum(self, *args):
@@ -543,7 +885,7 @@ class ZiGate(object):
         else:
             byte_data = data
         assert type(byte_cmd) == bytes
-        assert type(byte_data) == bytes
+        assert type(byte_data) in (bytes, bytearray)
         length = len(byte_data)
         byte_length = struct.pack('!H', length)
         checksum = self.checksum(byte_cmd, byte_length, byte_data)
@@ -557,156 +899,285 @@ class ZiGate(object):
         encoded_output = bytes(enc_msg)
         LOGGER.debug('Encoded Msg to send %s', hexlify(encoded_output))
 
+        trace = tracing.TRACER.sample('command', cmd)
+        if trace:
+            trace.mark(tracing.SEND)
+            encoded_output = tracing.Frame(encoded_output)
+            encoded_output.trace = trace
+            self._command_traces[cmd] = trace
+            if wait_response:
+                self._response_traces[wait_response] = trace
+        start = monotonic()
         self.send_to_transport(encoded_output)
-        if wait_status:
-            status = self._wait_status(cmd)
-            if wait_response and status is not None:
-                r = self._wait_response(wait_response)
-                return r
-            return status
-        return False
+        if trace:
+            trace.mark(tracing.TRANSPORT)
+        try:
+            if wait_status:
+                status = self._wait_status(cmd)
+                if status is not None:
+                    metrics.COMMAND_LATENCY.labels(cmd).observe(monotonic() - start)
+                if wait_response and status is not None:
+                    r = self._wait_response(wait_response)
+                    return r
+                return status
+            return False
+        finally:
+            if trace:
+                self._finish_command_trace(trace, cmd, wait_response)
+
+    def _finish_command_trace(self, trace, cmd, wait_response):
+        if self._command_traces.get(cmd) is trace:
+            self._command_traces.pop(cmd, None)
+        if wait_response and self._response_traces.get(wait_response) is trace:
+            self._response_traces.pop(wait_response, None)
+        tracing.TRACER.finish(trace)
 
     def decode_data(self, packet):
         '''
         Decode raw packet message
         '''
+        start = monotonic()
+        if packet.__class__ is not tracing.Frame:
+            return self._decode_data(packet, start)
+        trace = packet.trace
+        trace.mark(tracing.DECODE)
+        previous = tracing.TRACER.activate(trace)
         try:
-            decoded = self.zigate_decode(packet[1:-1])
-            msg_type, length, checksum, value, lqi = \
-                struct.unpack('!HHB%dsB' % (len(decoded) - 6), decoded)
+            self._decode_data(packet, start, trace)
+        finally:
+            tracing.TRACER.activate(previous)
+            tracing.TRACER.finish(trace)
+
+    def _decode_data(self, packet, start, trace=None):
+        try:
+            # frames always contain escaped bytes (length high byte at least)
+            decoded = memoryview(self.zigate_decode(packet[1:-1]))
+            if len(decoded) < 6:
+                raise struct.error('frame too short')
+            msg_type, length, checksum = FRAME_HEADER.unpack_from(decoded)
+            value = decoded[5:-1]
+            lqi = decoded[-1]
         except Exception:
+            metrics.DECODE_ERRORS.labels('malformed').inc()
             LOGGER.error('Failed to decode packet : %s', hexlify(packet))
+            if trace:
+                trace.mark(tracing.ERROR, 'malformed')
             return
+        if trace:
+            trace.msg_type = msg_type
         if length != len(value) + 1:  # add lqi length
+            metrics.DECODE_ERRORS.labels('length').inc()
             LOGGER.error('Bad length %s != %s : %s', length, len(value) + 1, value)
+            if trace:
+                trace.mark(tracing.ERROR, 'length')
             return
         computed_checksum = self.checksum(decoded[:4], lqi, value)
         if checksum != computed_checksum:
+            metrics.DECODE_ERRORS.labels('checksum').inc()
             LOGGER.error('Bad checksum %s != %s', checksum, computed_checksum)
+            if trace:
+                trace.mark(tracing.ERROR, 'checksum')
             return
-        LOGGER.debug('Received response 0x{:04x}: {}'.format(msg_type, hexlify(value)))
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug('Received response 0x%04x: %s', msg_type, hexlify(value))
         try:
             response = RESPONSES.get(msg_type, Response)(value, lqi)
         except Exception:
+            metrics.DECODE_ERRORS.labels('response').inc()
             LOGGER.error('Error decoding response 0x{:04x}: {}'.format(msg_type, hexlify(value)))
             LOGGER.error(traceback.format_exc())
+            if trace:
+                trace.mark(tracing.ERROR, 'response')
             return
+        if trace:
+            trace.mark(tracing.DECODED)
+            response.trace = trace
+        addr = response.get('addr')
+        if isinstance(addr, str):
+            metrics.DEVICE_MESSAGES.labels(addr).inc()
+            metrics.DEVICE_LQI.labels(addr).set(lqi)
         if msg_type != response.msg:
             LOGGER.warning('Unknown response 0x{:04x}'.format(msg_type))
         LOGGER.debug(response)
         self._last_response[msg_type] = response
+        if 'sequence' in response:
+            self._sequence_response[(msg_type, response['sequence'])] = (monotonic(), response)
+        if self._response_traces:
+            command_trace = self._response_traces.pop(msg_type, None)
+            if command_trace:
+                command_trace.mark(tracing.RESPONSE)
+        if trace:
+            trace.mark(tracing.INTERPRET)
         self.interpret_response(response)
         dispatch_signal(ZIGATE_RESPONSE_RECEIVED, self, response=response)
+        metrics.DECODE_LATENCY.labels(msg_type).observe(monotonic() - start)
 
     def interpret_response(self, response):
-        if response.msg == 0x8000:  # status
-            if response['status'] != 0:
-                LOGGER.error('Command 0x{:04x} failed {} : {}'.format(response['packet_type'],
-                                                                      response.status_text(),
-                                                                      response['error']))
-            self._last_status[response['packet_type']] = response
-        elif response.msg == 0x8011:  # APS_DATA_ACK
-            if response['status'] != 0:
-                LOGGER.error('Device {} doesn\'t receive last command to '
-                             'endpoint {} cluster {}: 0x{:02x}'.format(response['addr'],
-                                                                       response['endpoint'],
-                                                                       response['cluster'],
-                                                                       response['status']))
-        elif response.msg == 0x8007:  # factory reset
-            if response['status'] == 0:
-                self._devices = {}
-                self.start_network()
-        elif response.msg == 0x8015:  # device list
-            keys = set(self._devices.keys())
-            known_addr = set([d['addr'] for d in response['devices']])
-            LOGGER.debug('Known devices in zigate : %s', known_addr)
-            missing = keys.difference(known_addr)
-            LOGGER.debug('Previous devices missing : %s', missing)
-            for addr in missing:
-                self._tag_missing(addr)
-#                 self._remove_device(addr)
-            for d in response['devices']:
-                if d['ieee'] == '0000000000000000':
-                    continue
-                device = Device(dict(d), self)
-                self._set_device(device)
-        elif response.msg == 0x8035:  # PDM event
-            LOGGER.warning('PDM Event : %s %s', response['status'], response.status_text())
-        elif response.msg == 0x8042:  # node descriptor
-            addr = response['addr']
-            d = self.get_device_from_addr(addr)
-            if d:
-                d.update_info(response.cleaned_data())
-                self.discover_device(addr)
-        elif response.msg == 0x8043:  # simple descriptor
-            addr = response['addr']
-            endpoint = response['endpoint']
-            d = self.get_device_from_addr(addr)
-            if d:
-                ep = d.get_endpoint(endpoint)
-                ep.update(response.cleaned_data())
-                ep['in_clusters'] = response['in_clusters']
-                ep['out_clusters'] = response['out_clusters']
-                self.discover_device(addr)
-                d._create_actions()
-        elif response.msg == 0x8045:  # endpoint list
-            addr = response['addr']
-            d = self.get_device_from_addr(addr)
-            if d:
-                for endpoint in response['endpoints']:
-                    ep = d.get_endpoint(endpoint['endpoint'])
-                    self.simple_descriptor_request(addr, endpoint['endpoint'])
-                self.discover_device(addr)
-        elif response.msg == 0x8048:  # leave
-            device = self.get_device_from_ieee(response['ieee'])
-            if device:
-                if response['rejoin_status'] == 1:
-                    device.missing = True
-                else:
-                    self._remove_device(device.addr)
-        elif response.msg == 0x8062:  # Get group membership response
-            data = response.cleaned_data()
-            self._sync_group_membership(data['addr'], data['endpoint'], data['groups'])
-        elif response.msg in (0x8100, 0x8102, 0x8110, 0x8401,
-                              0x8085, 0x8095, 0x80A7):  # attribute report or IAS Zone status change
-            if response.get('status', 0) != 0:
-                LOGGER.debug('Received Bad status')
-                # handle special case, no model identifier
-                if response['status'] == 0x86 and response['cluster'] == 0 and response['attribute'] == 5:
-                    response['data'] = 'unsupported'
+        '''
+        call handlers registered for response msg type
+        '''
+        for handler, exclusive in HANDLERS.get(response.msg, ()):
+            name = getattr(handler, '__name__', repr(handler))
+            if getattr(ZiGate, name, None) is handler:  # built-in, may be overridden
+                handler, args = getattr(self, name), (response,)
+            else:
+                args = (self, response)
+            try:
+                if exclusive:
+                    with self._handler_lock:
+                        handler(*args)
                 else:
-                    return
+                    handler(*args)
+            except Exception:
+                LOGGER.error('Error in handler %s of response 0x%04x', name, response.msg)
+                LOGGER.error(traceback.format_exc())
+
+    @register_handler(0x8000)
+    def _handle_status(self, response):
+        if response['status'] != 0:
+            LOGGER.error('Command 0x{:04x} failed {} : {}'.format(response['packet_type'],
+                                                                  response.status_text(),
+                                                                  response['error']))
+        if self._command_traces:
+            command_trace = self._command_traces.pop(response['packet_type'], None)
+            if command_trace:
+                command_trace.mark(tracing.STATUS, response['status'])
+        self._last_status[response['packet_type']] = response
+
+    @register_handler(0x8011)
+    def _handle_aps_data_ack(self, response):
+        if response['status'] != 0:
+            LOGGER.error('Device {} doesn\'t receive last command to '
+                         'endpoint {} cluster {}: 0x{:02x}'.format(response['addr'],
+                                                                   response['endpoint'],
+                                                                   response['cluster'],
+                                                                   response['status']))
+
+    @register_handler(0x8007)
+    def _handle_factory_reset(self, response):
+        if response['status'] == 0:
+            self._devices = {}
+            self._next_change_version()
+            self.start_network()
+
+    @register_handler(0x8015)
+    def _handle_device_list(self, response):
+        keys = set(self._devices.keys())
+        known_addr = set([d['addr'] for d in response['devices']])
+        LOGGER.debug('Known devices in zigate : %s', known_addr)
+        missing = keys.difference(known_addr)
+        LOGGER.debug('Previous devices missing : %s', missing)
+        for addr in missing:
+            self._tag_missing(addr)
+#             self._remove_device(addr)
+        for d in response['devices']:
+            if d['ieee'] == '0000000000000000':
+                continue
+            if self._touch_device(d):
+                continue
+            device = Device(dict(d), self)
+            self._set_device(device)
+
+    @register_handler(0x8035)
+    def _handle_pdm_event(self, response):
+        LOGGER.warning('PDM Event : %s %s', response['status'], response.status_text())
+
+    @register_handler(0x8042)
+    def _handle_node_descriptor(self, response):
+        addr = response['addr']
+        d = self.get_device_from_addr(addr)
+        if d:
+            d.update_info(response.cleaned_data())
+            self.discover_device(addr)
+
+    @register_handler(0x8043)
+    def _handle_simple_descriptor(self, response):
+        addr = response['addr']
+        endpoint = response['endpoint']
+        d = self.get_device_from_addr(addr)
+        if d:
+            ep = d.get_endpoint(endpoint)
+            ep.update(response.cleaned_data())
+            ep['in_clusters'] = response['in_clusters']
+            ep['out_clusters'] = response['out_clusters']
+            d._changed()
+            self.discover_device(addr)
+            d._create_actions()
+
+    @register_handler(0x8045)
+    def _handle_active_endpoints(self, response):
+        addr = response['addr']
+        d = self.get_device_from_addr(addr)
+        if d:
+            for endpoint in response['endpoints']:
+                d.get_endpoint(endpoint['endpoint'])
+                self.simple_descriptor_request(addr, endpoint['endpoint'])
+            d._changed()
+            self.discover_device(addr)
+
+    @register_handler(0x8048)
+    def _handle_leave(self, response):
+        device = self.get_device_from_ieee(response['ieee'])
+        if device:
+            if response['rejoin_status'] == 1:
+                device.missing = True
+            else:
+                self._remove_device(device.addr)
+
+    @register_handler(0x8062)
+    def _handle_group_membership(self, response):
+        data = response.cleaned_data()
+        self._sync_group_membership(data['addr'], data['endpoint'], data['groups'])
+
+    # attribute report or IAS Zone status change
+    @register_handler(0x8100, 0x8102, 0x8110, 0x8401, 0x8085, 0x8095, 0x80A7)
+    def _handle_attribute(self, response):
+        if response.get('status', 0) != 0:
+            LOGGER.debug('Received Bad status')
+            # handle special case, no model identifier
+            if response['status'] == 0x86 and response['cluster'] == 0 and response['attribute'] == 5:
+                response['data'] = 'unsupported'
+            else:
+                return
+        # ignore if related to zigate
+        if response['addr'] == self.addr:
+            return
+        device = self._get_device(response['addr'])
+        device.lqi = response['lqi']
+        device.set_attribute(response['endpoint'],
+                             response['cluster'],
+                             response.cleaned_data())
+
+    @register_handler(0x004D)
+    def _handle_device_announce(self, response):
+        LOGGER.debug('Device Announce %s', response)
+        device = Device(response.data, self)
+        self._set_device(device)
+
+    @register_handler(0x8140)
+    def _handle_attribute_discovery(self, response):
+        if 'addr' in response:
             # ignore if related to zigate
             if response['addr'] == self.addr:
                 return
             device = self._get_device(response['addr'])
-            device.lqi = response['lqi']
             device.set_attribute(response['endpoint'],
                                  response['cluster'],
                                  response.cleaned_data())
-        elif response.msg == 0x004D:  # device announce
-            LOGGER.debug('Device Announce %s', response)
-            device = Device(response.data, self)
-            self._set_device(device)
-        elif response.msg == 0x8140:  # attribute discovery
-            if 'addr' in response:
-                # ignore if related to zigate
-                if response['addr'] == self.addr:
-                    return
-                device = self._get_device(response['addr'])
-                device.set_attribute(response['endpoint'],
-                                     response['cluster'],
-                                     response.cleaned_data())
-        elif response.msg == 0x8501:  # OTA image block request
-            LOGGER.debug('Client is requesting ota image data')
-            self._ota_send_image_data(response)
-        elif response.msg == 0x8503:  # OTA Upgrade end request
-            LOGGER.debug('Client ended ota process')
-            self._ota_handle_upgrade_end_request(response)
-        elif response.msg == 0x8702:  # APS Data confirm Fail
-            LOGGER.warning(response)
-#         else:
-#             LOGGER.debug('Do nothing special for response {}'.format(response))
+
+    @register_handler(0x8501)
+    def _handle_ota_image_block_request(self, response):
+        LOGGER.debug('Client is requesting ota image data')
+        self._ota_send_image_data(response)
+
+    @register_handler(0x8503)
+    def _handle_ota_upgrade_end_request(self, response):
+        LOGGER.debug('Client ended ota process')
+        self._ota_handle_upgrade_end_request(response)
+
+    @register_handler(0x8702)
+    def _handle_aps_data_confirm_fail(self, response):
+        LOGGER.warning(response)
 
     def _get_device(self, addr):
         '''
@@ -754,17 +1225,21 @@ class ZiGate(object):
         remove device from addr
         '''
         device = self._devices.pop(addr)
-        dispatch_signal(ZIGATE_DEVICE_REMOVED, **{'zigate': self,
-                                                  'addr': addr,
-                                                  'device': device})
+        self._reporting_ledger.pop(device.info.get('ieee'), None)
+        self._removed_versions[addr] = self._next_change_version()
+        dispatch_signal(ZIGATE_DEVICE_REMOVED, self, **{'zigate': self,
+                                                        'addr': addr,
+                                                        'device': device})
 
     def _set_device(self, device):
         '''
         add/update device to cache list
         '''
         assert type(device) == Device
+        self._removed_versions.pop(device.addr, None)
         if device.addr in self._devices:
             self._devices[device.addr].update(device)
+            self._devices[device.addr]._changed()
             dispatch_signal(ZIGATE_DEVICE_UPDATED, self, **{'zigate': self,
                                                             'device': self._devices[device.addr]})
         else:
@@ -778,6 +1253,8 @@ class ZiGate(object):
                 d.update(device)
                 self._devices[new_addr] = d
                 del self._devices[old_addr]
+                self._removed_versions[old_addr] = self._next_change_version()
+                d._changed()
                 dispatch_signal(ZIGATE_DEVICE_ADDRESS_CHANGED, self,
                                 **{'zigate': self,
                                    'device': d,
@@ -786,10 +1263,27 @@ class ZiGate(object):
                                    })
             else:
                 self._devices[device.addr] = device
+                device._changed()
                 dispatch_signal(ZIGATE_DEVICE_ADDED, self, **{'zigate': self,
                                                               'device': device})
             self.discover_device(device.addr)
 
+    def _next_change_version(self):
+        '''
+        increment and return global change version
+        '''
+        with self._change_lock:
+            self.change_version += 1
+            return self.change_version
+
+    def get_changes(self, since=0):
+        '''
+        return devices changed and addresses of devices removed since change version
+        '''
+        devices = [device for device in self.devices if device.change_version > since]
+        removed = [addr for addr, version in self._removed_versions.items() if version > since]
+        return devices, removed
+
     def get_status_text(self, status_code):
         return STATUS_CODES.get(status_code,
                                 'Failed with event code: %s', status_code)
@@ -824,6 +1318,7 @@ class ZiGate(object):
             t2 = monotonic()
             if t2 - t1 > WAIT_TIMEOUT:  # no response timeout
                 self._no_response_count += 1
+                metrics.COMMAND_TIMEOUTS.labels(cmd).inc()
                 LOGGER.warning('No response after command 0x{:04x} ({})'.format(cmd, self._no_response_count))
                 return
         self._no_response_count = 0
@@ -1086,10 +1581,11 @@ class ZiGate(object):
         LOGGER.error('Failed to retrieve short address for %s', ieee)
 
     def _bind_unbind(self, cmd, ieee, endpoint, cluster,
-                     dst_addr=None, dst_endpoint=1):
+                     dst_addr=None, dst_endpoint=1, wait=True):
         '''
         bind
         if dst_addr not specified, supposed zigate
+        if wait is False, only wait for status
         '''
         if not dst_addr:
             dst_addr = self.ieee
@@ -1098,7 +1594,9 @@ class ZiGate(object):
         dst_addr = self.__addr(dst_addr)
         data = struct.pack('!QBHB' + addr_fmt + 'B', ieee, endpoint,
                            cluster, addr_mode, dst_addr, dst_endpoint)
-        wait_response = cmd + 0x8000
+        wait_response = None
+        if wait:
+            wait_response = cmd + 0x8000
         return self.send_data(cmd, data, wait_response)
 
     def bind(self, ieee, endpoint, cluster, dst_addr=None, dst_endpoint=1):
@@ -1223,6 +1721,8 @@ class ZiGate(object):
                     self._neighbours_table_cache = self._neighbours_table()
                 finally:
                     self._building_neighbours_table = False
+                dispatch_signal(ZIGATE_NETWORK_TABLE_UPDATED, self, **{'zigate': self,
+                                                                       'network_table': self._neighbours_table_cache})
             else:
                 LOGGER.warning('building neighbours table already started')
         return self._neighbours_table_cache
@@ -1337,6 +1837,7 @@ class ZiGate(object):
             device.discovery = ''
             device.info['mac_capability'] = ''
             device.endpoints = {}
+            self.clear_reporting_ledger(addr)
         if device.discovery:
             return
         typ = device.get_type()
@@ -1359,7 +1860,7 @@ class ZiGate(object):
         if not device.load_template():
             LOGGER.debug('Loading template failed, tag as auto-discovered')
             device.discovery = 'auto-discovered'
-            for endpoint, values in device.endpoints.items():
+            for endpoint, values in list(device.endpoints.items()):
                 for cluster in values.get('in_clusters', []):
                     self.attribute_discovery_request(addr, endpoint, cluster)
 
@@ -1693,11 +2194,15 @@ class ZiGate(object):
         self.send_data(0x0110, data)
 
     def reporting_request(self, addr, endpoint, cluster, attributes,
-                          direction=0, manufacturer_code=0, min_interval=1, max_interval=3600):
+                          direction=0, manufacturer_code=0, min_interval=1, max_interval=3600,
+                          change=0, wait=True):
         '''
         Configure reporting request
         attribute could be a tuple of (attribute_id, attribute_type)
-        or a list of tuple (attribute_id, attribute_type)
+        or (attribute_id, attribute_type, change)
+        or a list of tuple
+        change is the reportable change, encoded according to attribute_type
+        if wait is False, only wait for status
         '''
         addr = self._translate_addr(addr)
         addr_mode, addr_fmt = self._choose_addr_mode(addr)
@@ -1708,159 +2213,517 @@ class ZiGate(object):
 
         attribute_direction = 0
         timeout = 0
-        change = 0
         fmt = ''
         attributes_data = []
         for attribute_tuple in attributes:
-            fmt += 'BBHHHHB'
+            attribute_change = change
+            if len(attribute_tuple) > 2:
+                attribute_change = attribute_tuple[2]
+            attribute_change = encode_reportable_change(attribute_tuple[1], attribute_change)
+            fmt += 'BBHHHH{}s'.format(len(attribute_change))
             attributes_data += [attribute_direction,
                                 attribute_tuple[1],
                                 attribute_tuple[0],
                                 min_interval,
                                 max_interval,
                                 timeout,
-                                change
+                                attribute_change
                                 ]
         manufacturer_specific = manufacturer_code != 0
         data = struct.pack('!B' + addr_fmt + 'BBHBBHB{}'.format(fmt), addr_mode, addr, 1, endpoint, cluster,
                            direction, manufacturer_specific,
                            manufacturer_code, length, *attributes_data)
+        if not wait:
+            return self.send_data(0x0120, data)
         r = self.send_data(0x0120, data, 0x8120)
+        self._handle_reporting_response(r)
+        return r
+
+    def _handle_reporting_response(self, r):
         # reporting not supported on cluster 6, supposed on/off attribute
         if r and r.status == 0x8c and r.cluster == 6:
             device = self._devices[r.addr]
             device.set_assumed_state()
-        return r
 
-    def ota_load_image(self, path_to_file):
-        # Check that ota process is not active
-        if self._ota['active'] is True:
-            LOGGER.error('Cannot load image while OTA process is active.')
-            self.get_ota_status()
+    def bind_report_bulk(self, plan, max_pending=8, force=True):
+        '''
+        Bind and configure reporting for a whole plan
+
+        plan is a list of (addr, endpoint, cluster, attributes)
+        attributes is a list of (attribute_id, attribute_type)
+        or (attribute_id, attribute_type, min_interval, max_interval[, change]),
+        an empty list only binds the cluster.
+
+        Commands are sent one after the other without waiting for the device answer,
+        up to max_pending answers could be awaited at the same time.
+        Successful binds and reports are stored in the reporting ledger,
+        if force is False, entries already in the ledger are not sent again
+        and reported as success.
+        Attributes the device answered as unsupported or unreportable
+        are stored too and never sent again, their status is reported.
+
+        return a list of dict, one per plan item:
+        {'addr', 'endpoint', 'cluster', 'bind': status, 'report': {attribute_id: status}}
+        status is None if no answer has been received
+        '''
+        results = []
+        pending = {}
+        for addr, endpoint, cluster, attributes in plan:
+            result = {'addr': addr, 'endpoint': endpoint, 'cluster': cluster,
+                      'bind': None, 'report': {}}
+            results.append(result)
+            device = self._devices.get(addr)
+            if not device or not device.ieee:
+                LOGGER.error('Failed to bind, addr %s unknown or without IEEE', addr)
+                continue
+            ledger = self._get_reporting_ledger(device.ieee)
+            if not force and (endpoint, cluster) in ledger['bind']:
+                result['bind'] = 0
+            else:
+                while len(pending) >= max_pending:
+                    self._collect_pending(pending)
+                t = monotonic()
+                r = self._bind_unbind(0x0030, device.ieee, endpoint, cluster, wait=False)
+                self._add_pending(pending, 0x8030, r, t,
+                                  functools.partial(self._bind_result, ledger, result, (endpoint, cluster)))
+            for attribute in attributes:
+                attribute_id, attribute_type = attribute[:2]
+                config = tuple(attribute[2:5]) + REPORTING_DEFAULT[len(attribute[2:5]):]
+                min_interval, max_interval, change = config
+                key = (endpoint, cluster, attribute_id)
+                if key in ledger['unsupported']:
+                    result['report'][attribute_id] = ledger['unsupported'][key]
+                    continue
+                if not force and ledger['report'].get(key) == config:
+                    result['report'][attribute_id] = 0
+                    continue
+                while len(pending) >= max_pending:
+                    self._collect_pending(pending)
+                result['report'][attribute_id] = None
+                t = monotonic()
+                r = self.reporting_request(addr, endpoint, cluster, (attribute_id, attribute_type),
+                                           0, 0, min_interval, max_interval, change, wait=False)
+                self._add_pending(pending, 0x8120, r, t,
+                                  functools.partial(self._report_result, ledger, result, key, config))
+        while pending:
+            self._collect_pending(pending)
+        return results
+
+    def _bind_result(self, ledger, result, key, response):
+        if response is None:
             return
+        result['bind'] = response['status']
+        if response['status'] == 0:
+            ledger['bind'].add(key)
 
-        # Try reading file from user provided path
-        try:
-            with open(path_to_file, 'rb') as f:
-                ota_file_content = f.read()
-        except OSError as err:
-            LOGGER.error('{path}: {error}'.format(path=path_to_file, error=err))
-            return False
+    def _report_result(self, ledger, result, key, config, response):
+        if response is None:
+            return
+        if response.msg == 0x8120:
+            self._handle_reporting_response(response)
+        status = response['status']
+        result['report'][key[2]] = status
+        if status == 0:
+            ledger['report'][key] = config
+        elif status in REPORTING_UNSUPPORTED:
+            ledger['report'].pop(key, None)
+            ledger['unsupported'][key] = status
+
+    def _add_pending(self, pending, msg_type, status, sent, callback):
+        '''
+        register a command waiting for its response in the pending table
+        callback is called with the response, the failed status
+        or None if no response has been received
+        '''
+        if status is None:  # no status, nothing to wait
+            return
+        if status['status'] != 0:
+            callback(status)
+            return
+        pending[(msg_type, status['sequence'])] = (sent, callback)
 
-        if ota_file_content.startswith(b'NGIS'):
-            LOGGER.debug('Signed file, removing signature')
-            header_end = struct.unpack('<I', ota_file_content[0x10:0x14])[0]
-            footer_pos = struct.unpack('<I', ota_file_content[0x18:0x1C])[0]
-            ota_file_content = ota_file_content[header_end:footer_pos]
+    def _collect_pending(self, pending):
+        '''
+        wait until at least one pending command is answered or expired
+        '''
+        while True:
+            now = monotonic()
+            done = False
+            for k, (sent, callback) in list(pending.items()):
+                received, response = self._sequence_response.get(k, (0, None))
+                if response is not None and received >= sent:
+                    del pending[k]
+                    callback(response)
+                    done = True
+                elif now - sent > WAIT_TIMEOUT:
+                    LOGGER.warning('No response waiting message 0x{:04x} sequence {}'.format(*k))
+                    del pending[k]
+                    callback(None)
+                    done = True
+            if done or not pending:
+                return
+            sleep(0.01)
 
-        # Ensure that file has 69 bytes so it can contain header
-        if len(ota_file_content) < 69:
-            LOGGER.error('OTA file is too short')
-            return False
+    def _get_reporting_ledger(self, ieee):
+        '''
+        return reporting ledger of device ieee
+        '''
+        return self._reporting_ledger.setdefault(ieee, {'bind': set(), 'report': {}, 'unsupported': {}})
+
+    def get_reporting_ledger(self, addr):
+        '''
+        return successfully configured binds and reports for device addr
+        and attributes the device can't report
+        {'bind': {(endpoint, cluster)},
+         'report': {(endpoint, cluster, attribute): (min_interval, max_interval, change)},
+         'unsupported': {(endpoint, cluster, attribute): status}}
+        '''
+        device = self.get_device_from_addr(addr)
+        if device and device.ieee:
+            return self._get_reporting_ledger(device.ieee)
+
+    def clear_reporting_ledger(self, addr=None):
+        '''
+        forget configured binds and reports of device addr
+        or of all devices if addr is None,
+        they will be sent again on next template loading
+        '''
+        if addr is None:
+            self._reporting_ledger = {}
+            return
+        device = self.get_device_from_addr(addr)
+        if device:
+            self._reporting_ledger.pop(device.info.get('ieee'), None)
+
+    def read_reporting_configuration_request(self, addr, endpoint, cluster, attributes,
+                                             direction=0, manufacturer_code=0, wait=True):
+        '''
+        Read reporting configuration request
+        attribute can be a unique int or a list of int
+        if wait is False, only wait for status
+        '''
+        addr = self._translate_addr(addr)
+        addr_mode, addr_fmt = self._choose_addr_mode(addr)
+        addr = self.__addr(addr)
+        if not isinstance(attributes, list):
+            attributes = [attributes]
+        length = len(attributes)
+        attributes_data = []
+        for attribute_id in attributes:
+            attributes_data += [0, attribute_id]
+        manufacturer_specific = manufacturer_code != 0
+        data = struct.pack('!B' + addr_fmt + 'BBHBBHB{}'.format('BH' * length), addr_mode, addr, 1, endpoint, cluster,
+                           direction, manufacturer_specific,
+                           manufacturer_code, length, *attributes_data)
+        wait_response = None
+        if wait:
+            wait_response = 0x8122
+        return self.send_data(0x0122, data, wait_response)
 
-        # Read header data
+    def verify_reporting(self, addr=None, max_pending=8):
+        '''
+        Read back the reporting configuration of the devices in the reporting ledger,
+        entries which doesn't match anymore are removed from the ledger
+        and configured again
+        if addr is None, verify all devices
+        '''
+        if addr:
+            devices = [self.get_device_from_addr(addr)]
+        else:
+            devices = self.devices
+        for device in devices:
+            if not device or device.info.get('ieee') not in self._reporting_ledger:
+                continue
+            ledger = self._reporting_ledger[device.ieee]
+            LOGGER.debug('Verify reporting configuration of %s', device)
+            removed = []
+            pending = {}
+            for key, config in list(ledger['report'].items()):
+                while len(pending) >= max_pending:
+                    self._collect_pending(pending)
+                endpoint, cluster, attribute_id = key
+                t = monotonic()
+                r = self.read_reporting_configuration_request(device.addr, endpoint, cluster,
+                                                              attribute_id, wait=False)
+                self._add_pending(pending, 0x8122, r, t,
+                                  functools.partial(self._verify_reporting_result, ledger, key, config, removed))
+            while pending:
+                self._collect_pending(pending)
+            if removed:
+                device._bind_report()
+
+    def _verify_reporting_result(self, ledger, key, config, removed, response):
+        if response is None or response.msg == 0x8000:  # sleeping device or unsupported command, keep it
+            return
+        change = response.get('change')
+        if response['status'] != 0 or \
+           (response.get('min_interval'), response.get('max_interval')) != config[:2] or \
+           (change is not None and encode_reportable_change(response['data_type'], change) !=
+                encode_reportable_change(response['data_type'], config[2])):
+            LOGGER.warning('Reporting configuration of %s differs, configure it again', key)
+            ledger['report'].pop(key, None)
+            ledger['bind'].discard(key[:2])
+            removed.append(key)
+
+    def start_auto_verify_reporting(self, interval=VERIFY_REPORTING):
+        '''
+        periodically verify reporting configuration
+        '''
+        self._verifyreportingtimer = threading.Timer(interval, self._auto_verify_reporting, (interval,))
+        self._verifyreportingtimer.setDaemon(True)
+        self._verifyreportingtimer.start()
+
+    def _auto_verify_reporting(self, interval):
         try:
-            header_data = list(struct.unpack('<LHHHHHLH32BLBQHH', ota_file_content[:69]))
-        except struct.error:
-            LOGGER.exception('Header is not correct')
-            return False
+            self.verify_reporting()
+        except Exception:
+            LOGGER.error('Failed to verify reporting configuration')
+            LOGGER.error(traceback.format_exc())
+        if not self._closing:
+            self.start_auto_verify_reporting(interval)
 
-        # Fix header str
-        # First replace null characters from header str to spaces
-        for i in range(8, 40):
-            if header_data[i] == 0x00:
-                header_data[i] = 0x20
-        # Reconstruct header data
-        header_data_compact = header_data[0:8] + [header_data[8:40]] + header_data[40:]
-        # Convert header data to dict
-        header_headers = [
-            'file_id', 'header_version', 'header_length', 'header_fctl', 'manufacturer_code', 'image_type',
-            'image_version', 'stack_version', 'header_str', 'size', 'security_cred_version', 'upgrade_file_dest',
-            'min_hw_version', 'max_hw_version'
-        ]
-        header = dict(zip(header_headers, header_data_compact))
-
-        # Check that size from header corresponds to file size
-        if header['size'] != len(ota_file_content):
-            LOGGER.error('Header size({header}) and file size({file}) does not match'.format(
-                header=header['size'], file=len(ota_file_content)
-            ))
+    def ota_load_image(self, path_to_file):
+        '''
+        Load OTA image, image is memory-mapped and can be sent
+        to several devices at the same time.
+        Image header is loaded in ZiGate to answer query next image requests.
+        '''
+        image = self._ota_open_image(path_to_file)
+        if image is None:
             return False
+        if image is False:
+            self.get_ota_status()
+            return
+
+        if self._ota_load_server_image(image):
+            LOGGER.info('OTA header loaded to server successfully.')
+        else:
+            LOGGER.warning('Something wrong with ota file header.')
 
+    def _ota_open_image(self, path_to_file, directory=False):
+        '''
+        memory-map image and add it to loaded images
+        images from OTA directory are closed when superseded or idle
+        return None if image is invalid, False if same image is currently sent
+        '''
+        try:
+            image = OTAImage(path_to_file)
+        except (OSError, OTAImageError, struct.error) as err:
+            LOGGER.error('{path}: {error}'.format(path=path_to_file, error=err))
+            return None
+
+        with self._ota_lock:
+            self._ota_expire_sessions()
+            # Check that same image is not currently sent
+            if any(session.image.key == image.key for session in self._ota_sessions.values()):
+                LOGGER.error('Cannot load image while OTA process is active for this image.')
+                image.close()
+                return False
+            old_image = self._ota_images.get(image.key)
+            self._ota_images[image.key] = image
+            if directory:
+                self._ota_directory_images.add(image.key)
+            else:
+                self._ota_directory_images.discard(image.key)
+            if old_image:
+                old_image.close()
+            self._ota_evict_images(keep=image.key)
+        return image
+
+    def _ota_evict_images(self, keep=None):
+        '''
+        close images from OTA directory without session which are
+        superseded by a newer version or unused for session timeout,
+        must be called with OTA lock held
+        '''
+        now = monotonic()
+        used = set(session.image.key for session in self._ota_sessions.values())
+        used.add(keep)
+        if self._ota_server_image:
+            used.add(self._ota_server_image.key)
+        latest = {}
+        for key in self._ota_images:
+            latest[key[:2]] = max(key[2], latest.get(key[:2], key[2]))
+        for key in list(self._ota_directory_images):
+            image = self._ota_images.get(key)
+            if image is None:
+                self._ota_directory_images.discard(key)
+                continue
+            if key in used:
+                continue
+            if key[2] < latest[key[:2]] or now - image.last_used > self._ota_session_timeout:
+                LOGGER.debug('Closing unused OTA image %s', image)
+                del self._ota_images[key]
+                self._ota_directory_images.discard(key)
+                image.close()
+
+    def _ota_expire_sessions(self):
+        '''
+        remove sessions without block request for session timeout,
+        must be called with OTA lock held
+        '''
+        now = monotonic()
+        for key, session in list(self._ota_sessions.items()):
+            if session.expired(now, self._ota_session_timeout):
+                LOGGER.warning('OTA upgrade of %s expired, no block request since %ss',
+                               session.addr, int(now - session.last_activity))
+                del self._ota_sessions[key]
+                status = session.status()
+                status['result'] = None
+                self._ota_completed[key] = status
+        self._ota_evict_images()
+
+    def _ota_load_server_image(self, image):
+        '''
+        load image header in ZiGate
+        '''
         destination_address_mode = 0x02
         destination_address = 0x0000
-        data = struct.pack('!BHlHHHHHLH32BLBQHH', destination_address_mode, destination_address, *header_data)
+        data = struct.pack('!BH', destination_address_mode, destination_address) + image.header_payload()
         response = self.send_data(0x0500, data)
+        if response and response.status == 0:
+            self._ota_server_image = image
+            return True
+        return False
 
-        # If response is success place header and file content to variable
-        if response.status == 0:
-            LOGGER.info('OTA header loaded to server successfully.')
-            self._ota_reset_local_variables()
-            self._ota['image']['header'] = header
-            self._ota['image']['data'] = ota_file_content
-        else:
-            LOGGER.warning('Something wrong with ota file header.')
+    def ota_load_directory(self, path):
+        '''
+        Use directory (like ~/ota filled by ikea_ota_download) as OTA images library
+        Block requests are answered from matching image automatically.
+        return list of available images
+        '''
+        self._ota_repository = OTARepository(path)
+        self._ota_repository.refresh()
+        return self._ota_repository.images()
+
+    def ota_images(self):
+        '''
+        return list of available images in OTA directory
+        '''
+        if self._ota_repository is None:
+            return []
+        self._ota_repository.refresh()
+        return self._ota_repository.images()
+
+    def _ota_get_image(self, manufacturer_code, image_type, image_version=None):
+        '''
+        return loaded image or load it from OTA directory
+        latest version if image_version is None
+        '''
+        if image_version is None:
+            versions = [k[2] for k in self._ota_images if k[:2] == (manufacturer_code, image_type)]
+            if self._ota_repository:
+                latest = self._ota_repository.latest().get((manufacturer_code, image_type))
+                if latest is not None:
+                    versions.append(latest)
+            if not versions:
+                return None
+            image_version = max(versions)
+        key = (manufacturer_code, image_type, image_version)
+        image = self._ota_images.get(key)
+        if image is None and self._ota_repository:
+            path = self._ota_repository.get(*key)
+            if path:
+                LOGGER.debug('Loading OTA image %s', path)
+                image = self._ota_open_image(path, directory=True) or None
+        return image
+
+    def ota_configure(self, block_delay=None, max_data_size=None, session_timeout=None):
+        '''
+        Tune OTA transfers
+        block_delay: minimum delay in seconds between two block responses to the same device
+        max_data_size: maximum block size, smaller than the size requested by device, 0 to disable
+        session_timeout: seconds without block request before a session is dropped
+        '''
+        if block_delay is not None:
+            self._ota_block_delay = block_delay
+        if max_data_size is not None:
+            self._ota_max_data_size = max_data_size or None
+        if session_timeout is not None:
+            self._ota_session_timeout = session_timeout
+        return {'block_delay': self._ota_block_delay,
+                'max_data_size': self._ota_max_data_size,
+                'session_timeout': self._ota_session_timeout}
 
     def _ota_send_image_data(self, request):
-        errors = False
-        # Ensure that image is loaded using ota_load_image
-        if self._ota['image']['header'] is None:
-            LOGGER.error('No header found. Load image using ota_load_image(\'path_to_ota_image\')')
-            errors = True
-        if self._ota['image']['data'] is None:
-            LOGGER.error('No data found. Load image using ota_load_image(\'path_to_ota_ota\')')
-            errors = True
-        if errors:
-            return
-
-        # Compare received image data to loaded image
-        errors = False
-        if request['image_version'] != self._ota['image']['header']['image_version']:
-            LOGGER.error('Image versions do not match. Make sure you have correct image loaded.')
-            errors = True
-        if request['image_type'] != self._ota['image']['header']['image_type']:
-            LOGGER.error('Image types do not match. Make sure you have correct image loaded.')
-            errors = True
-        if request['manufacturer_code'] != self._ota['image']['header']['manufacturer_code']:
-            LOGGER.error('Manufacturer codes do not match. Make sure you have correct image loaded.')
-            errors = True
-        if errors:
+        received = monotonic()
+        # Find image loaded using ota_load_image or from ota directory
+        image = self._ota_get_image(request['manufacturer_code'], request['image_type'], request['image_version'])
+        if image is None:
+            LOGGER.error('No image found for manufacturer 0x%04x image type 0x%04x version 0x%08x. '
+                         'Load image using ota_load_image(\'path_to_ota_image\')',
+                         request['manufacturer_code'], request['image_type'], request['image_version'])
             return
 
         # Mark ota process started
-        if self._ota['starttime'] is False and self._ota['active'] is False:
-            self._ota['starttime'] = datetime.datetime.now()
-            self._ota['active'] = True
-            self._ota['transfered'] = 0
-            self._ota['addr'] = request['addr']
-
-        source_endpoint = 0x01
-        ota_status = 0x00  # Success. Using value 0x01 would make client to request data again later
-
-        # Get requested bytes from ota file
-        self._ota['transfered'] = request['file_offset']
-        end_position = request['file_offset'] + request['max_data_size']
-        ota_data_to_send = self._ota['image']['data'][request['file_offset']:end_position]
-        data_size = len(ota_data_to_send)
-        ota_data_to_send = struct.unpack('<{}B'.format(data_size), ota_data_to_send)
+        with self._ota_lock:
+            image = self._ota_images.get(image.key)  # may have been replaced meanwhile
+            if image is None:
+                return
+            session_key = (request['addr'],) + image.key[:2]
+            session = self._ota_sessions.get(session_key)
+            if session is None or session.image is not image:
+                session = OTASession(request['addr'], image)
+                self._ota_sessions[session_key] = session
+            self._ota_expire_sessions()
+            # a retried request replaces the one waiting for its pacing delay
+            timer = self._ota_block_timers.pop(session_key, None)
+            if timer:
+                timer.cancel()
+            if self._ota_block_delay and session.last_response is not None:
+                wait = session.last_response + self._ota_block_delay - monotonic()
+                if wait > 0:
+                    # do not block decoding thread, response is sent later
+                    timer = threading.Timer(wait, self._ota_send_block, (session, request, received, True))
+                    timer.setDaemon(True)
+                    self._ota_block_timers[session_key] = timer
+                    timer.start()
+                    return
+        self._ota_send_block(session, request, received)
+
+    def _ota_send_block(self, session, request, received, paced=False):
+        '''
+        build and send block response of session
+        paced is True when called from pacing timer
+        '''
+        start = monotonic()
+        image = session.image
+        # images are closed under the same lock, block is copied from an open image
+        with self._ota_lock:
+            if paced:
+                if self._ota_block_timers.get(session.key) is not threading.current_thread():
+                    return  # cancelled or replaced by a retried request
+                del self._ota_block_timers[session.key]
+                if self._ota_sessions.get(session.key) is not session:
+                    return  # session ended while waiting
+            if self._ota_images.get(image.key) is not image:
+                LOGGER.warning('OTA image %s has been replaced, block request ignored', image)
+                return
+            data = session.pack_block(request, max_data_size=self._ota_max_data_size)
 
         # Giving user feedback of ota process
-        self.get_ota_status(debug=True)
-
-        data = struct.pack('!BHBBBBLLHHB{}B'.format(data_size), request['address_mode'], self.__addr(request['addr']),
-                           source_endpoint, request['endpoint'], request['sequence'], ota_status,
-                           request['file_offset'], self._ota['image']['header']['image_version'],
-                           self._ota['image']['header']['image_type'],
-                           self._ota['image']['header']['manufacturer_code'],
-                           data_size, *ota_data_to_send)
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            self.get_ota_status(debug=True, addr=request['addr'])
+
         self.send_data(0x0502, data, wait_status=False)
+        session.record(received, start, monotonic(), len(data) - OTA_BLOCK_HEADER.size)
 
     def _ota_handle_upgrade_end_request(self, request):
-        if self._ota['active'] is True:
+        with self._ota_lock:
+            session = self._ota_sessions.pop((request['addr'], request['manufacture_code'], request['image_type']),
+                                             None)
+        if session:
+            status = session.status()
+            status['result'] = request['status']
+            self._ota_completed[session.key] = status
             # Handle error statuses
             if request['status'] == 0x00:
-                LOGGER.info('OTA image upload finnished successfully in {seconds}s.'.format(
-                    seconds=(datetime.datetime.now() - self._ota['starttime']).seconds))
+                LOGGER.info('OTA image upload to {addr} finnished successfully in {seconds}s.'.format(
+                    addr=session.addr, seconds=int(status['elapsed'])))
+                device = self.get_device_from_addr(session.addr)
+                if device:
+                    device.update_info({'image_type': request['image_type'],
+                                        'image_version': request['file_version']})
             elif request['status'] == 0x95:
                 LOGGER.warning('OTA aborted by client')
             elif request['status'] == 0x96:
@@ -1869,43 +2732,41 @@ class ZiGate(object):
                 LOGGER.warning('OTA image uploaded successfully, but client needs more images for update.')
             elif request['status'] != 0x00:
                 LOGGER.warning('Some unexpected OTA status {}'.format(request['status']))
-            # Reset local ota variables
-            self._ota_reset_local_variables()
-
-    def _ota_reset_local_variables(self):
-        self._ota = {
-            'image': {
-                'header': None,
-                'data': None,
-            },
-            'active': False,
-            'starttime': False,
-            'transfered': 0,
-            'addr': None
-        }
 
-    def get_ota_status(self, debug=False):
-        if self._ota['active']:
-            image_size = len(self._ota['image']['data'])
-            time_passed = (datetime.datetime.now() - self._ota['starttime']).seconds
-            try:
-                time_remaining = int((image_size / self._ota['transfered']) * time_passed) - time_passed
-            except ZeroDivisionError:
-                time_remaining = -1
+    def get_ota_status(self, debug=False, addr=None):
+        '''
+        log and return status of active OTA sessions
+        '''
+        sessions = [session.status() for session in list(self._ota_sessions.values())
+                    if addr is None or session.addr == addr]
+        messages = []
+        for status in sessions:
             message = 'OTA upgrade address {addr}: {sent:>{width}}/{total:>{width}} {percentage:.3%}'.format(
-                addr=self._ota['addr'], sent=self._ota['transfered'], total=image_size,
-                percentage=self._ota['transfered'] / image_size, width=len(str(image_size)))
+                addr=status['addr'], sent=status['transfered'], total=status['size'],
+                percentage=status['progress'], width=len(str(status['size'])))
             message += ' time elapsed: {passed}s Time remaining estimate: {remaining}s'.format(
-                passed=time_passed, remaining=time_remaining
+                passed=int(status['elapsed']), remaining=int(status['remaining'])
             )
-        else:
-            message = "OTA process is not active"
-        if debug:
-            LOGGER.debug(message)
-        else:
-            LOGGER.info(message)
+            messages.append(message)
+        if not messages:
+            messages.append("OTA process is not active")
+        for message in messages:
+            if debug:
+                LOGGER.debug(message)
+            else:
+                LOGGER.info(message)
+        return sessions
 
-    def ota_image_notify(self, addr, destination_endpoint=0x01, payload_type=0):
+    def ota_metrics(self):
+        '''
+        return OTA configuration, active and completed sessions with their metrics
+        '''
+        return {'config': self.ota_configure(),
+                'active': [session.status() for session in list(self._ota_sessions.values())],
+                'completed': list(self._ota_completed.values())}
+
+    def ota_image_notify(self, addr, destination_endpoint=0x01, payload_type=0,
+                         manufacturer_code=None, image_type=None):
         """
         Send image available notification to client. This will start ota process
 
@@ -1913,15 +2774,25 @@ class ZiGate(object):
         :param destination_endpoint:
         :param payload_type: 0, 1, 2, 3
         :type payload_type: int
+        :param manufacturer_code: image to notify, default to last loaded image
+        :param image_type: image to notify, default to last loaded image
         :return:
         """
         # Get required data from ota header
-        if self._ota['image']['header'] is None:
+        if manufacturer_code is None or image_type is None:
+            image = self._ota_server_image
+        else:
+            image = self._ota_get_image(manufacturer_code, image_type)
+        if image is None:
             LOGGER.warning('Cannot read ota header. No ota file loaded.')
             return False
-        image_version = self._ota['image']['header']['image_version']
-        image_type = self._ota['image']['header']['image_type']
-        manufacturer_code = self._ota['image']['header']['manufacturer_code']
+        # ZiGate answers query next image with its loaded header
+        if image is not self._ota_server_image and not self._ota_load_server_image(image):
+            LOGGER.warning('Failed to load ota header in ZiGate.')
+            return False
+        image_version = image.header['image_version']
+        image_type = image.header['image_type']
+        manufacturer_code = image.header['manufacturer_code']
 
         source_endpoint = 0x01
         destination_address_mode = 0x02  # uint16
@@ -1942,6 +2813,91 @@ class ZiGate(object):
                            source_endpoint, destination_endpoint, 0,
                            image_version, image_type, manufacturer_code, query_jitter)
         self.send_data(0x0505, data)
+        return True
+
+    def ota_notify_all(self, pace=1.0, image_delay=30, destination_endpoint=0x01, query=True):
+        '''
+        Notify every device having a newer image available in OTA directory
+        (or loaded images), matching on node descriptor manufacturer code
+        and on current image type/version of the device.
+        Only devices whose version is known (from previous upgrade or read from
+        OTA cluster) are notified, if query is True the version of the other devices
+        of these manufacturers is read so they can be notified on next call.
+        Notifications are sent from a background timer, paced by pace seconds,
+        since ZiGate only holds one image header, image_delay seconds are waited
+        before switching image so notified devices can query it.
+        return list of (addr, manufacturer_code, image_type, image_version) to notify
+        '''
+        available = {k[:2]: k[2] for k in sorted(self._ota_images)}
+        if self._ota_repository:
+            self._ota_repository.refresh()
+            for key, version in self._ota_repository.latest().items():
+                available[key] = max(version, available.get(key, version))
+        manufacturers = set('{:04x}'.format(k[0]) for k in available)
+        plan = []
+        unknown = []
+        for device in self.devices:
+            if device.info.get('manufacturer_code') not in manufacturers:
+                continue
+            current = self._ota_device_version(device)
+            if current is None:
+                unknown.append(device)
+                continue
+            for (manufacturer_code, image_type), image_version in available.items():
+                if device.info['manufacturer_code'] == '{:04x}'.format(manufacturer_code) and \
+                   current[0] == image_type and current[1] < image_version:
+                    plan.append((device.addr, manufacturer_code, image_type, image_version))
+        plan.sort(key=lambda p: p[1:3])
+        if query:
+            for device in unknown:
+                self._ota_query_version(device)
+        if self._ota_notify_timer:
+            self._ota_notify_timer.cancel()
+        if plan:
+            self._ota_schedule_notify(0, plan, 0, pace, image_delay, destination_endpoint)
+        return plan
+
+    def _ota_device_version(self, device):
+        '''
+        return (image_type, image_version) currently running on device or None if unknown
+        '''
+        info = device.info
+        if info.get('image_type') is not None and info.get('image_version') is not None:
+            return (info['image_type'], info['image_version'])
+        for endpoint_id in device.endpoints:
+            image_type = device.get_attribute(endpoint_id, 0x0019, 0x0008)
+            version = device.get_attribute(endpoint_id, 0x0019, 0x0002)
+            if image_type and version:
+                return (image_type['value'], version['value'])
+
+    def _ota_query_version(self, device):
+        '''
+        read current image type and version from device OTA client cluster
+        '''
+        endpoints = [endpoint_id for endpoint_id, endpoint in device.endpoints.items()
+                     if 0x0019 in endpoint.get('out_clusters', [])]
+        if not endpoints:
+            return
+        LOGGER.debug('Query OTA version of %s', device)
+        self.read_attribute_request(device.addr, endpoints[0], 0x0019, [0x0002, 0x0008], direction=1)
+
+    def _ota_schedule_notify(self, delay, plan, index, pace, image_delay, destination_endpoint):
+        self._ota_notify_timer = threading.Timer(delay, self._ota_notify_next,
+                                                 (plan, index, pace, image_delay, destination_endpoint))
+        self._ota_notify_timer.setDaemon(True)
+        self._ota_notify_timer.start()
+
+    def _ota_notify_next(self, plan, index, pace, image_delay, destination_endpoint):
+        addr, manufacturer_code, image_type, image_version = plan[index]
+        try:
+            self.ota_image_notify(addr, destination_endpoint, 2, manufacturer_code, image_type)
+        except Exception:
+            LOGGER.error('Failed to notify OTA image to %s', addr)
+            LOGGER.error(traceback.format_exc())
+        index += 1
+        if index < len(plan) and not self._closing:
+            delay = pace if plan[index][1:3] == plan[index - 1][1:3] else image_delay
+            self._ota_schedule_notify(delay, plan, index, pace, image_delay, destination_endpoint)
 
     def attribute_discovery_request(self, addr, endpoint, cluster,
                                     direction=0, manufacturer_code=0):
@@ -2476,10 +3432,21 @@ class Device(object):
         self.endpoints = {}
         self._expire_timer = {}
         self._fast_change = {}
+        self._signaled = {}  # (endpoint, cluster, attribute) to last signaled value of filtered attribute
         self.missing = False
         self.genericType = ''
         self.discovery = ''
         self.name = ''
+        self.change_version = 0
+
+    def _changed(self):
+        '''
+        update change version of device
+        '''
+        if self._zigate:
+            self.change_version = self._zigate._next_change_version()
+        else:
+            self.change_version += 1
 
     def _lock_acquire(self):
         LOGGER.debug('Acquire Lock on device %s', self)
@@ -2563,144 +3530,76 @@ class Device(object):
         '''
         if not BIND_REPORT:
             return
+        LOGGER.debug('Start automagic bind and report process for device %s', self)
+        plan = self._bind_report_plan(enpoint_id)
+        if plan:
+            return self._zigate.bind_report_bulk(plan, force=False)
+
+    def _bind_report_plan(self, enpoint_id=None):
+        '''
+        build the list of (addr, endpoint, cluster, attributes)
+        to bind and report
+        '''
         if enpoint_id:
             endpoints_list = [(enpoint_id, self.endpoints[enpoint_id])]
         else:
             endpoints_list = list(self.endpoints.items())
-        LOGGER.debug('Start automagic bind and report process for device %s', self)
+        plan = []
         for endpoint_id, endpoint in endpoints_list:
             # if endpoint['device'] in ACTUATORS:  # light
             LOGGER.debug('Bind and report endpoint %s for device %s', endpoint_id, self)
-            if 0x0001 in endpoint['in_clusters']:
-                LOGGER.debug('bind and report for cluster 0x0001')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0x0001)
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0001, (0x0020, 0x20))
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0001, (0x0021, 0x20))
-            if 0x0006 in endpoint['in_clusters']:
-                LOGGER.debug('bind and report for cluster 0x0006')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0x0006)
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0006, (0x0000, 0x10))
-            if 0x0008 in endpoint['in_clusters']:
-                LOGGER.debug('bind and report for cluster 0x0008')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0x0008)
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0008, (0x0000, 0x20))
-            if 0x0009 in endpoint['in_clusters']:
-                LOGGER.debug('bind and report for cluster 0x0009')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0x0009)
-            if 0x000f in endpoint['in_clusters']:
-                LOGGER.debug('bind and report for cluster 0x000f')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0x000f)
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x000f, (0x0055, 0x10))
-            if 0x0101 in endpoint['in_clusters']:
-                LOGGER.debug('bind and report for cluster 0x0101')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0x0101)
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0101, (0x0000, 0x30))
-            if 0x0102 in endpoint['in_clusters']:
-                LOGGER.debug('bind and report for cluster 0x0102')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0x0102)
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0102, (0x0007, 0x20))
-            if 0x0201 in endpoint['in_clusters']:
-                LOGGER.debug('bind and report for cluster 0x0201')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0x0201)
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0201, (0x0000, 0x29))
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0201, (0x0002, 0x18))
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0201, (0x0008, 0x20))
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0201, (0x0012, 0x29))
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0201, (0x0014, 0x29))
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0201, (0x001C, 0x30))
-            if 0x0300 in endpoint['in_clusters']:
-                LOGGER.debug('bind and report for cluster 0x0300')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0x0300)
-                if endpoint['device'] in (0x0105,):
-                    self._zigate.reporting_request(self.addr,
-                                                   endpoint_id,
-                                                   0x0300, (0x0000, 0x20))
-                    self._zigate.reporting_request(self.addr,
-                                                   endpoint_id,
-                                                   0x0300, (0x0001, 0x20))
-                elif endpoint['device'] in (0x010D, 0x0210):
-                    # self._zigate.reporting_request(self.addr,
-                    #                               endpoint_id,
-                    #                               0x0300, [(0x0000, 0x20),
-                    #                                        (0x0001, 0x20),
-                    #                                        (0x0003, 0x21),
-                    #                                        (0x0004, 0x21),
-                    #                                        (0x0007, 0x21),
-                    #                                        ])
-                    self._zigate.reporting_request(self.addr,
-                                                   endpoint_id,
-                                                   0x0300, (0x0000, 0x20))
-                    self._zigate.reporting_request(self.addr,
-                                                   endpoint_id,
-                                                   0x0300, (0x0001, 0x20))
-                    self._zigate.reporting_request(self.addr,
-                                                   endpoint_id,
-                                                   0x0300, (0x0003, 0x21))
-                    self._zigate.reporting_request(self.addr,
-                                                   endpoint_id,
-                                                   0x0300, (0x0004, 0x21))
-                    self._zigate.reporting_request(self.addr,
-                                                   endpoint_id,
-                                                   0x0300, (0x0007, 0x21))
-                elif endpoint['device'] in (0x0102, 0x010C, 0x0220):
-                    self._zigate.reporting_request(self.addr,
-                                                   endpoint_id,
-                                                   0x0300, (0x0007, 0x21))
-                else:  # 0x0200
-                    # self._zigate.reporting_request(self.addr,
-                    #                               endpoint_id,
-                    #                               0x0300, [(0x0000, 0x20),
-                    #                                        (0x0001, 0x20),
-                    #                                        (0x0003, 0x21),
-                    #                                        (0x0004, 0x21),
-                    #                                        ])
-                    self._zigate.reporting_request(self.addr,
-                                                   endpoint_id,
-                                                   0x0300, (0x0000, 0x20))
-                    self._zigate.reporting_request(self.addr,
-                                                   endpoint_id,
-                                                   0x0300, (0x0001, 0x20))
-                    self._zigate.reporting_request(self.addr,
-                                                   endpoint_id,
-                                                   0x0300, (0x0003, 0x21))
-                    self._zigate.reporting_request(self.addr,
-                                                   endpoint_id,
-                                                   0x0300, (0x0004, 0x21))
-            if 0x0400 in endpoint['in_clusters']:
-                LOGGER.debug('bind for cluster 0x0400')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0x0400)
-            if 0x0402 in endpoint['in_clusters']:
-                LOGGER.debug('bind for cluster 0x0402')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0x0402)
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0402, (0x0000, 0x29), 0, 0, 30, 3600)
-            if 0x0405 in endpoint['in_clusters']:
-                LOGGER.debug('bind for cluster 0x0405')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0x0405)
-                self._zigate.reporting_request(self.addr, endpoint_id,
-                                               0x0405, (0x0000, 0x21), 0, 0, 30, 3600)
-            if 0xFC00 in endpoint['in_clusters']:
-                LOGGER.debug('bind for cluster 0xFC00')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0xFC00)
-            if 0x0702 in endpoint['in_clusters']:
-                LOGGER.debug('bind for cluster 0x0702')
-                self._zigate.bind_addr(self.addr, endpoint_id, 0x0702)
-                self._zigate.reporting_request(self.addr,
-                                               endpoint_id,
-                                               0x0702, (0x0000, 0x25))
+            for cluster_id, attributes in BIND_REPORT_CLUSTERS.items():
+                if cluster_id not in endpoint['in_clusters']:
+                    continue
+                if cluster_id == 0x0300:
+                    if endpoint['device'] in (0x0105,):
+                        attributes = [(0x0000, 0x20), (0x0001, 0x20)]
+                    elif endpoint['device'] in (0x010D, 0x0210):
+                        attributes = [(0x0000, 0x20), (0x0001, 0x20), (0x0003, 0x21),
+                                      (0x0004, 0x21), (0x0007, 0x21)]
+                    elif endpoint['device'] in (0x0102, 0x010C, 0x0220):
+                        attributes = [(0x0007, 0x21)]
+                LOGGER.debug('bind and report for cluster 0x%04x', cluster_id)
+                attributes = [(attribute_id, attribute_type) + self.get_reporting_profile(cluster_id, attribute_id)
+                              for attribute_id, attribute_type in attributes]
+                plan.append((self.addr, endpoint_id, cluster_id, attributes))
+        return plan
+
+    def get_reporting_profile(self, cluster_id, attribute_id):
+        '''
+        return reporting profile (min_interval, max_interval, change) for attribute
+        each field is taken from the attribute then the cluster device profile
+        (from template or set_reporting_profile), then from the attribute
+        then the cluster REPORTING_PROFILES, then from REPORTING_DEFAULT
+        '''
+        profiles = {(p['cluster'], p.get('attribute')): p for p in self.info.get('reporting', [])}
+        sources = [profiles.get((cluster_id, attribute_id), {}), profiles.get((cluster_id, None), {})]
+        for k in ((cluster_id, attribute_id), (cluster_id, None)):
+            if k in REPORTING_PROFILES:
+                sources.append(dict(zip(REPORTING_FIELDS, REPORTING_PROFILES[k])))
+        profile = []
+        for field, default in zip(REPORTING_FIELDS, REPORTING_DEFAULT):
+            profile.append(next((s[field] for s in sources if s.get(field) is not None), default))
+        return tuple(profile)
+
+    def set_reporting_profile(self, cluster_id, attribute_id=None,
+                              min_interval=None, max_interval=None, change=None):
+        '''
+        override reporting profile for a cluster or a specific attribute
+        change is the reportable change in attribute unit (eg 10 for 0.1 °C on 0x0402)
+        only given fields are overridden, see get_reporting_profile,
+        it will be applied on next bind and report
+        '''
+        profiles = [p for p in self.info.get('reporting', [])
+                    if (p['cluster'], p.get('attribute')) != (cluster_id, attribute_id)]
+        profile = {'cluster': cluster_id}
+        for field, value in zip(REPORTING_FIELDS, (min_interval, max_interval, change)):
+            if value is not None:
+                profile[field] = value
+        if attribute_id is not None:
+            profile['attribute'] = attribute_id
+        profiles.append(profile)
+        self.info['reporting'] = profiles
 
     @staticmethod
     def from_json(data, zigate_instance=None):
@@ -3016,6 +3915,7 @@ class Device(object):
         self._lock_acquire()
         self.info.update(info)
         self._lock_release()
+        self._changed()
 
     def get_endpoint(self, endpoint_id):
         self._lock_acquire()
@@ -3039,12 +3939,14 @@ class Device(object):
         return endpoint['clusters'][cluster_id]
 
     def set_attribute(self, endpoint_id, cluster_id, data):
+        tracing.TRACER.mark(tracing.SET_ATTRIBUTE, cluster_id)
         added = False
         lqi = data.pop('lqi', 0)
         if lqi > 0:
             self.info['lqi'] = lqi
         self.info['last_seen'] = strftime('%Y-%m-%d %H:%M:%S')
         self.missing = False
+        self._changed()
 
         # delay fast change for cluster 0x0006
         if DETECT_FASTCHANGE and cluster_id == 0x0006 and data['attribute'] == 0x0000:
@@ -3058,6 +3960,16 @@ class Device(object):
                 return
 
         cluster = self.get_cluster(endpoint_id, cluster_id)
+        change_filter = self._zigate._get_change_filter(cluster, data['attribute']) if self._zigate else None
+        previous_value = None
+        if change_filter:
+            previous = cluster.attributes.get(data['attribute'])
+            if previous and 'expire' not in previous:
+                if change_filter[0] == CHANGE_EXACT and 'data' in data and previous.get('data') == data['data']:
+                    return  # touch only, same raw data gives same value
+                previous_value = previous.get('value')
+            else:
+                change_filter = None
         self._lock_acquire()
         r = cluster.update(data)
         if r:
@@ -3070,6 +3982,12 @@ class Device(object):
         self._lock_release()
         if not r:
             return
+        if change_filter and not added:
+            key = (endpoint_id, cluster_id, attribute['attribute'])
+            value = attribute.get('value')
+            if not value_changed(change_filter, self._signaled.get(key, previous_value), value):
+                return  # within deadband
+            self._signaled[key] = value
         changed = self.get_attribute(endpoint_id,
                                      cluster_id,
                                      attribute['attribute'], True)
@@ -3176,6 +4094,7 @@ class Device(object):
             new_value = type(value)()
         attribute['value'] = new_value
         attribute['data'] = new_value
+        self._changed()
         attribute = self.get_attribute(endpoint_id,
                                        cluster_id,
                                        attribute_id,
@@ -3421,6 +4340,7 @@ class Device(object):
 
     def set_assumed_state(self, assumed_state=True):
         self.info['assumed_state'] = assumed_state
+        self._changed()
 
     @property
     def assumed_state(self):
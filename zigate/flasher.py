@@ -11,6 +11,7 @@
 import argparse
 import atexit
 import functools
+import hashlib
 import itertools
 import logging
 import struct
@@ -42,6 +43,11 @@ ZIGATE_CHIP_ID = 0x10408686
 ZIGATE_BINARY_VERSION = bytes.fromhex('07030008')
 ZIGATE_FLASH_START = 0x00000000
 ZIGATE_FLASH_END = 0x00040000
+DEFAULT_CHUNK_SIZE = 128
+# message length is a single byte, (length, type, address, data, checksum)
+FAST_CHUNK_SIZE = 248
+# bootloader baudrate is 1MHz / divisor
+FAST_BAUDRATES = (1000000, 500000, 250000, 115200)
 
 
 class Command:
@@ -245,6 +251,41 @@ def change_baudrate(ser, baudrate):
     ser.baudrate = baudrate
 
 
+def negotiate_baudrate(ser, rates=FAST_BAUDRATES):
+    '''
+    switch to the highest baudrate supported by serial port and bootloader
+    '''
+    current = ser.baudrate
+    for rate in rates:
+        if rate == current:
+            return rate
+        try:
+            ser.baudrate = rate
+        except (ValueError, serial.SerialException):
+            logger.debug('Baudrate %s not supported by serial port', rate)
+            continue
+        finally:
+            ser.baudrate = current
+        ser.write(req_change_baudrate(rate))
+        res = read_response(ser)
+        if not res or not res.ok:
+            logger.debug('Baudrate %s refused by bootloader', rate)
+            continue
+        ser.baudrate = rate
+        ser.write(req_chip_id())
+        res = read_response(ser)
+        if res and res.ok:
+            logger.info('Using baudrate %s', rate)
+            return rate
+        # link not reliable, try to go back
+        logger.debug('Baudrate %s not reliable', rate)
+        ser.write(req_change_baudrate(current))
+        read_response(ser)
+        ser.baudrate = current
+    logger.info('Using baudrate %s', current)
+    return current
+
+
 def check_chip_id(ser):
     ser.write(req_chip_id())
     res = read_response(ser)
@@ -310,7 +351,7 @@ def printProgressBar (iteration, total, prefix = '', suffix = '', decimals = 1,
         print()
 
 
-def write_flash_to_file(ser, filename):
+def write_flash_to_file(ser, filename, chunk_size=DEFAULT_CHUNK_SIZE):
     # flash_start = cur = ZIGATE_FLASH_START
     cur = ZIGATE_FLASH_START
     flash_end = ZIGATE_FLASH_END
@@ -318,25 +359,31 @@ def write_flash_to_file(ser, filename):
     logger.info('Backup firmware to %s', filename)
     with open(filename, 'wb') as fd:
         fd.write(ZIGATE_BINARY_VERSION)
-        read_bytes = 128
+        read_bytes = chunk_size
+        data = None
         while cur < flash_end:
             if cur + read_bytes > flash_end:
                 read_bytes = flash_end - cur
             ser.write(req_flash_read(cur, read_bytes))
+            # write previous chunk while bootloader is reading
+            if data:
+                fd.write(data)
             res = read_response(ser)
             if not res or not res.ok:
                 print('Reading flash failed')
                 raise SystemExit(1)
             if cur == 0:
                 (flash_end,) = struct.unpack('>L', res.data[0x20:0x24])
-            fd.write(res.data)
+            data = res.data
             printProgressBar(cur, flash_end, 'Reading')
             cur += read_bytes
+        if data:
+            fd.write(data)
     printProgressBar(flash_end, flash_end, 'Reading')
     logger.info('Backup firmware done')
 
 
-def write_file_to_flash(ser, filename):
+def write_file_to_flash(ser, filename, chunk_size=DEFAULT_CHUNK_SIZE):
     logger.info('Writing new firmware from %s', filename)
     with open(filename, 'rb') as fd:
         ser.write(req_flash_erase())
@@ -353,22 +400,72 @@ def write_file_to_flash(ser, filename):
         if bin_ver != ZIGATE_BINARY_VERSION:
             print('Not a valid image for Zigate')
             raise SystemExit(1)
-        read_bytes = 128
-        while cur < flash_end:
-            data = fd.read(read_bytes)
-            if not data:
-                break
+        read_bytes = chunk_size
+        data = fd.read(read_bytes)
+        while cur < flash_end and data:
             ser.write(req_flash_write(cur, data))
+            # read next chunk while bootloader is writing
+            next_data = fd.read(read_bytes)
             res = read_response(ser)
-            if not res.ok:
-                print('writing failed at 0x%08x, status: 0x%x, data: %s' % (cur, res.status, data.hex()))
+            if (not res or not res.ok) and read_bytes > DEFAULT_CHUNK_SIZE:
+                logger.info('Chunk size %s refused, fallback to %s', read_bytes, DEFAULT_CHUNK_SIZE)
+                read_bytes = DEFAULT_CHUNK_SIZE
+                fd.seek(len(ZIGATE_BINARY_VERSION) + cur - ZIGATE_FLASH_START)
+                data = fd.read(read_bytes)
+                continue
+            if not res or not res.ok:
+                status = res.status if res else None
+                print('writing failed at 0x%08x, status: %s, data: %s' % (cur, status, data.hex()))
                 raise SystemExit(1)
             printProgressBar(cur, flash_end, 'Writing')
-            cur += read_bytes
+            cur += len(data)
+            data = next_data
     printProgressBar(flash_end, flash_end, 'Writing')
     logger.info('Writing new firmware done')
 
 
+def compare_flash(ser, filename, chunk_size=DEFAULT_CHUNK_SIZE, stop=True):
+    '''
+    Compare flash with firmware file chunk by chunk, only one chunk of each is kept in memory
+    return None if identical else address of the first difference,
+    if stop is False, the whole firmware is read to log both hashes
+    '''
+    logger.info('Comparing firmware with %s', filename)
+    file_hash = hashlib.sha256()
+    flash_hash = hashlib.sha256()
+    mismatch = None
+    with open(filename, 'rb') as fd:
+        bin_ver = fd.read(4)
+        if bin_ver != ZIGATE_BINARY_VERSION:
+            print('Not a valid image for Zigate')
+            raise SystemExit(1)
+        cur = ZIGATE_FLASH_START
+        data = fd.read(chunk_size)
+        while cur < ZIGATE_FLASH_END and data:
+            ser.write(req_flash_read(cur, len(data)))
+            # read next chunk while bootloader is reading
+            next_data = fd.read(chunk_size)
+            res = read_response(ser)
+            if not res or not res.ok:
+                print('Reading flash failed')
+                raise SystemExit(1)
+            file_hash.update(data)
+            flash_hash.update(res.data)
+            if mismatch is None and res.data != data:
+                mismatch = cur
+                if stop:
+                    break
+            cur += len(data)
+            data = next_data
+    if mismatch is None:
+        logger.info('Firmware identical, sha256 %s', file_hash.hexdigest())
+    else:
+        logger.info('Firmware differs at 0x%08x', mismatch)
+        if not stop:
+            logger.info('File sha256 %s, flash sha256 %s', file_hash.hexdigest(), flash_hash.hexdigest())
+    return mismatch
+
+
 def erase_EEPROM(ser, pdm_only=False):
     ser.timeout = 10  # increase timeout because official NXP programmer do it
     ser.write(req_eeprom_erase(pdm_only))
@@ -378,9 +475,14 @@ def erase_EEPROM(ser, pdm_only=False):
         raise SystemExit(1)
 
 
-def flash(serialport='auto', write=None, save=None, erase=False, pdm_only=False):
+def flash(serialport='auto', write=None, save=None, erase=False, pdm_only=False, fast=False,
+          verify=False, compare=False):
     """
     Read or write firmware
+    fast mode uses the highest baudrate and the largest chunk size
+    verify: read back and compare flash after write
+    compare: compare flash with write file first, backup and write only if different
+    return True if firmware was written
     """
     serialport = discover_port(serialport)
     try:
@@ -388,8 +490,17 @@ def flash(serialport='auto', write=None, save=None, erase=False, pdm_only=False)
     except serial.SerialException:
         logger.exception("Could not open serial device %s", serialport)
         return
+    return _flash(ser, write, save, erase, pdm_only, fast, verify, compare)
+
 
-    change_baudrate(ser, 115200)
+def _flash(ser, write=None, save=None, erase=False, pdm_only=False, fast=False, verify=False, compare=False):
+    flashed = False
+    chunk_size = DEFAULT_CHUNK_SIZE
+    if fast:
+        negotiate_baudrate(ser)
+        chunk_size = FAST_CHUNK_SIZE
+    else:
+        change_baudrate(ser, 115200)
     check_chip_id(ser)
     flash_type = get_flash_type(ser)
     mac_address = get_mac(ser)
@@ -397,26 +508,39 @@ def flash(serialport='auto', write=None, save=None, erase=False, pdm_only=False)
     if write or save or erase:
         select_flash(ser, flash_type)
 
+    if write and compare and compare_flash(ser, write, chunk_size) is None:
+        logger.info('Firmware already flashed, nothing to do')
+        write = save = None
+
     if save:
-        write_flash_to_file(ser, save)
+        write_flash_to_file(ser, save, chunk_size)
 
     if write:
-        write_file_to_flash(ser, write)
+        write_file_to_flash(ser, write, chunk_size)
+        flashed = True
+        if verify:
+            mismatch = compare_flash(ser, write, chunk_size)
+            if mismatch is not None:
+                print('Verify failed at 0x%08x' % mismatch)
+                raise SystemExit(1)
+            logger.info('Verify done')
 
     if erase:
         erase_EEPROM(ser, pdm_only)
     change_baudrate(ser, 38400)
     ser.close()
+    return flashed
 
 
-def upgrade_firmware(port):
+def upgrade_firmware(port, fast=False):
     backup_filename = 'zigate_backup_{:%Y%m%d%H%M%S}.bin'.format(datetime.datetime.now())
-    flash(port, save=backup_filename)
-    print('ZiGate backup created {}'.format(backup_filename))
     firmware_path = download_latest()
     print('Firmware downloaded', firmware_path)
-    flash(port, write=firmware_path)
-    print('ZiGate flashed with {}'.format(firmware_path))
+    if flash(port, write=firmware_path, save=backup_filename, fast=fast, verify=True, compare=True):
+        print('ZiGate backup created {}'.format(backup_filename))
+        print('ZiGate flashed with {}'.format(firmware_path))
+    else:
+        print('ZiGate already flashed with {}'.format(firmware_path))
 
 
 def ftdi_set_bitmode(dev, bitmask):
@@ -432,6 +556,120 @@ def ftdi_set_bitmode(dev, bitmask):
     dev.ctrl_transfer(bmRequestType, SIO_SET_BITMODE_REQUEST, wValue)
 
 
+class FakeBootloader(object):
+    '''
+    Simulated JN516x bootloader, serial.Serial stand-in for test without hardware.
+    Transfer time is simulated according to baudrate and accumulated in elapsed,
+    set realtime to actually wait.
+    '''
+    def __init__(self, firmware=b'', max_baudrate=1000000, max_chunk_size=FAST_CHUNK_SIZE,
+                 turnaround=0.001, write_delay=0.0005, realtime=False):
+        self.flash = bytearray(b'\xff' * ZIGATE_FLASH_END)
+        self.flash[:len(firmware)] = firmware
+        self.max_baudrate = max_baudrate
+        self.max_chunk_size = max_chunk_size
+        self.turnaround = turnaround  # usb-serial latency per command
+        self.write_delay = write_delay  # flash write time per command
+        self.realtime = realtime
+        self.timeout = 5
+        self.elapsed = 0.0
+        self.bootloader_baudrate = 38400
+        self._baudrate = 38400
+        self._output = bytearray()
+        self._handlers = {0x07: self._flash_erase,
+                          0x09: self._flash_write,
+                          0x0b: self._flash_read,
+                          0x1f: self._ram_read,
+                          0x25: self._flash_id,
+                          0x27: self._change_baudrate,
+                          0x2c: self._select_flash_type,
+                          0x32: self._chip_id,
+                          0x36: self._eeprom_erase,
+                          }
+
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    @baudrate.setter
+    def baudrate(self, value):
+        if value > self.max_baudrate:
+            raise ValueError('Baudrate {} not supported'.format(value))
+        self._baudrate = value
+
+    def _wait(self, duration):
+        self.elapsed += duration
+        if self.realtime:
+            time.sleep(duration)
+
+    def _transfer(self, length):
+        # 8N1, 10 bits per byte
+        self._wait(length * 10 / self._baudrate)
+
+    def write(self, data):
+        self._transfer(len(data))
+        if abs(self._baudrate - self.bootloader_baudrate) > self.bootloader_baudrate * 0.05:
+            return len(data)  # garbage for bootloader
+        self._wait(self.turnaround)
+        type_ = data[1]
+        payload = bytes(data[2:-1])
+        response_type, response = self._handlers[type_](payload)
+        rate = None
+        if type_ == 0x27 and response[0] == 0:
+            rate = round(1000000 / payload[0])
+        self._output += prepare(response_type, response)
+        if rate:
+            self.bootloader_baudrate = rate
+        return len(data)
+
+    def read(self, size=1):
+        data = bytes(self._output[:size])
+        del self._output[:size]
+        self._transfer(len(data))
+        return data
+
+    def close(self):
+        pass
+
+    def _flash_erase(self, payload):
+        self.flash[:] = b'\xff' * len(self.flash)
+        return 0x08, b'\x00'
+
+    def _flash_write(self, payload):
+        (addr,) = struct.unpack_from('<L', payload)
+        data = payload[4:]
+        if len(data) > self.max_chunk_size:
+            return 0x0a, b'\xff'
+        self._wait(self.write_delay)
+        self.flash[addr:addr + len(data)] = data
+        return 0x0a, b'\x00'
+
+    def _flash_read(self, payload):
+        addr, length = struct.unpack('<LH', payload)
+        return 0x0c, b'\x00' + bytes(self.flash[addr:addr + length])
+
+    def _ram_read(self, payload):
+        return 0x20, b'\x00' + bytes.fromhex('00158d0001020304')
+
+    def _flash_id(self, payload):
+        return 0x26, b'\x00\xcc\xee'
+
+    def _change_baudrate(self, payload):
+        rate = round(1000000 / payload[0])
+        if rate > self.max_baudrate:
+            return 0x28, b'\xff'
+        return 0x28, b'\x00'
+
+    def _select_flash_type(self, payload):
+        return 0x2d, b'\x00'
+
+    def _chip_id(self, payload):
+        return 0x33, b'\x00' + struct.pack('!L', ZIGATE_CHIP_ID)
+
+    def _eeprom_erase(self, payload):
+        return 0x37, b'\x00'
+
+
 def main():
     ports_available = [port for (port, _, _) in sorted(comports())]
     parser = argparse.ArgumentParser()
@@ -443,6 +681,12 @@ def main():
                         action='store_true', default=False)
 #     parser.add_argument('-e', '--erase', help='Erase EEPROM', action='store_true')
 #     parser.add_argument('--pdm-only', help='Erase PDM only, use it with --erase', action='store_true')
+    parser.add_argument('-f', '--fast', help='Use highest baudrate and largest chunk size',
+                        action='store_true', default=False)
+    parser.add_argument('--verify', help='Verify firmware after writing',
+                        action='store_true', default=False)
+    parser.add_argument('-c', '--compare', help='Compare firmware with WRITE file, only backup and write if different',
+                        action='store_true', default=False)
     parser.add_argument('-d', '--debug', help='Set log level to DEBUG', action='store_true')
     parser.add_argument('--gpio', help='Configure GPIO for PiZiGate flash', action='store_true', default=False)
     parser.add_argument('--din', help='Configure USB for ZiGate DIN flash', action='store_true', default=False)
@@ -481,7 +725,7 @@ def main():
         time.sleep(0.5)
 
     if args.upgrade:
-        upgrade_firmware(args.serialport)
+        upgrade_firmware(args.serialport, args.fast)
 
     else:
         try:
@@ -492,19 +736,7 @@ def main():
 
         # atexit.register(change_baudrate, ser, 38400)
 
-        change_baudrate(ser, 115200)
-        check_chip_id(ser)
-        flash_type = get_flash_type(ser)
-        mac_address = get_mac(ser)
-        logger.info('Found MAC-address: %s', mac_address)
-        if args.write or args.save:  # or args.erase:
-            select_flash(ser, flash_type)
-
-        if args.save:
-            write_flash_to_file(ser, args.save)
-
-        if args.write:
-            write_file_to_flash(ser, args.write)
+        _flash(ser, args.write, args.save, fast=args.fast, verify=args.verify, compare=args.compare)
 
 #         if args.erase:
 #             erase_EEPROM(ser, args.pdm_only)
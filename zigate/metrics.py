@@ -0,0 +1,227 @@
+#
+# Copyright (c) 2018 Sébastien RAMAGE
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+'''
+Metrics registry with Prometheus text exposition
+
+Updates are cheap: no lock (an increment could rarely be lost under
+contention, which is acceptable for monitoring) and no formatting,
+labels are kept as raw values and only formatted by render().
+'''
+
+import bisect
+import threading
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_label(value):
+    '''
+    int labels are message or command types, rendered as hex
+    '''
+    if isinstance(value, int):
+        return '0x{:04x}'.format(value)
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name):
+        return [(name, (), self.value)]
+
+
+class Gauge(object):
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set_function(self, function):
+        '''
+        value computed by function when collected
+        '''
+        self.function = function
+
+    def get(self):
+        if self.function:
+            try:
+                return self.function()
+            except Exception:
+                return 0
+        return self.value
+
+    def samples(self, name):
+        return [(name, (), self.get())]
+
+
+class Histogram(object):
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name):
+        samples = []
+        total = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            total += count
+            samples.append((name + '_bucket', (('le', repr(float(bucket))),), total))
+        samples.append((name + '_bucket', (('le', '+Inf'),), self.count))
+        samples.append((name + '_sum', (), self.sum))
+        samples.append((name + '_count', (), self.count))
+        return samples
+
+
+class Metric(object):
+    '''
+    metric family, children by labels values
+    '''
+    TYPES = {'counter': Counter, 'gauge': Gauge, 'histogram': Histogram}
+
+    def __init__(self, name, documentation, metric_type, labelnames=(), **kwargs):
+        self.name = name
+        self.documentation = documentation
+        self.type = metric_type
+        self.labelnames = tuple(labelnames)
+        self._kwargs = kwargs
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._create()
+
+    def _create(self):
+        return self.TYPES[self.type](**self._kwargs)
+
+    def labels(self, *values):
+        '''
+        return child for labels values (no values for metric without labels),
+        keep it to avoid lookup on hot path
+        '''
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._create())
+        return child
+
+    def remove(self, *values):
+        '''
+        remove child for labels values
+        '''
+        with self._lock:
+            self._children.pop(values, None)
+
+    def collect(self):
+        '''
+        return samples list of (name, labels dict, value)
+        '''
+        samples = []
+        for values, child in list(self._children.items()):
+            labels = tuple(zip(self.labelnames, map(format_label, values)))
+            for name, extra, value in child.samples(self.name):
+                samples.append((name, dict(labels + extra), value))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, name, documentation, metric_type, labelnames=(), **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Metric(name, documentation, metric_type, labelnames, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(name, documentation, 'counter', labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(name, documentation, 'gauge', labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(name, documentation, 'histogram', labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def collect(self):
+        '''
+        return dict of metric name to samples list of (name, labels, value)
+        '''
+        return {name: metric.collect() for name, metric in sorted(self._metrics.items())}
+
+    def render(self):
+        '''
+        return metrics in Prometheus text format
+        '''
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append('# HELP {} {}'.format(name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(name, metric.type))
+            for sample_name, labels, value in metric.collect():
+                if labels:
+                    labels = '{' + ','.join('{}="{}"'.format(k, v) for k, v in labels.items()) + '}'
+                else:
+                    labels = ''
+                lines.append('{}{} {}'.format(sample_name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# transport
+FRAMES_IN = REGISTRY.counter('zigate_transport_frames_received_total', 'Frames received from ZiGate').labels()
+BYTES_IN = REGISTRY.counter('zigate_transport_bytes_received_total', 'Bytes received from ZiGate').labels()
+FRAMES_OUT = REGISTRY.counter('zigate_transport_frames_sent_total', 'Frames sent to ZiGate').labels()
+BYTES_OUT = REGISTRY.counter('zigate_transport_bytes_sent_total', 'Bytes sent to ZiGate').labels()
+MALFORMED = REGISTRY.counter('zigate_transport_malformed_packets_total', 'Malformed packets received').labels()
+RECONNECTS = REGISTRY.counter('zigate_transport_reconnects_total', 'Reconnections to ZiGate').labels()
+SEND_QUEUE = REGISTRY.gauge('zigate_transport_send_queue_depth', 'Frames waiting to be sent', ('instance',))
+RECEIVED_QUEUE = REGISTRY.gauge('zigate_transport_received_queue_depth', 'Frames waiting to be decoded',
+                                ('instance',))
+# decode
+DECODE_ERRORS = REGISTRY.counter('zigate_decode_errors_total', 'Packets not decoded', ('reason',))
+DECODE_LATENCY = REGISTRY.histogram('zigate_decode_seconds', 'Decode and interpretation time', ('msg_type',))
+# commands
+COMMAND_LATENCY = REGISTRY.histogram('zigate_command_round_trip_seconds', 'Command to status time', ('cmd',))
+COMMAND_TIMEOUTS = REGISTRY.counter('zigate_command_timeouts_total', 'Commands without status', ('cmd',))
+NO_RESPONSE = REGISTRY.gauge('zigate_command_no_response_count', 'Consecutive commands without status',
+                             ('instance',))
+# devices
+DEVICE_MESSAGES = REGISTRY.counter('zigate_device_messages_total', 'Messages received from device', ('addr',))
+DEVICE_LQI = REGISTRY.gauge('zigate_device_lqi', 'Last LQI of device messages', ('addr',))
+# asynchronous bus subscribers
+SUBSCRIBER_QUEUE = REGISTRY.gauge('zigate_subscriber_queue_depth', 'Signals waiting for subscriber',
+                                  ('subscriber',))
+SUBSCRIBER_DELIVERED = REGISTRY.counter('zigate_subscriber_delivered_total', 'Signals delivered to subscriber',
+                                        ('subscriber',))
+SUBSCRIBER_DROPPED = REGISTRY.counter('zigate_subscriber_dropped_total', 'Signals not delivered to subscriber',
+                                      ('subscriber', 'reason'))
+SUBSCRIBER_LAG = REGISTRY.histogram('zigate_subscriber_lag_seconds', 'Time from dispatch to subscriber delivery',
+                                    ('subscriber',))
@@ -7,6 +7,9 @@
 
 from pydispatch import dispatcher
 import logging
+import threading
+import time
+import queue
 from .const import (ZIGATE_ATTRIBUTE_ADDED, ZIGATE_ATTRIBUTE_UPDATED,
                     ZIGATE_DEVICE_ADDED, ZIGATE_DEVICE_REMOVED,
                     ZIGATE_DEVICE_UPDATED)
@@ -14,18 +17,38 @@ from .core import DeviceEncoder
 import paho.mqtt.client as mqtt
 import json
 
+# window in seconds used to coalesce updates of the same topic
+PUBLISH_INTERVAL = 0.1
+COMMAND_WORKERS = 4
+COMMAND_QUEUE_SIZE = 100  # per worker
+RESULT_TOPIC = 'zigate/command/result'
+
 
 class MQTT_Broker(object):
     def __init__(self, zigate, mqtt_host='localhost:1883',
-                 username=None, password=None):
+                 username=None, password=None, publish_interval=PUBLISH_INTERVAL,
+                 workers=COMMAND_WORKERS, max_queue=COMMAND_QUEUE_SIZE):
         self._mqtt_host = mqtt_host
         self.zigate = zigate
+        self._publish_interval = publish_interval
+        self._lock = threading.Lock()
+        self._pending = {}  # topic to payload waiting for publish
+        self._dirty_devices = {}  # addr to device waiting for delta publish
+        self._device_attributes = {}  # addr to changed attributes since last delta
+        self._device_state = {}  # addr to last published device state
+        self._retained = {}  # topic to last published retained payload
+        self._flush_event = threading.Event()
+        self._publisher = None
+        self._workers = []
+        # commands are sharded by client (response topic), one queue per worker,
+        # so commands of a client are executed in order
+        self._commands = [queue.Queue(max_queue) for i in range(workers)]
         self.client = mqtt.Client()
         if username is not None:
             self.client.username_pw_set(username, password)
         dispatcher.connect(self.attribute_changed, ZIGATE_ATTRIBUTE_ADDED)
         dispatcher.connect(self.attribute_changed, ZIGATE_ATTRIBUTE_UPDATED)
-        dispatcher.connect(self.device_changed, ZIGATE_DEVICE_ADDED)
+        dispatcher.connect(self.device_added, ZIGATE_DEVICE_ADDED)
         dispatcher.connect(self.device_changed, ZIGATE_DEVICE_UPDATED)
         dispatcher.connect(self.device_removed, ZIGATE_DEVICE_REMOVED)
         self.client.on_connect = self.on_connect
@@ -38,6 +61,8 @@ class MQTT_Broker(object):
             host, port = host.split(':')
         port = int(port)
         self.client.connect(host, port)
+        self.start_publisher()
+        self.start_workers()
 
     def start(self):
         self.connect()
@@ -45,54 +70,257 @@ class MQTT_Broker(object):
         self.zigate.start_auto_save()
         self.client.loop_forever()
 
-    def _publish(self, topic, payload=None):
-        if payload:
+    def start_publisher(self):
+        if self._publisher is None:
+            self._publisher = threading.Thread(target=self._publisher_loop,
+                                               name='MQTT-Publisher', daemon=True)
+            self._publisher.start()
+
+    def start_workers(self):
+        while len(self._workers) < len(self._commands):
+            commands = self._commands[len(self._workers)]
+            t = threading.Thread(target=self._worker_loop, args=(commands,),
+                                 name='MQTT-Command-{}'.format(len(self._workers)), daemon=True)
+            self._workers.append(t)
+            t.start()
+
+    def _worker_loop(self, commands):
+        while True:
+            command = commands.get()
+            try:
+                self.execute_command(command)
+            except Exception:
+                logging.exception('Failed to execute command')
+            finally:
+                self._publish_queue_depth()
+                commands.task_done()
+
+    def join_commands(self):
+        '''
+        wait until all queued commands are executed
+        '''
+        for commands in self._commands:
+            commands.join()
+
+    def _command_queue(self, command):
+        client = command.get('response_topic') or RESULT_TOPIC
+        return self._commands[hash(client) % len(self._commands)]
+
+    def _publish_queue_depth(self):
+        self._queue('zigate/command/queue', {'depth': sum(commands.qsize() for commands in self._commands),
+                                             'max': self._commands[0].maxsize,
+                                             'workers': len(self._workers)})
+
+    def _publisher_loop(self):
+        while True:
+            self._flush_event.wait()
+            time.sleep(self._publish_interval)  # let updates coalesce
+            self._flush_event.clear()
+            try:
+                self.flush()
+            except Exception:
+                logging.exception('Failed to publish')
+
+    def _publish(self, topic, payload=None, retain=True, dedupe=True):
+        '''
+        publish payload, unchanged retained payload is not published again if dedupe
+        '''
+        if payload is not None:
             payload = json.dumps(payload, cls=DeviceEncoder)
+        if retain and dedupe:
+            # suppress re-publish of unchanged retained value
+            with self._lock:
+                unchanged = topic in self._retained and self._retained[topic] == payload
+                self._retained[topic] = payload
+            if unchanged:
+                logging.debug('Unchanged {}'.format(topic))
+                return
         logging.info('Publish {}'.format(topic))
-        self.client.publish(topic, payload, retain=True)
+        self.client.publish(topic, payload, retain=retain)
+
+    def _queue(self, topic, payload):
+        '''
+        queue payload, replacing previous payload of the same topic not yet published
+        '''
+        with self._lock:
+            self._pending[topic] = payload
+        self._flush_event.set()
+
+    def flush(self):
+        '''
+        publish queued payloads and device deltas
+        '''
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            devices, self._dirty_devices = self._dirty_devices, {}
+        for topic, payload in pending.items():
+            self._publish(topic, payload)
+        for addr, device in devices.items():
+            delta = self._device_delta(device)
+            if delta:
+                self._publish('zigate/device_changed/{}'.format(addr), delta, retain=False)
+
+    def _device_state_of(self, device):
+        return {'info': dict(device.info),
+                'generictype': device.genericType,
+                'discovery': device.discovery,
+                'name': device.name}
+
+    def _device_delta(self, device):
+        '''
+        return changes since last published state of device
+        '''
+        addr = device.addr
+        state = self._device_state_of(device)
+        with self._lock:
+            previous = self._device_state.get(addr, {})
+            self._device_state[addr] = state
+            attributes = self._device_attributes.pop(addr, {})
+        delta = {}
+        previous_info = previous.get('info', {})
+        info = {k: v for k, v in state['info'].items() if k not in previous_info or previous_info[k] != v}
+        if info:
+            delta['info'] = info
+        for k in ('generictype', 'discovery', 'name'):
+            if k not in previous or previous[k] != state[k]:
+                delta[k] = state[k]
+        if attributes:
+            delta['attributes'] = list(attributes.values())
+        if delta:
+            delta['addr'] = addr
+        return delta
+
+    def publish_snapshot(self, addr=None):
+        '''
+        publish full device (or all devices if addr is None) on zigate/device_snapshot/<addr>
+        '''
+        if addr:
+            devices = [self.zigate.get_device_from_addr(addr)]
+        else:
+            devices = self.zigate.devices
+        for device in devices:
+            if not device:
+                continue
+            with self._lock:
+                self._device_state[device.addr] = self._device_state_of(device)
+                self._device_attributes.pop(device.addr, None)
+            self._publish('zigate/device_snapshot/{}'.format(device.addr), device, retain=False)
 
     def device_changed(self, device):
         logging.debug('device_changed {}'.format(device))
-        self._publish('zigate/device_changed/{}'.format(device.addr), device)
+        with self._lock:
+            self._dirty_devices[device.addr] = device
+        self._flush_event.set()
+
+    def device_added(self, device):
+        logging.debug('device_added {}'.format(device))
+        self.publish_snapshot(device.addr)
 
     def device_removed(self, addr):
         logging.debug('device_removed {}'.format(addr))
-        self._publish('zigate/device_removed', addr)
+        with self._lock:
+            self._dirty_devices.pop(addr, None)
+            self._device_attributes.pop(addr, None)
+            self._device_state.pop(addr, None)
+        self._publish('zigate/device_removed', addr, dedupe=False)
 
-    def attribute_changed(self, attribute):
+    def attribute_changed(self, attribute, device=None):
         logging.debug('attribute_changed {}'.format(attribute))
-        self._publish('zigate/attribute_changed/{0[addr]}/'
-                      '{0[endpoint]:02x}/{0[cluster]:04x}/'
-                      '{0[attribute]:04x}'.format(attribute), attribute)
+        topic = ('zigate/attribute_changed/{0[addr]}/'
+                 '{0[endpoint]:02x}/{0[cluster]:04x}/'
+                 '{0[attribute]:04x}'.format(attribute))
+        if device:
+            key = (attribute['endpoint'], attribute['cluster'], attribute['attribute'])
+            with self._lock:
+                self._device_attributes.setdefault(device.addr, {})[key] = attribute
+        if 'expire' in attribute:
+            # event like attribute (click, etc), every occurence is published
+            self._publish(topic, attribute, retain=False)
+        else:
+            self._queue(topic, attribute)
 
     def on_connect(self, client, userdata, flags, rc):
         logging.info("MQTT connected with result code {}".format(rc))
+        # broker may have lost retained messages, publish them again
+        with self._lock:
+            self._retained.clear()
         client.subscribe("zigate/command/#")
 
     def on_message(self, client, userdata, msg):
         payload = {}
-        if msg.payload:
-            payload = json.loads(msg.payload.decode())
-        if msg.topic == 'zigate/command':
-            func_name = payload.get('function')
-            args = payload.get('args', [])
-            if hasattr(self.zigate, func_name):
-                func = getattr(self.zigate, func_name)
-                if callable(func):
-                    try:
-                        result = func(*args)
-                    except Exception:
-                        result = None
-                        logging.error('Error calling function {}'.format(func_name))
-                else:
-                    result = func
-                if result:
-                    self._publish('zigate/command/result',
-                                  {'function': func_name,
-                                   'result': result
-                                   })
-            else:
-                logging.error('ZiGate has no function named {}'.format(func_name))
+        try:
+            if msg.payload:
+                payload = json.loads(msg.payload.decode())
+            if msg.topic == 'zigate/command' and not isinstance(payload, dict):
+                raise TypeError('command must be an object')
+        except (ValueError, TypeError) as e:
+            logging.error('Invalid payload on {}: {}'.format(msg.topic, e))
+            if msg.topic == 'zigate/command':
+                self._publish_result(payload if isinstance(payload, dict) else {},
+                                     error='invalid command: {}'.format(e))
+            return
+        if msg.topic == 'zigate/command/snapshot':
+            addr = payload.get('addr') if isinstance(payload, dict) else payload
+            self.publish_snapshot(addr)
+        elif msg.topic == 'zigate/command':
+            self.submit_command(payload)
+
+    def submit_command(self, command):
+        '''
+        queue command for asynchronous execution,
+        command is a dict with function, optional args, id (correlation id)
+        and response_topic (default zigate/command/result),
+        commands with the same response_topic are executed in order
+        '''
+        try:
+            self._command_queue(command).put_nowait(command)
+        except queue.Full:
+            logging.error('Command queue full, drop command {}'.format(command.get('function')))
+            self._publish_result(command, error='queue full')
+            return False
+        self._publish_queue_depth()
+        return True
+
+    def execute_command(self, command):
+        func_name = command.get('function')
+        args = command.get('args', [])
+        if not hasattr(self.zigate, func_name or ''):
+            logging.error('ZiGate has no function named {}'.format(func_name))
+            self._publish_result(command, error='unknown function')
+            return
+        func = getattr(self.zigate, func_name)
+        if callable(func):
+            try:
+                result = func(*args)
+            except Exception as e:
+                logging.error('Error calling function {}'.format(func_name))
+                self._publish_result(command, error=str(e))
+                return
+        else:
+            result = func
+        self._publish_result(command, result)
+
+    def _publish_result(self, command, result=None, error=None):
+        '''
+        publish result on response_topic, only non empty results
+        are published for command without correlation id
+        '''
+        correlation_id = command.get('id')
+        if correlation_id is None and not result and not error:
+            return
+        payload = {'function': command.get('function'),
+                   'result': result
+                   }
+        if correlation_id is not None:
+            payload['id'] = correlation_id
+        if error:
+            payload['error'] = error
+        topic = command.get('response_topic') or RESULT_TOPIC
+        try:
+            self._publish(topic, payload, dedupe=False)
+        except TypeError:  # not serializable result
+            payload['result'] = str(result)
+            self._publish(topic, payload, dedupe=False)
 
 
 if __name__ == '__main__':
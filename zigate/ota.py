@@ -0,0 +1,334 @@
+#
+# Copyright (c) 2018 Sébastien RAMAGE
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+
+import logging
+import mmap
+import struct
+import datetime
+import os
+import threading
+from time import monotonic
+
+
+LOGGER = logging.getLogger('zigate')
+
+OTA_HEADER = struct.Struct('<LHHHHHLH32sLBQHH')
+# 0x0502 image block response header, followed by data
+OTA_BLOCK_HEADER = struct.Struct('!BHBBBBLLHHB')
+# upper bounds in seconds of request latency histogram
+OTA_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+# seconds without block request after which a session is considered abandoned
+OTA_SESSION_TIMEOUT = 300
+# seconds before directory is scanned again for an image not found
+OTA_MISS_TTL = 60
+OTA_HEADER_FIELDS = ['file_id', 'header_version', 'header_length', 'header_fctl', 'manufacturer_code', 'image_type',
+                     'image_version', 'stack_version', 'header_str', 'size', 'security_cred_version',
+                     'upgrade_file_dest', 'min_hw_version', 'max_hw_version']
+
+
+class OTAImageError(Exception):
+    pass
+
+
+def parse_header(data):
+    '''
+    parse OTA header at the beginning of data
+    '''
+    # Ensure that file has 69 bytes so it can contain header
+    if len(data) < OTA_HEADER.size:
+        raise OTAImageError('OTA file is too short')
+    header_data = list(OTA_HEADER.unpack_from(data))
+    # replace null characters from header str to spaces
+    header_data[8] = header_data[8].replace(b'\x00', b' ')
+    return dict(zip(OTA_HEADER_FIELDS, header_data))
+
+
+def signature_offset(data):
+    '''
+    return (header_end, footer_pos) if image is signed else None
+    '''
+    if data[:4] == b'NGIS':
+        return (struct.unpack_from('<I', data, 0x10)[0],
+                struct.unpack_from('<I', data, 0x18)[0])
+
+
+class OTAImage(object):
+    '''
+    OTA image memory-mapped from file,
+    data is a read-only memoryview shared by all sessions
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise OTAImageError('OTA file is too short')
+        self._view = memoryview(self._mmap)
+        self.data = self._view
+        self.last_used = monotonic()
+        signature = signature_offset(self._view)
+        if signature:
+            LOGGER.debug('Signed file, removing signature')
+            self.data = self._view[signature[0]:signature[1]]
+        try:
+            self.header = parse_header(self.data)
+        except OTAImageError:
+            self.close()
+            raise
+        # Check that size from header corresponds to file size
+        if self.header['size'] != len(self.data):
+            size = len(self.data)
+            self.close()
+            raise OTAImageError('Header size({header}) and file size({file}) does not match'.format(
+                header=self.header['size'], file=size))
+
+    @property
+    def key(self):
+        return (self.header['manufacturer_code'], self.header['image_type'], self.header['image_version'])
+
+    @property
+    def size(self):
+        return self.header['size']
+
+    def header_payload(self):
+        '''
+        header as expected by 0x0500 load image command
+        '''
+        header = self.header
+        return struct.pack('!lHHHHHLH32sLBQHH', *[header[k] for k in OTA_HEADER_FIELDS])
+
+    def block(self, offset, max_data_size):
+        '''
+        return memoryview of the requested block, no copy
+        '''
+        return self.data[offset:offset + max_data_size]
+
+    def close(self):
+        if self.data is not self._view:
+            self.data.release()
+        self._view.release()
+        self._mmap.close()
+
+    def __repr__(self):
+        return 'OTAImage(0x{:04x}, 0x{:04x}, 0x{:08x}, {})'.format(self.header['manufacturer_code'],
+                                                                   self.header['image_type'],
+                                                                   self.header['image_version'],
+                                                                   self.path)
+
+
+class OTASession(object):
+    '''
+    OTA transfer of an image to a device
+    '''
+    def __init__(self, addr, image):
+        self.addr = addr
+        self.image = image
+        self.starttime = datetime.datetime.now()
+        self.transfered = 0
+        self.blocks = 0
+        self.bytes = 0
+        self.retransmits = 0
+        self.host_time = 0.0  # time spent building and sending responses
+        self.paced_time = 0.0  # time waiting because of block_delay
+        self.radio_time = 0.0  # time between response sent and next request
+        self.latency = [0] * (len(OTA_LATENCY_BUCKETS) + 1)
+        self.last_response = None
+        self._offsets = set()
+        self._start = monotonic()
+        self.last_activity = self._start
+
+    def expired(self, now, timeout=OTA_SESSION_TIMEOUT):
+        return now - self.last_activity > timeout
+
+    @property
+    def key(self):
+        return (self.addr,) + self.image.key[:2]
+
+    def pack_block(self, request, source_endpoint=0x01, status=0x00, max_data_size=None):
+        '''
+        build 0x0502 payload for block request,
+        data are copied once from the memory-mapped image
+        status 0x00 is success, using value 0x01 would make client to request data again later
+        '''
+        self.last_activity = self.image.last_used = monotonic()
+        offset = request['file_offset']
+        size = request['max_data_size']
+        if max_data_size:
+            size = min(size, max_data_size)
+        block = self.image.block(offset, size)
+        data_size = len(block)
+        buf = bytearray(OTA_BLOCK_HEADER.size + data_size)
+        OTA_BLOCK_HEADER.pack_into(buf, 0, request['address_mode'], int(self.addr, 16),
+                                   source_endpoint, request['endpoint'], request['sequence'], status,
+                                   offset, self.image.header['image_version'],
+                                   self.image.header['image_type'],
+                                   self.image.header['manufacturer_code'],
+                                   data_size)
+        buf[OTA_BLOCK_HEADER.size:] = block
+        block.release()
+        self.transfered = offset + data_size
+        if offset in self._offsets:
+            self.retransmits += 1
+        else:
+            self._offsets.add(offset)
+        return buf
+
+    def record(self, received, start, sent, size):
+        '''
+        record block response metrics
+        received is the monotonic time of the request, start when response building started
+        (after pacing) and sent after the response was sent
+        '''
+        if self.last_response is not None:
+            latency = max(received - self.last_response, 0)
+            self.radio_time += latency
+            bucket = len(OTA_LATENCY_BUCKETS)
+            for i, bound in enumerate(OTA_LATENCY_BUCKETS):
+                if latency <= bound:
+                    bucket = i
+                    break
+            self.latency[bucket] += 1
+        self.paced_time += start - received
+        self.host_time += sent - start
+        self.blocks += 1
+        self.bytes += size
+        self.last_response = sent
+
+    def metrics(self):
+        duration = max(monotonic() - self._start, 1e-6)
+        histogram = {'<={}'.format(bound): count for bound, count in zip(OTA_LATENCY_BUCKETS, self.latency)}
+        histogram['>{}'.format(OTA_LATENCY_BUCKETS[-1])] = self.latency[-1]
+        return {'blocks': self.blocks,
+                'bytes': self.bytes,
+                'retransmits': self.retransmits,
+                'blocks_per_second': self.blocks / duration,
+                'bytes_per_second': self.bytes / duration,
+                'host_time': self.host_time,
+                'radio_time': self.radio_time,
+                'paced_time': self.paced_time,
+                'latency_histogram': histogram,
+                }
+
+    def status(self):
+        image_size = self.image.size
+        time_passed = (datetime.datetime.now() - self.starttime).total_seconds()
+        try:
+            time_remaining = (image_size / self.transfered) * time_passed - time_passed
+        except ZeroDivisionError:
+            time_remaining = -1
+        return {'addr': self.addr,
+                'manufacturer_code': self.image.header['manufacturer_code'],
+                'image_type': self.image.header['image_type'],
+                'image_version': self.image.header['image_version'],
+                'transfered': self.transfered,
+                'size': image_size,
+                'progress': self.transfered / image_size,
+                'elapsed': time_passed,
+                'remaining': time_remaining,
+                'metrics': self.metrics()
+                }
+
+
+class OTARepository(object):
+    '''
+    Index of OTA images in a directory (like ~/ota filled by ikea_ota_download)
+    headers are parsed once and cached by file mtime
+    '''
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._cache = {}  # path to (mtime, header)
+        self._index = {}  # (manufacturer_code, image_type) to {image_version: path}
+        self._misses = {}  # (manufacturer_code, image_type, image_version) to monotonic time of last miss
+        self.miss_ttl = OTA_MISS_TTL
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        '''
+        scan directory, only new or modified files are parsed
+        '''
+        cache = {}
+        index = {}
+        try:
+            entries = [entry for entry in os.scandir(self.path) if entry.is_file()]
+        except OSError as err:
+            LOGGER.error('{path}: {error}'.format(path=self.path, error=err))
+            entries = []
+        for entry in entries:
+            mtime = entry.stat().st_mtime
+            cached = self._cache.get(entry.path)
+            if cached and cached[0] == mtime:
+                header = cached[1]
+            else:
+                header = self._read_header(entry.path)
+            cache[entry.path] = (mtime, header)
+            if header is None:
+                continue
+            index.setdefault((header['manufacturer_code'], header['image_type']), {})[header['image_version']] = \
+                entry.path
+        with self._lock:
+            self._cache = cache
+            self._index = index
+            self._misses = {}
+
+    def _read_header(self, path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read(0x1C)
+                signature = signature_offset(data)
+                if signature:
+                    f.seek(signature[0])
+                    data = f.read(OTA_HEADER.size)
+                else:
+                    data += f.read(OTA_HEADER.size - len(data))
+                header = parse_header(data)
+        except (OSError, OTAImageError, struct.error) as err:
+            LOGGER.debug('Ignoring {path}: {error}'.format(path=path, error=err))
+            return None
+        return header
+
+    def get(self, manufacturer_code, image_type, image_version=None):
+        '''
+        return path of image, latest version if image_version is None
+        directory is scanned again if image is not found,
+        at most once per miss_ttl seconds for the same image
+        '''
+        key = (manufacturer_code, image_type, image_version)
+        for retry in (False, True):
+            if retry:
+                missed = self._misses.get(key)
+                if missed is not None and monotonic() - missed < self.miss_ttl:
+                    return None
+                self.refresh()
+            versions = self._index.get((manufacturer_code, image_type))
+            if versions:
+                if image_version is None:
+                    return versions[max(versions)]
+                if image_version in versions:
+                    return versions[image_version]
+        with self._lock:
+            self._misses[key] = monotonic()
+        return None
+
+    def latest(self):
+        '''
+        return dict of (manufacturer_code, image_type) to latest image_version
+        '''
+        return {key: max(versions) for key, versions in self._index.items()}
+
+    def images(self):
+        '''
+        return list of indexed images headers with path
+        '''
+        images = []
+        for path, (mtime, header) in sorted(self._cache.items()):
+            if header:
+                image = header.copy()
+                image['header_str'] = image['header_str'].decode(errors='ignore').strip()
+                image['path'] = path
+                images.append(image)
+        return images
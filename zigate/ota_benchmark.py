@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2018 Sébastien RAMAGE
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+"""
+OTA benchmark with simulated clients on FakeTransport
+
+python3 -m zigate.ota_benchmark --devices 10 --size 20000
+"""
+
+import argparse
+import json
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+from .core import FakeZiGate
+from .ota import OTA_HEADER, OTA_BLOCK_HEADER
+
+MANUFACTURER_CODE = 0x117c
+IMAGE_TYPE = 0x2101
+IMAGE_VERSION = 0x00010000
+
+
+def create_image(path, size):
+    header = OTA_HEADER.pack(0x0BEEF11E, 0x0100, OTA_HEADER.size, 0, MANUFACTURER_CODE, IMAGE_TYPE,
+                             IMAGE_VERSION, 2, b'benchmark', size, 0, 0, 0, 0)
+    with open(path, 'wb') as f:
+        f.write(header + os.urandom(size - len(header)))
+
+
+class SimulatedClients(object):
+    '''
+    answer 0x0502 block responses with next 0x8501 block request,
+    after latency seconds, losing requests with loss probability
+    '''
+    def __init__(self, zigate, size, max_data_size=64, latency=0.02, loss=0.0):
+        self.zigate = zigate
+        self.connection = zigate.connection
+        self.size = size
+        self.max_data_size = max_data_size
+        self.latency = latency
+        self.loss = loss
+        self.done = set()
+        self.addrs = set()
+        self.finished = threading.Event()
+        self._send = self.connection.send
+        self.connection.send = self.send
+
+    def request(self, addr, offset):
+        if random.random() < self.loss:  # lost block, device asks again
+            offset = max(offset - self.max_data_size, 0)
+        msg_data = struct.pack('!BBHBHQLLHHHBB', 1, 1, 0x0019, 2, addr, addr, offset,
+                               IMAGE_VERSION, IMAGE_TYPE, MANUFACTURER_CODE, 0, self.max_data_size, 0)
+        self.put(0x8501, msg_data)
+
+    def end(self, addr):
+        msg_data = struct.pack('!BBHBHLHHB', 1, 1, 0x0019, 2, addr, IMAGE_VERSION, IMAGE_TYPE, MANUFACTURER_CODE, 0)
+        self.put(0x8503, msg_data)
+        self.done.add(addr)
+        if self.done == self.addrs:
+            self.finished.set()
+
+    def put(self, msg, msg_data):
+        self.connection.put_received(self.connection.create_fake_response(msg, msg_data))
+
+    def later(self, func, *args):
+        if self.latency:
+            t = threading.Timer(self.latency, func, args)
+            t.daemon = True
+            t.start()
+        else:
+            func(*args)
+
+    def send(self, data):
+        self._send(data)
+        data = self.connection.zigate_decode(data[1:-1])
+        cmd = struct.unpack('!H', data[:2])[0]
+        if cmd != 0x0502:
+            return
+        payload = data[5:]
+        header = OTA_BLOCK_HEADER.unpack_from(payload)
+        addr = header[1]
+        offset = header[6] + header[10]
+        if offset >= self.size:
+            self.later(self.end, addr)
+        else:
+            self.later(self.request, addr, offset)
+
+    def start(self, devices):
+        for addr in range(1, devices + 1):
+            self.addrs.add(addr)
+            self.request(addr, 0)
+
+
+def run(devices=10, size=20000, max_data_size=64, latency=0.02, loss=0.0,
+        block_delay=0, zigate_max_data_size=None, timeout=600):
+    '''
+    upgrade devices simulated clients in parallel and return duration and sessions metrics
+    '''
+    zigate = FakeZiGate(auto_start=False)
+    zigate._start_event_thread()
+    zigate.setup_connection()
+    zigate.ota_configure(block_delay, zigate_max_data_size or 0)
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'benchmark.ota')
+    try:
+        create_image(path, size)
+        zigate.ota_load_image(path)
+        clients = SimulatedClients(zigate, size, max_data_size, latency, loss)
+        start = time.monotonic()
+        clients.start(devices)
+        finished = clients.finished.wait(timeout)
+        duration = time.monotonic() - start
+        metrics = zigate.ota_metrics()
+    finally:
+        zigate.close()
+        for image in zigate._ota_images.values():
+            image.close()
+        os.remove(path)
+        os.rmdir(tmp)
+    return {'finished': finished,
+            'devices': devices,
+            'size': size,
+            'duration': duration,
+            'bytes_per_second': devices * size / duration,
+            'sessions': metrics['completed'] + metrics['active']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ZiGate OTA benchmark with simulated clients')
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--size', type=int, default=20000, help='image size')
+    parser.add_argument('--max_data_size', type=int, default=64, help='block size requested by clients')
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated radio latency in seconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability of block request retransmit')
+    parser.add_argument('--block_delay', type=float, default=0, help='OTA server pacing in seconds')
+    parser.add_argument('--zigate_max_data_size', type=int, default=0, help='OTA server maximum block size')
+    parser.add_argument('--json', action='store_true', help='print full result as json')
+    args = parser.parse_args()
+    result = run(args.devices, args.size, args.max_data_size, args.latency, args.loss,
+                 args.block_delay, args.zigate_max_data_size)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print('{devices} devices, {size} bytes image: {duration:.2f}s, {bytes_per_second:.0f} bytes/s'.format(**result))
+    for session in result['sessions']:
+        metrics = session['metrics']
+        print('{addr}: {blocks} blocks, {blocks_per_second:.1f} blocks/s, {retransmits} retransmits, '
+              'host {host_time:.3f}s, radio {radio_time:.3f}s'.format(addr=session['addr'], **metrics))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,7 @@ import struct
 import logging
 from collections import OrderedDict
 from binascii import hexlify
-from .const import DATA_TYPE
+from .const import DATA_TYPE, ANALOG_DATA_TYPE
 
 LOGGER = logging.getLogger('zigate')
 
@@ -28,12 +28,14 @@ class Response(object):
     format = {'addr': '{:04x}',
               'ieee': '{:016x}',
               'group': '{:04x}'}
+    trace = None  # tracing.Trace of sampled frame
 
     def __init__(self, msg_data, lqi):
-        self.msg_data = msg_data
+        self.msg_data = msg_data  # bytes or memoryview of the frame
         self.lqi = lqi
         self.data = OrderedDict()
         self.decode()
+        self._materialize()
 
     def __str__(self):
         d = ['{}:{}'.format(k, v) for k, v in self.data.items()]
@@ -73,8 +75,9 @@ class Response(object):
 
     def decode(self):
         fmt = '!'
-        msg_data = self.msg_data
+        msg_data = memoryview(self.msg_data)
         keys = list(self.s.keys())
+        rawend = None
         for k, v in self.s.items():
             if isinstance(v, OrderedDict):
                 keys.remove(k)
@@ -83,21 +86,24 @@ class Response(object):
                 if rest == 0:
                     continue
                 subfmt = '!' + ''.join(v.values())
-                count = rest // struct.calcsize(subfmt)
+                size = struct.calcsize(subfmt)
+                count = rest // size
                 submsg_data = msg_data[-rest:]
                 msg_data = msg_data[:-rest]
-                for i in range(count):
-                    sdata, submsg_data = self._decode(subfmt,
-                                                      v.keys(),
-                                                      submsg_data)
-                    self.data[k].append(sdata)
+                if count > 0:
+                    subkeys = list(v.keys())
+                    self.data[k] = [OrderedDict(zip(subkeys, values))
+                                    for values in struct.iter_unpack(subfmt, submsg_data[:count * size])]
             elif v == 'rawend':
-                fmt += '{}s'.format(len(msg_data) - struct.calcsize(fmt))
+                keys.remove(k)
+                rawend = k
             else:
                 fmt += v
         sdata, msg_data = self._decode(fmt, keys, msg_data)
         self.data.update(sdata)
-        if msg_data:
+        if rawend:
+            self.data[rawend] = msg_data
+        elif msg_data:
             self.data['additional'] = msg_data
 
         # reformat output, TODO: do it live
@@ -106,10 +112,18 @@ class Response(object):
 
     def _decode(self, fmt, keys, data):
         size = struct.calcsize(fmt)
-        sdata = OrderedDict(zip(keys, struct.unpack(fmt, data[:size])))
+        sdata = OrderedDict(zip(keys, struct.unpack_from(fmt, data)))
         data = data[size:]
         return sdata, data
 
+    def _materialize(self):
+        '''
+        convert raw memoryview left in data to bytes
+        '''
+        for k, v in self.data.items():
+            if v.__class__ is memoryview:
+                self.data[k] = v.tobytes()
+
     def _format(self, data, keys=[]):
         keys = keys or data.keys()
         for k in keys:
@@ -1132,6 +1146,62 @@ class R8120(Response):
         Response.decode(self)
 
 
+def decode_reportable_change(data_type, data):
+    '''
+    decode reportable change according to attribute data type
+    '''
+    if data_type == 0x38:  # semi float, struct 'e' format requires python 3.6
+        half = struct.unpack('!H', data)[0]
+        exponent = (half >> 10) & 0x1f
+        mantissa = half & 0x3ff
+        if exponent == 0:
+            value = mantissa * 2 ** -24
+        elif exponent == 31:
+            value = float('inf')
+        else:
+            value = (mantissa + 1024) * 2 ** (exponent - 25)
+        return -value if half & 0x8000 else value
+    if data_type == 0x39:
+        return struct.unpack('!f', data)[0]
+    if data_type == 0x3a:
+        return struct.unpack('!d', data)[0]
+    return int.from_bytes(data, 'big', signed=0x28 <= data_type <= 0x2f)
+
+
+@register_response
+class R8122(Response):
+    msg = 0x8122
+    type = 'Read Reporting Configuration response'
+    s = OrderedDict([('sequence', 'B'),
+                     ('addr', 'H'),
+                     ('endpoint', 'B'),
+                     ('cluster', 'H'),
+                     ('status', 'B'),
+                     ('data_type', 'B'),
+                     ('attribute', 'H'),
+                     ('min_interval', 'H'),
+                     ('max_interval', 'H'),
+                     ])
+
+    def decode(self):
+        if len(self.msg_data) < 14:  # status error, no configuration
+            self.s = self.s.copy()
+            del self.s['data_type']
+            del self.s['attribute']
+            del self.s['min_interval']
+            del self.s['max_interval']
+        Response.decode(self)
+        # reportable change of analog attribute, if provided by firmware
+        size = ANALOG_DATA_TYPE.get(self.data.get('data_type'))
+        additional = self.data.get('additional')
+        if size and additional is not None and len(additional) >= size:
+            self.data['change'] = decode_reportable_change(self.data['data_type'], additional[:size])
+            if len(additional) > size:
+                self.data['additional'] = additional[size:]
+            else:
+                del self.data['additional']
+
+
 @register_response
 class R8140(Response):
     msg = 0x8140
@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2018 Sébastien RAMAGE
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+"""
+Simulated Zigbee network on FakeTransport, for load testing
+
+Virtual devices answer device list, discovery, read attribute, attribute
+discovery, bind and configure reporting requests, and emit attribute
+reports at a configurable rate, with bursts, rejoin storms, radio latency
+and packet loss.
+
+python3 -m zigate.simulator --devices 500 --duration 30 --rate 0.2
+"""
+
+import argparse
+import bisect
+import heapq
+import itertools
+import json
+import random
+import struct
+import threading
+import time
+from .const import DATA_TYPE, ZIGATE_RESPONSE_RECEIVED
+from .core import FakeZiGate, dispatcher, encode_reportable_change
+from .transport import FakeTransport
+
+BASE_ADDR = 0x1000
+BASE_IEEE = 0x00158d0001000000
+STRING_TYPES = (0x41, 0x42, 0x43, 0x44)
+# device profiles, endpoints are (profile, device, in clusters, out clusters),
+# attributes are (endpoint, cluster, attribute) to data type,
+# reports are attributes reported periodically
+PROFILES = {'xiaomi_ht': {'type': 'lumi.sensor_ht', 'manufacturer': 'LUMI', 'manufacturer_code': 0x1037,
+                          'mac_capability': 0x80, 'power_type': 0,
+                          'endpoints': {1: (0x0104, 0x5f01, [0x0000, 0x0003, 0x0402, 0x0405, 0xffff], [0x0000])},
+                          'attributes': {(1, 0x0402, 0x0000): 0x29,
+                                         (1, 0x0405, 0x0000): 0x21,
+                                         (1, 0x0000, 0xff01): 0x42},
+                          'reports': [(1, 0x0402, 0x0000), (1, 0x0402, 0x0000),
+                                      (1, 0x0405, 0x0000), (1, 0x0405, 0x0000),
+                                      (1, 0x0000, 0xff01)]},
+            'xiaomi_magnet': {'type': 'lumi.sensor_magnet.aq2', 'manufacturer': 'LUMI', 'manufacturer_code': 0x1037,
+                              'mac_capability': 0x80, 'power_type': 0,
+                              'endpoints': {1: (0x0104, 0x5f01, [0x0000, 0x0003, 0x0006, 0xffff], [0x0000])},
+                              'attributes': {(1, 0x0006, 0x0000): 0x10,
+                                             (1, 0x0000, 0xff01): 0x42},
+                              'reports': [(1, 0x0006, 0x0000), (1, 0x0006, 0x0000), (1, 0x0000, 0xff01)]},
+            'bulb': {'type': 'TRADFRI bulb E27 W opal 1000lm', 'manufacturer': 'IKEA of Sweden',
+                     'manufacturer_code': 0x117c, 'mac_capability': 0x8e, 'power_type': 1,
+                     'endpoints': {1: (0x0104, 0x0100, [0x0000, 0x0003, 0x0004, 0x0005, 0x0006, 0x0008, 0x1000],
+                                       [0x0005, 0x0019, 0x0020, 0x1000])},
+                     'attributes': {(1, 0x0006, 0x0000): 0x10,
+                                    (1, 0x0008, 0x0000): 0x20},
+                     'reports': [(1, 0x0006, 0x0000), (1, 0x0008, 0x0000)]},
+            'plug': {'type': 'lumi.plug', 'manufacturer': 'LUMI', 'manufacturer_code': 0x1037,
+                     'mac_capability': 0x8e, 'power_type': 1,
+                     'endpoints': {1: (0x0104, 0x0051, [0x0000, 0x0004, 0x0003, 0x0006, 0x0010, 0x0005, 0x000a],
+                                       [0x0019, 0x000a]),
+                                   2: (0x0104, 0x0009, [0x000c], [0x000c, 0x0004])},
+                     'attributes': {(1, 0x0006, 0x0000): 0x10,
+                                    (2, 0x000c, 0x0055): 0x39},
+                     'reports': [(1, 0x0006, 0x0000), (2, 0x000c, 0x0055), (2, 0x000c, 0x0055)]},
+            'meter': {'type': 'SmartMeter', 'manufacturer': 'Develco', 'manufacturer_code': 0x1015,
+                      'mac_capability': 0x8e, 'power_type': 1,
+                      'endpoints': {2: (0x0104, 0x0053, [0x0000, 0x0003, 0x0702], [0x0019])},
+                      'attributes': {(2, 0x0702, 0x0000): 0x25},
+                      'reports': [(2, 0x0702, 0x0000)]},
+            }
+DEFAULT_MIX = {'xiaomi_ht': 0.4, 'xiaomi_magnet': 0.2, 'bulb': 0.2, 'plug': 0.15, 'meter': 0.05}
+# initial value and next value function by (cluster, attribute)
+VALUES = {(0x0006, 0x0000): (False, lambda v: not v),
+          (0x0008, 0x0000): (254, lambda v: random.randint(0, 254)),
+          (0x000c, 0x0055): (0.0, lambda v: round(random.random() * 2000, 1)),
+          (0x0402, 0x0000): (2000, lambda v: max(-2000, min(6000, v + random.randint(-20, 20)))),
+          (0x0405, 0x0000): (5000, lambda v: max(0, min(10000, v + random.randint(-50, 50)))),
+          (0x0702, 0x0000): (0, lambda v: v + random.randint(0, 50)),
+          }
+
+
+def encode_value(data_type, value):
+    if data_type in STRING_TYPES:
+        return value.encode() if isinstance(value, str) else value
+    if data_type == 0x25:  # uint48
+        return value.to_bytes(6, 'big')
+    return struct.pack('!' + DATA_TYPE[data_type], value)
+
+
+class VirtualDevice(object):
+    def __init__(self, addr, ieee, profile_name):
+        self.addr = addr
+        self.ieee = ieee
+        self.profile_name = profile_name
+        self.profile = PROFILES[profile_name]
+        self.sequence = random.randint(0, 255)
+        self.lqi = random.randint(60, 255)
+        self.binds = set()  # (endpoint, cluster)
+        self.reporting = set()  # (endpoint, cluster, attribute)
+        self.values = {}
+        for endpoint_id, (profile, device, in_clusters, out_clusters) in self.profile['endpoints'].items():
+            self.values[(endpoint_id, 0x0000, 0x0004)] = (0x42, self.profile['manufacturer'])
+            self.values[(endpoint_id, 0x0000, 0x0005)] = (0x42, self.profile['type'])
+            self.values[(endpoint_id, 0x0000, 0x0007)] = (0x30, self.profile['power_type'] and 1 or 3)
+        for key, data_type in self.profile['attributes'].items():
+            self.values[key] = (data_type, VALUES.get(key[1:], (0, None))[0])
+
+    def next_sequence(self):
+        self.sequence = (self.sequence + 1) % 256
+        return self.sequence
+
+    def xiaomi_heartbeat(self):
+        '''
+        xiaomi 0xff01 attribute: battery voltage and main values,
+        0x05 high byte is never valid utf-8 so ZiGate reports it as hex
+        '''
+        data = struct.pack('<BBHBBH', 0x01, 0x21, random.randint(2800, 3100), 0x05, 0x21, 0xff00 + random.randint(0, 255))
+        if (1, 0x0402, 0x0000) in self.values:
+            data += struct.pack('<BBh', 0x64, 0x29, self.values[(1, 0x0402, 0x0000)][1])
+            data += struct.pack('<BBH', 0x65, 0x21, self.values[(1, 0x0405, 0x0000)][1])
+        elif (1, 0x0006, 0x0000) in self.values:
+            data += struct.pack('<BB?', 0x64, 0x10, self.values[(1, 0x0006, 0x0000)][1])
+        return data
+
+    def read(self, key):
+        '''
+        return (data type, raw value) of attribute, None if unsupported
+        '''
+        if key == (1, 0x0000, 0xff01):
+            return 0x42, self.xiaomi_heartbeat()
+        if key not in self.values:
+            return
+        data_type, value = self.values[key]
+        return data_type, encode_value(data_type, value)
+
+    def change(self, key):
+        data_type, value = self.values[key]
+        function = VALUES.get(key[1:], (0, None))[1]
+        if function:
+            self.values[key] = (data_type, function(value))
+
+    def attribute_frame(self, msg, key, status=0):
+        endpoint_id, cluster_id, attribute_id = key
+        r = self.read(key)
+        if r is None:
+            return struct.pack('!BHBHHBBH', self.next_sequence(), self.addr, endpoint_id, cluster_id,
+                               attribute_id, 0x86, 0, 0)
+        data_type, raw = r
+        return struct.pack('!BHBHHBBH', self.next_sequence(), self.addr, endpoint_id, cluster_id,
+                           attribute_id, status, data_type, len(raw)) + raw
+
+    def node_descriptor(self, sequence):
+        logical_type = 2 if self.profile['mac_capability'] == 0x80 else 1
+        return struct.pack('!BBHHHHHBBBH', sequence, 0, self.addr, self.profile['manufacturer_code'],
+                           80, 80, 0, 0, self.profile['mac_capability'], 80, logical_type)
+
+    def active_endpoints(self, sequence):
+        endpoints = sorted(self.profile['endpoints'])
+        return struct.pack('!BBHB{}B'.format(len(endpoints)), sequence, 0, self.addr, len(endpoints), *endpoints)
+
+    def simple_descriptor(self, sequence, endpoint_id):
+        if endpoint_id not in self.profile['endpoints']:
+            return struct.pack('!BBHB', sequence, 0x83, self.addr, 0)
+        profile, device, in_clusters, out_clusters = self.profile['endpoints'][endpoint_id]
+        clusters = struct.pack('!B{}H'.format(len(in_clusters)), len(in_clusters), *in_clusters) + \
+            struct.pack('!B{}H'.format(len(out_clusters)), len(out_clusters), *out_clusters)
+        return struct.pack('!BBHBBHHB', sequence, 0, self.addr, 8 + len(clusters), endpoint_id,
+                           profile, device, 0) + clusters
+
+    def announce(self):
+        return struct.pack('!HQB?', self.addr, self.ieee, self.profile['mac_capability'], True)
+
+
+class SimulatedNetwork(FakeTransport):
+    '''
+    FakeTransport answering for virtual devices
+    mix: dict of profile name to proportion of devices
+    rate: reports per second per device
+    latency: maximum radio latency in seconds of device frames
+    loss: probability a device frame is lost
+    seed: seed of devices mix, reports scheduling and loss
+    '''
+    def __init__(self, devices=10, mix=None, rate=0.0, latency=0.0, loss=0.0, seed=None):
+        FakeTransport.__init__(self)
+        self.auto_responder.pop((0x0015, None), None)
+        self.random = random.Random(seed)
+        self.rate = rate
+        self.latency = latency
+        self.loss = loss
+        self.devices = {}  # addr to VirtualDevice
+        self._by_ieee = {}
+        self.emitted = 0
+        self.lost = 0
+        self.report_times = {}  # (addr, sequence) to monotonic time of reports
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._running = True
+        self._next_addr = BASE_ADDR + 1
+        mix = mix or DEFAULT_MIX
+        names = sorted(mix)
+        # cumulative weights draw, random.choices requires python 3.6
+        cumulative = list(itertools.accumulate(mix[name] for name in names))
+        for i in range(devices):
+            self.add_device(names[bisect.bisect(cumulative, self.random.random() * cumulative[-1])])
+        self.handlers = {0x0015: self.device_list,
+                         0x0030: self.bind,
+                         0x0042: self.node_descriptor_request,
+                         0x0043: self.simple_descriptor_request,
+                         0x0045: self.active_endpoint_request,
+                         0x0100: self.read_attribute_request,
+                         0x0120: self.reporting_request,
+                         0x0140: self.attribute_discovery_request,
+                         }
+        self.thread = threading.Thread(target=self._loop, name='ZiGate-Simulator')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add_device(self, profile_name):
+        with self._condition:
+            addr = self._next_addr
+            self._next_addr += 1
+            device = VirtualDevice(addr, BASE_IEEE + addr, profile_name)
+            self.devices[addr] = device
+            self._by_ieee[device.ieee] = device
+        return device
+
+    def close(self):
+        self._running = False
+        with self._condition:
+            self._condition.notify()
+
+    # scheduling
+
+    def schedule(self, delay, func, *args):
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), func, args))
+            self._condition.notify()
+
+    def _loop(self):
+        while self._running:
+            with self._condition:
+                if not self._heap:
+                    self._condition.wait(0.1)
+                    continue
+                due = self._heap[0][0] - time.monotonic()
+                if due > 0:
+                    self._condition.wait(due)
+                    continue
+                _, _, func, args = heapq.heappop(self._heap)
+            func(*args)
+
+    def emit(self, device, msg, payload, report=False):
+        '''
+        send device frame to ZiGate after radio latency, unless lost
+        '''
+        if self.loss and self.random.random() < self.loss:
+            self.lost += 1
+            return
+        delay = self.random.random() * self.latency if self.latency else 0
+        if delay:
+            self.schedule(delay, self._put, device, msg, payload, report)
+        else:
+            self._put(device, msg, payload, report)
+
+    def _put(self, device, msg, payload, report):
+        if report:
+            self.report_times[('{:04x}'.format(device.addr), payload[0])] = time.monotonic()
+        self.emitted += 1
+        self.put_received(self.create_fake_response(msg, payload, device.lqi))
+
+    # reports
+
+    def start_reports(self, rate=None):
+        '''
+        each device reports rate times per second on average
+        '''
+        if rate is not None:
+            self.rate = rate
+        if not self.rate:
+            return
+        for device in list(self.devices.values()):
+            self.schedule(self.random.expovariate(self.rate), self._periodic_report, device)
+
+    def stop_reports(self):
+        self.rate = 0
+
+    def _periodic_report(self, device):
+        if not self.rate or device.addr not in self.devices:
+            return
+        self.report(device)
+        self.schedule(self.random.expovariate(self.rate), self._periodic_report, device)
+
+    def report(self, device, key=None):
+        key = key or self.random.choice(device.profile['reports'])
+        device.change(key)
+        self.emit(device, 0x8102, device.attribute_frame(0x8102, key), True)
+
+    def burst(self, count, spread=0.0):
+        '''
+        count reports from random devices over spread seconds
+        '''
+        devices = list(self.devices.values())
+        for i in range(count):
+            device = self.random.choice(devices)
+            if spread:
+                self.schedule(self.random.random() * spread, self.report, device)
+            else:
+                self.report(device)
+
+    def rejoin_storm(self, fraction=1.0, spread=1.0, new_addr=False):
+        '''
+        fraction of devices announce themselves again over spread seconds,
+        with a new short address if new_addr
+        '''
+        devices = list(self.devices.values())
+        devices = self.random.sample(devices, int(len(devices) * fraction))
+        for device in devices:
+            if new_addr:
+                # devices are iterated by the sending thread
+                with self._condition:
+                    del self.devices[device.addr]
+                    device.addr = self._next_addr
+                    self._next_addr += 1
+                    self.devices[device.addr] = device
+            self.schedule(self.random.random() * spread, self.emit, device, 0x004D, device.announce())
+        return len(devices)
+
+    # requests
+
+    def send(self, data):
+        FakeTransport.send(self, data)
+        decoded = self.zigate_decode(data[1:-1])
+        cmd = struct.unpack('!H', decoded[0:2])[0]
+        handler = self.handlers.get(cmd)
+        if handler:
+            handler(bytes(decoded[5:]))
+
+    def _device_from_request(self, data, offset=0):
+        '''
+        return (device, next offset) from address mode and address
+        '''
+        addr_mode = data[offset]
+        if addr_mode == 3:
+            device = self._by_ieee.get(struct.unpack_from('!Q', data, offset + 1)[0])
+            return device, offset + 9
+        return self.devices.get(struct.unpack_from('!H', data, offset + 1)[0]), offset + 3
+
+    def device_list(self, data):
+        with self._condition:
+            devices = list(self.devices.values())
+        payload = b''.join(struct.pack('!BHQBB', i % 256, device.addr, device.ieee,
+                                       device.profile['power_type'], device.lqi)
+                           for i, device in enumerate(devices))
+        self.put_received(self.create_fake_response(0x8015, payload))
+
+    def node_descriptor_request(self, data):
+        device = self.devices.get(struct.unpack('!H', data[:2])[0])
+        if device:
+            self.emit(device, 0x8042, device.node_descriptor(self.sequence))
+
+    def active_endpoint_request(self, data):
+        device = self.devices.get(struct.unpack('!H', data[:2])[0])
+        if device:
+            self.emit(device, 0x8045, device.active_endpoints(self.sequence))
+
+    def simple_descriptor_request(self, data):
+        addr, endpoint_id = struct.unpack('!HB', data[:3])
+        device = self.devices.get(addr)
+        if device:
+            self.emit(device, 0x8043, device.simple_descriptor(self.sequence, endpoint_id))
+
+    def read_attribute_request(self, data):
+        device, offset = self._device_from_request(data)
+        if not device:
+            return
+        src_endpoint, endpoint_id, cluster_id, direction, manufacturer_specific, manufacturer_code, count = \
+            struct.unpack_from('!BBHBBHB', data, offset)
+        attributes = struct.unpack_from('!{}H'.format(count), data, offset + 9)
+        for attribute_id in attributes:
+            self.emit(device, 0x8100, device.attribute_frame(0x8100, (endpoint_id, cluster_id, attribute_id)))
+
+    def attribute_discovery_request(self, data):
+        device, offset = self._device_from_request(data)
+        if not device:
+            return
+        endpoint_id, cluster_id = struct.unpack_from('!BH', data, offset + 1)
+        keys = [key for key in sorted(device.values) if key[:2] == (endpoint_id, cluster_id)]
+        for i, key in enumerate(keys):
+            complete = 1 if i == len(keys) - 1 else 0
+            self.emit(device, 0x8140, struct.pack('!BBHHBH', complete, device.values[key][0], key[2],
+                                                  device.addr, endpoint_id, cluster_id))
+
+    def bind(self, data):
+        ieee, endpoint_id, cluster_id = struct.unpack('!QBH', data[:11])
+        device = self._by_ieee.get(ieee)
+        if not device:
+            return
+        status = 0 if cluster_id in device.profile['endpoints'].get(endpoint_id, (0, 0, [], []))[2] else 0x84
+        if status == 0:
+            device.binds.add((endpoint_id, cluster_id))
+        self.emit(device, 0x8030, struct.pack('!BBBH', self.sequence, status, 2, device.addr))
+
+    def reporting_request(self, data):
+        device, offset = self._device_from_request(data)
+        if not device:
+            return
+        src_endpoint, endpoint_id, cluster_id, direction, manufacturer_specific, manufacturer_code, count = \
+            struct.unpack_from('!BBHBBHB', data, offset)
+        offset += 9
+        attribute_id = struct.unpack_from('!BBH', data, offset)[2] if count else 0
+        for i in range(count):
+            attribute_direction, data_type, report_attribute = struct.unpack_from('!BBH', data, offset)
+            device.reporting.add((endpoint_id, cluster_id, report_attribute))
+            offset += 10 + len(encode_reportable_change(data_type, 0))
+        self.emit(device, 0x8120, struct.pack('!BHBHHB', self.sequence, device.addr, endpoint_id,
+                                              cluster_id, attribute_id, 0))
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(devices=100, duration=10, rate=0.2, mix=None, latency=0.0, loss=0.0,
+        bursts=0, burst_size=100, rejoin=0.0, discovery_timeout=60, seed=None):
+    '''
+    join devices simulated devices to a FakeZiGate, then emit reports for duration seconds
+    and return throughput and latency of report processing,
+    loss only applies to reporting since discovery doesn't retry
+    '''
+    zigate = FakeZiGate(auto_start=False, path=None)
+    network = SimulatedNetwork(devices, mix, 0, latency, 0, seed)
+    zigate.connection = network
+    zigate._devices.clear()
+    zigate._start_event_thread()
+    latencies = []
+
+    def received(response, **kwargs):
+        if response.msg == 0x8102:
+            sent = network.report_times.pop((response.get('addr'), response.get('sequence')), None)
+            if sent is not None:
+                latencies.append(time.monotonic() - sent)
+    dispatcher.connect(received, ZIGATE_RESPONSE_RECEIVED, sender=zigate)
+    try:
+        start = time.monotonic()
+        zigate.get_devices_list(True)
+        while time.monotonic() - start < discovery_timeout:
+            if len([d for d in zigate.devices if d.discovery]) >= devices:
+                break
+            time.sleep(0.1)
+        discovery = time.monotonic() - start
+        discovered = len([d for d in zigate.devices if d.discovery])
+        emitted = network.emitted
+        network.loss = loss
+        network.start_reports(rate)
+        start = time.monotonic()
+        for i in range(bursts):
+            network.schedule(duration * (i + 1) / (bursts + 1), network.burst, burst_size)
+        if rejoin:
+            network.schedule(duration / 2, network.rejoin_storm, rejoin, min(duration / 4, 5))
+        time.sleep(duration)
+        network.stop_reports()
+        # drain
+        drain = time.monotonic()
+        while network.received.qsize() and time.monotonic() - drain < 30:
+            time.sleep(0.05)
+        time.sleep(0.2)
+        elapsed = time.monotonic() - start
+    finally:
+        dispatcher.disconnect(received, ZIGATE_RESPONSE_RECEIVED, sender=zigate)
+        network.close()
+        zigate.close()
+    reports = len(latencies)
+    return {'devices': devices,
+            'discovered': discovered,
+            'discovery_duration': discovery,
+            'duration': elapsed,
+            'frames_emitted': network.emitted - emitted,
+            'frames_lost': network.lost,
+            'reports_processed': reports,
+            'reports_per_second': reports / elapsed,
+            'latency_p50': percentile(latencies, 0.5),
+            'latency_p95': percentile(latencies, 0.95),
+            'latency_p99': percentile(latencies, 0.99),
+            'latency_max': max(latencies) if latencies else 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ZiGate load test with simulated Zigbee network')
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10, help='reporting duration in seconds')
+    parser.add_argument('--rate', type=float, default=0.2, help='reports per second per device')
+    parser.add_argument('--mix', help='profiles proportions as json, default {}'.format(json.dumps(DEFAULT_MIX)))
+    parser.add_argument('--latency', type=float, default=0.0, help='maximum radio latency in seconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability a device frame is lost')
+    parser.add_argument('--bursts', type=int, default=0, help='number of report bursts')
+    parser.add_argument('--burst_size', type=int, default=100, help='reports per burst')
+    parser.add_argument('--rejoin', type=float, default=0.0, help='fraction of devices rejoining during test')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', action='store_true', help='print full result as json')
+    args = parser.parse_args()
+    result = run(args.devices, args.duration, args.rate, json.loads(args.mix) if args.mix else None,
+                 args.latency, args.loss, args.bursts, args.burst_size, args.rejoin, seed=args.seed)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print('{discovered}/{devices} devices discovered in {discovery_duration:.2f}s'.format(**result))
+    print('{reports_processed} reports in {duration:.2f}s: {reports_per_second:.1f} reports/s, '
+          '{frames_lost} frames lost'.format(**result))
+    print('latency p50 {:.2f}ms p95 {:.2f}ms p99 {:.2f}ms max {:.2f}ms'.format(
+        *[result[k] * 1000 for k in ('latency_p50', 'latency_p95', 'latency_p99', 'latency_max')]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+#
+# Copyright (c) 2018 Sébastien RAMAGE
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+#
+'''
+Pipeline latency tracing
+
+A sampled inbound frame carries a Trace of monotonic timestamps, from its
+extraction in the transport to the signals dispatched while interpreting it.
+A sampled command is traced from send_data to its status and response.
+Finished traces are kept in a bounded buffer and exported in Chrome
+trace-event format (chrome://tracing, Perfetto).
+
+When tracing is disabled, frames are plain bytes and the only cost is a
+flag test.
+'''
+
+import collections
+import json
+import os
+import threading
+from time import monotonic
+
+MAX_TRACES = 1000
+
+# inbound stages
+READ = 'read'  # frame extracted from transport buffer
+DEQUEUE = 'dequeue'  # frame taken from received queue by event loop
+DECODE = 'decode'  # decode thread started
+DECODED = 'decoded'  # Response built
+INTERPRET = 'interpret'
+SET_ATTRIBUTE = 'set_attribute'
+DISPATCH = 'dispatch'  # signal dispatch started
+DISPATCHED = 'dispatched'  # all receivers called
+# outbound stages
+SEND = 'send'
+TRANSPORT = 'transport'  # frame queued in transport
+WRITE = 'write'  # frame written to serial port or socket
+STATUS = 'status'  # 0x8000 status interpreted
+RESPONSE = 'response'  # expected response decoded
+# common
+ERROR = 'error'
+DONE = 'done'
+
+
+class Frame(bytes):
+    '''
+    raw frame carrying its trace
+    '''
+    trace = None
+
+
+class Trace(object):
+    __slots__ = ('id', 'kind', 'msg_type', 'marks', 'thread')
+
+    def __init__(self, trace_id, kind, msg_type=None):
+        self.id = trace_id
+        self.kind = kind
+        self.msg_type = msg_type
+        self.marks = []  # list of (stage, monotonic time, detail)
+        self.thread = threading.current_thread().name
+
+    @property
+    def name(self):
+        if self.msg_type is None:
+            return self.kind
+        return '{} 0x{:04x}'.format(self.kind, self.msg_type)
+
+    @property
+    def duration(self):
+        if not self.marks:
+            return 0
+        return self.marks[-1][1] - self.marks[0][1]
+
+    def mark(self, stage, detail=None, timestamp=None):
+        self.marks.append((stage, timestamp or monotonic(), detail))
+
+    def stages(self):
+        '''
+        return list of (stage, detail, seconds since previous stage)
+        '''
+        stages = []
+        previous = None
+        for stage, timestamp, detail in self.marks:
+            stages.append((stage, detail, timestamp - previous if previous is not None else 0))
+            previous = timestamp
+        return stages
+
+    def to_json(self):
+        return {'id': self.id,
+                'name': self.name,
+                'duration': self.duration,
+                'stages': self.stages()}
+
+    def to_events(self, pid=0):
+        '''
+        return Chrome trace events: a complete event for the whole trace
+        and one per interval between two stages, on its own row
+        '''
+        if not self.marks:
+            return []
+        start = self.marks[0][1]
+        events = [{'name': self.name, 'cat': self.kind, 'ph': 'X', 'pid': pid, 'tid': self.id,
+                   'ts': start * 1e6, 'dur': self.duration * 1e6,
+                   'args': {'thread': self.thread}}]
+        previous = self.marks[0]
+        for mark in self.marks[1:]:
+            name = mark[0] if mark[2] is None else '{} {}'.format(mark[0], mark[2])
+            events.append({'name': name, 'cat': self.kind, 'ph': 'X', 'pid': pid, 'tid': self.id,
+                           'ts': previous[1] * 1e6, 'dur': (mark[1] - previous[1]) * 1e6,
+                           'args': {'from': previous[0]}})
+            previous = mark
+        return events
+
+
+class Tracer(object):
+    def __init__(self):
+        self.enabled = False
+        self.sample_every = 1
+        self._count = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.traces = collections.deque(maxlen=MAX_TRACES)
+
+    def start(self, sample_every=1, max_traces=MAX_TRACES):
+        '''
+        trace one frame or command out of sample_every,
+        keep the max_traces last finished traces
+        '''
+        self.sample_every = max(int(sample_every), 1)
+        if max_traces != self.traces.maxlen:
+            self.traces = collections.deque(self.traces, maxlen=max_traces)
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def clear(self):
+        self.traces.clear()
+
+    def sample(self, kind, msg_type=None):
+        '''
+        return a new Trace if this one is sampled, None otherwise
+        '''
+        if not self.enabled:
+            return
+        with self._lock:
+            self._count += 1
+            if self._count % self.sample_every:
+                return
+            self._next_id += 1
+            trace_id = self._next_id
+        return Trace(trace_id, kind, msg_type)
+
+    def finish(self, trace):
+        trace.mark(DONE)
+        self.traces.append(trace)
+
+    def activate(self, trace):
+        '''
+        set trace of current thread, return previous one
+        '''
+        previous = getattr(self._local, 'trace', None)
+        self._local.trace = trace
+        return previous
+
+    def current(self):
+        return getattr(self._local, 'trace', None)
+
+    def mark(self, stage, detail=None):
+        '''
+        mark stage on trace of current thread, if any
+        '''
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace.mark(stage, detail)
+
+    def collect(self):
+        return [trace.to_json() for trace in list(self.traces)]
+
+    def export(self, path=None):
+        '''
+        return finished traces in Chrome trace-event format,
+        also written to path if given
+        '''
+        events = []
+        pid = os.getpid()
+        for trace in list(self.traces):
+            events.extend(trace.to_events(pid))
+        data = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if path:
+            with open(os.path.expanduser(path), 'w') as fp:
+                json.dump(data, fp)
+        return data
+
+
+TRACER = Tracer()
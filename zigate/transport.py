@@ -16,6 +16,9 @@ import select
 from pydispatch import dispatcher
 import sys
 from .const import ZIGATE_FAILED_TO_CONNECT
+from . import metrics
+from . import tracing
+from . import capture
 import struct
 from binascii import unhexlify, hexlify
 
@@ -36,28 +39,70 @@ class BaseTransport(object):
         self._buffer = b''
         self.queue = queue.Queue()
         self.received = queue.Queue()
+        self._capture = None
 
     def read_data(self, data):
         '''
         Read ZiGate output and split messages
         '''
-        LOGGER.debug('Raw packet received, {}'.format(data))
-        self._buffer += data
-#         print(self._buffer)
-        endpos = self._buffer.find(b'\x03')
+        LOGGER.debug('Raw packet received, %s', data)
+        metrics.BYTES_IN.inc(len(data))
+        buffer = self._buffer + data
+        # only slice out frames, buffer is trimmed once at the end
+        start = 0
+        endpos = buffer.find(b'\x03')
         while endpos != -1:
-            startpos = self._buffer.rfind(b'\x01', 0, endpos)
-            if startpos != -1 and startpos < endpos:
-                raw_message = self._buffer[startpos:endpos + 1]
-                self.received.put(raw_message)
+            startpos = buffer.rfind(b'\x01', start, endpos)
+            if startpos != -1:
+                metrics.FRAMES_IN.inc()
+                self.put_received(buffer[startpos:endpos + 1])
             else:
+                metrics.MALFORMED.inc()
                 LOGGER.error('Malformed packet received, ignore it')
-            self._buffer = self._buffer[endpos + 1:]
-            endpos = self._buffer.find(b'\x03')
+            start = endpos + 1
+            endpos = buffer.find(b'\x03', start)
+        self._buffer = buffer[start:] if start else buffer
+
+    def put_received(self, raw_message):
+        '''
+        queue raw message for decoding, start its trace if sampled
+        '''
+        if tracing.TRACER.enabled:
+            trace = tracing.TRACER.sample('frame')
+            if trace:
+                trace.mark(tracing.READ)
+                raw_message = tracing.Frame(raw_message)
+                raw_message.trace = trace
+        if self._capture:
+            self._capture.write(capture.IN, raw_message)
+        self.received.put(raw_message)
 
     def send(self, data):
+        metrics.FRAMES_OUT.inc()
+        metrics.BYTES_OUT.inc(len(data))
+        if self._capture:
+            self._capture.write(capture.OUT, data)
         self.queue.put(data)
 
+    def start_capture(self, path, max_bytes=capture.MAX_BYTES, backup_count=capture.BACKUP_COUNT):
+        '''
+        capture raw inbound and outbound frames to rotating file path
+        '''
+        self.stop_capture()
+        self._capture = capture.CaptureWriter(path, max_bytes, backup_count)
+        return self._capture
+
+    def stop_capture(self):
+        writer = self._capture
+        self._capture = None
+        if writer:
+            writer.close()
+
+    def _write_done(self, data):
+        trace = getattr(data, 'trace', None)
+        if trace:
+            trace.mark(tracing.WRITE)
+
     def is_connected(self):
         pass
 
@@ -81,6 +126,7 @@ class FakeTransport(BaseTransport):
     def __init__(self):
         BaseTransport.__init__(self)
         self.sent = []
+        self.sequence = 0
         self.auto_responder = {}
         self.add_auto_response(0x0010, 0x8010, unhexlify(b'000f3ff0'))
         self.add_auto_response(0x0009, 0x8009, unhexlify(b'00000123456789abcdef12340123456789abcdef0b'))
@@ -95,7 +141,7 @@ class FakeTransport(BaseTransport):
                 temp = int(round(random.random() * 40.0, 2) * 100)
                 msg = struct.pack('!BHBHHBBHI', 1, int('abcd', 16), 1, 0x0402, 0, 0, 0x22, 4, temp)
                 enc_msg = self.create_fake_response(0x8102, msg, random.randint(0, 255))
-                self.received.put(enc_msg)
+                self.put_received(enc_msg)
         t = threading.Thread(target=periodic_response)
         t.setDaemon(True)
         t.start()
@@ -104,29 +150,35 @@ class FakeTransport(BaseTransport):
         return True
 
     def send(self, data):
+        metrics.FRAMES_OUT.inc()
+        metrics.BYTES_OUT.inc(len(data))
+        if self._capture:
+            self._capture.write(capture.OUT, data)
         self.sent.append(data)
+        self._write_done(data)
         # retrieve cmd
         data = self.zigate_decode(data[1:-1])
         cmd = struct.unpack('!H', data[0:2])[0]
         # reply 0x8000 ok for cmd
         lqi = 255
-        value = struct.pack('!BBHB', 0, 1, cmd, lqi)
+        self.sequence = (self.sequence + 1) % 256
+        value = struct.pack('!BBHB', 0, self.sequence, cmd, lqi)
         length = len(value)
         checksum = self.checksum(struct.pack('!H', 0x8000),
-                                 struct.pack('!B', length),
+                                 struct.pack('!H', length),
                                  value)
         raw_message = struct.pack('!HHB{}s'.format(len(value)), 0x8000, length, checksum, value)
         enc_msg = self.zigate_encode(raw_message)
         enc_msg.insert(0, 0x01)
         enc_msg.append(0x03)
         enc_msg = bytes(enc_msg)
-        self.received.put(enc_msg)
+        self.put_received(enc_msg)
 
         data = hexlify(data[5:])
         if (cmd, data) in self.auto_responder:
-            self.received.put(self.auto_responder[(cmd, data)])
+            self.put_received(self.auto_responder[(cmd, data)])
         elif (cmd, None) in self.auto_responder:
-            self.received.put(self.auto_responder[(cmd, None)])
+            self.put_received(self.auto_responder[(cmd, None)])
 
     def add_auto_response(self, cmd, resp, value, lqi=255):
         enc_msg = self.create_fake_response(resp, value, lqi)
@@ -138,7 +190,7 @@ class FakeTransport(BaseTransport):
         value += struct.pack('!B', lqi)
         length = len(value)
         checksum = self.checksum(struct.pack('!H', resp),
-                                 struct.pack('!B', length),
+                                 struct.pack('!H', length),
                                  value)
         raw_message = struct.pack('!HHB{}s'.format(len(value)), resp, length, checksum, value)
         enc_msg = self.zigate_encode(raw_message)
@@ -167,16 +219,16 @@ class FakeTransport(BaseTransport):
         return encoded
 
     def zigate_decode(self, data):
-        flip = False
-        decoded = bytearray()
-        for b in data:
-            if flip:
-                flip = False
-                decoded.append(b ^ 0x10)
-            elif b == 0x02:
-                flip = True
-            else:
-                decoded.append(b)
+        '''
+        unescape data, byte following 0x02 is xored with 0x10,
+        work is done per escape instead of per byte
+        '''
+        chunks = bytes(data).split(b'\x02')
+        decoded = bytearray(chunks[0])
+        for chunk in chunks[1:]:
+            if chunk:  # escape never follows escape in valid frame
+                decoded.append(chunk[0] ^ 0x10)
+                decoded += chunk[1:]
         return decoded
 
     def get_last_cmd(self):
@@ -187,6 +239,67 @@ class FakeTransport(BaseTransport):
         return data
 
 
+class ReplayTransport(BaseTransport):
+    '''
+    Feed inbound frames of a capture to ZiGate,
+    speed 1 for real time, N for N times faster, 0 for as fast as possible
+    outbound frames are only recorded in sent, ZiGate doesn't get status
+    '''
+    def __init__(self, path, speed=1.0, rotated=True, auto_start=True):
+        BaseTransport.__init__(self)
+        self.path = path
+        self.speed = speed
+        self.rotated = rotated
+        self.sent = []
+        self.replayed = 0
+        self.finished = threading.Event()
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self.replay, name='ZiGate-Replay')
+        self.thread.daemon = True
+        if auto_start:
+            self.start()
+
+    def start(self):
+        self.thread.start()
+
+    def replay(self):
+        start = None
+        for timestamp, direction, frame in capture.read_captures(self.path, self.rotated):
+            if self._stop.is_set():
+                break
+            if direction != capture.IN:
+                continue
+            if self.speed:
+                if start is None:
+                    start = (timestamp, time.monotonic())
+                delay = (timestamp - start[0]) / self.speed - (time.monotonic() - start[1])
+                if delay > 0 and self._stop.wait(delay):
+                    break
+            self.put_received(frame)
+            self.replayed += 1
+        self.finished.set()
+
+    def wait(self, timeout=None):
+        '''
+        wait until all frames are replayed
+        '''
+        return self.finished.wait(timeout)
+
+    def is_connected(self):
+        return True
+
+    def send(self, data):
+        metrics.FRAMES_OUT.inc()
+        metrics.BYTES_OUT.inc(len(data))
+        if self._capture:
+            self._capture.write(capture.OUT, data)
+        self.sent.append(data)
+
+    def close(self):
+        self._stop.set()
+        self.stop_capture()
+
+
 class ThreadSerialConnection(BaseTransport):
     def __init__(self, device, port=None, search_re='ZiGate|067b:2303|CP2102'):
         BaseTransport.__init__(self)
@@ -213,6 +326,8 @@ class ThreadSerialConnection(BaseTransport):
         return BaseTransport.vid_pid(self)
 
     def reconnect(self, retry=True):
+        if retry:
+            metrics.RECONNECTS.inc()
         delay = 1
         while self._running:
             try:
@@ -252,6 +367,7 @@ class ThreadSerialConnection(BaseTransport):
             while not self.queue.empty():
                 data = self.queue.get()
                 self.serial.write(data)
+                self._write_done(data)
             time.sleep(0.05)
 
     def _find_port(self, port):
@@ -333,6 +449,7 @@ class ThreadSocketConnection(ThreadSerialConnection):
                     data = self.queue.get()
                     try:
                         self.serial.send(data)
+                        self._write_done(data)
                     except OSError:
                         LOGGER.warning('OOPS connection lost, reconnect...')
                         self.reconnect()